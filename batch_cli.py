@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import sys
+import time
+from contextlib import nullcontext
+
+# Headless entry point: nothing here (or in the modules it uses) imports tkinter
+from dedup import MAX_DISTANCE, CropDeduplicator
+from extraction import MIN_CONFIDENCE, RETRY_DPI, extract_to_sink, extraction_spec, file_id, row_columns, run_id
+from instrumentation import Metrics, ThreadProfiler
+from ocr_cache import DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, OCRCache
+from ocr_engine import CROP_MODE, PAGE_MODE, OCRExecutor
+from pdf_pages import DEFAULT_MEMORY_BUDGET_MB, PAGE_COLOR_MODES, LazyPageSource
+from preprocess import THRESHOLD_METHODS, make_settings
+from sinks import StreamingSink
+from templates import load_layouts
+from text_layer import TextLayer
+
+
+def find_pdfs(input_dir, recursive):
+    # Collect the PDFs to process in a stable order
+    pdf_paths = []
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(".pdf"):
+                pdf_paths.append(os.path.join(dirpath, filename))
+        if not recursive:
+            break
+    return pdf_paths
+
+
+class CombinedFileSink:
+    # View of the combined sink for one PDF: adds the File column and records
+    # [file index, page] as the committed position so a combined run resumes mid-file
+
+    def __init__(self, sink, file_index, relative_path):
+        self.sink = sink
+        self.file_index = file_index
+        self.relative_path = relative_path
+        position = sink.position
+        self.position = position[1] if position and position[0] == file_index else 0
+        self.rows_written = 0
+
+    def write(self, rows, position):
+        self.rows_written += len(rows)
+        self.sink.write([{"File": self.relative_path, **row} for row in rows], [self.file_index, position])
+
+
+def extract_pdf(pdf_path, layouts, executor, sink, dpi, region_only, mode, cache, use_text_layer, metrics=None, profiler=None,
+                storage=None, dedup=None, scoring=None):
+    # Stream one PDF's rows into the sink; returns the extraction pipeline for its stats.
+    # storage holds LazyPageSource's page storage options (color_mode, memory_budget_mb, spill),
+    # scoring extract_to_sink's confidence options (confidence, retry_below, retry_dpi).
+    pages = LazyPageSource(pdf_path, dpi=dpi, **(storage or {}))
+    text_layer = TextLayer(pdf_path, len(pages)) if use_text_layer else None
+    return extract_to_sink(executor, pages, layouts, mode, sink, region_only=region_only, cache=cache, text_layer=text_layer,
+                           metrics=metrics, profiler=profiler, dedup=dedup, **(scoring or {}))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run a saved region template over a directory of PDFs.")
+    parser.add_argument("template", help="Region template JSON saved from the GUI")
+    parser.add_argument("input_dir", help="Directory containing the PDFs to process")
+    parser.add_argument("-o", "--output", required=True,
+                        help="Output directory (one file per PDF), or output file with --combined")
+    parser.add_argument("--combined", action="store_true", help="Write every PDF into one sheet with a File column")
+    parser.add_argument("--format", choices=["xlsx", "csv", "parquet"], default="xlsx", help="Output format for per-file output")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="Number of OCR worker processes")
+    parser.add_argument("--server", help="OCR on an ocr_server.py at host:port or unix:/path instead of local workers "
+                                         "(--workers is then the number of batches kept in flight)")
+    parser.add_argument("--warm", action="store_true",
+                        help="Keep tesseract loaded in the local worker processes (needs tesserocr)")
+    parser.add_argument("--dpi", type=int, default=300, help="OCR resolution")
+    parser.add_argument("--full-page", action="store_true", help="Crop from full-page renders instead of rendering regions only")
+    parser.add_argument("--page-colors", choices=PAGE_COLOR_MODES, default="gray",
+                        help="How decoded pages are held: 8-bit gray, 1-bit mono (least memory) or RGB")
+    parser.add_argument("--page-memory-mb", type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help="Decoded pages kept in memory per PDF (with --full-page or page mode)")
+    parser.add_argument("--spill-pages", action="store_true",
+                        help="Move pages over the memory budget to memory-mapped temp files instead of re-rendering them")
+    parser.add_argument("--ocr-mode", choices=[CROP_MODE, PAGE_MODE], default=CROP_MODE,
+                        help="One tesseract call per region crop, or one per page with word boxes assigned to regions")
+    parser.add_argument("--threshold", choices=THRESHOLD_METHODS, default="otsu", help="Binarization method")
+    parser.add_argument("--deskew", action="store_true", help="Straighten slightly rotated crops before OCR")
+    parser.add_argument("--no-despeckle", action="store_true", help="Keep isolated ink pixels")
+    parser.add_argument("--no-trim-border", action="store_true", help="Keep ruling lines along the crop edges")
+    parser.add_argument("--no-skip-empty", action="store_true", help="OCR crops even when they hold (almost) no ink")
+    parser.add_argument("--min-ink-blocks", type=int,
+                        help="Crops whose ink fills fewer 1pt blocks (about a stroke wide) are empty (default 2)")
+    parser.add_argument("--no-text-layer", action="store_true",
+                        help="OCR born-digital pages too instead of reading their embedded text")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="OCR result cache (SQLite file)")
+    parser.add_argument("--cache-size-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Evict least recently used cache entries beyond this size")
+    parser.add_argument("--no-cache", action="store_true", help="OCR every region even if it was extracted before")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="OCR every crop even when an identical one was OCR'd earlier in the batch")
+    parser.add_argument("--dedup-distance", type=int, default=MAX_DISTANCE,
+                        help=f"Perceptual hash bits near-duplicate crops may differ in before their pixels are compared (default {MAX_DISTANCE})")
+    parser.add_argument("--confidence", action="store_true",
+                        help="Add each value's OCR confidence (0-100) and whether it was re-OCR'd to the output")
+    parser.add_argument("--retry-below", type=float, nargs="?", const=MIN_CONFIDENCE,
+                        help=f"OCR regions read with a lower confidence again at --retry-dpi (default {MIN_CONFIDENCE} when given without a value)")
+    parser.add_argument("--retry-dpi", type=int, default=RETRY_DPI, help=f"Resolution of the re-OCR pass (default {RETRY_DPI})")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Start outputs from scratch instead of resuming an interrupted run")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Also process PDFs in subdirectories")
+    parser.add_argument("--report", help="Write a JSON performance report (timings, latency histograms, counters) here")
+    parser.add_argument("--profile", help="Write a cProfile dump of the run here (open with pstats or snakeviz)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    layouts = load_layouts(args.template)
+    if not len(layouts):
+        print(f"Template {args.template} has no regions", file=sys.stderr)
+        return 2
+
+    pdf_paths = find_pdfs(args.input_dir, args.recursive)
+    if not pdf_paths:
+        print(f"No PDF files found in {args.input_dir}", file=sys.stderr)
+        return 2
+
+    if not args.combined:
+        os.makedirs(args.output, exist_ok=True)
+
+    failures = 0
+    start = time.perf_counter()
+
+    cache = None if args.no_cache else OCRCache(args.cache, args.cache_size_mb * 1024 * 1024)
+    # Shared by all files, so pages repeated across the batch are OCR'd once
+    dedup = None if args.no_dedup else CropDeduplicator(args.dedup_distance)
+
+    storage = {"color_mode": args.page_colors, "memory_budget_mb": args.page_memory_mb, "spill": args.spill_pages}
+    scoring = {"confidence": args.confidence, "retry_below": args.retry_below, "retry_dpi": args.retry_dpi}
+    columns = row_columns(layouts, args.confidence)
+    preprocessing = make_settings(
+        threshold=args.threshold,
+        deskew=args.deskew,
+        despeckle=not args.no_despeckle,
+        trim_border=not args.no_trim_border,
+        skip_empty=not args.no_skip_empty,
+        min_ink_blocks=args.min_ink_blocks,
+    )
+
+    # Everything besides the file, regions and DPI that changes the values written, so a run
+    # with other settings starts over instead of appending to rows read differently
+    settings = {"mode": args.ocr_mode, "region_only": not args.full_page, "page_colors": args.page_colors,
+                "text_layer": not args.no_text_layer, "preprocessing": preprocessing, "scoring": scoring}
+
+    combined_sink = None
+    if args.combined:
+        combined_id = json.dumps([[file_id(p) for p in pdf_paths], *extraction_spec(layouts, args.dpi, settings)],
+                                 sort_keys=True)
+        combined_sink = StreamingSink(args.output, ["File"] + columns, combined_id, resume=not args.no_resume)
+
+    metrics = Metrics()
+    profiler = ThreadProfiler() if args.profile else None
+    file_reports = []  # Per-file entries of the performance report
+
+    with OCRExecutor(workers=args.workers, preprocessing=preprocessing, warm=args.warm, server=args.server) as executor, \
+            profiler.thread() if profiler else nullcontext():
+        for file_index, pdf_path in enumerate(pdf_paths):
+            relative_path = os.path.relpath(pdf_path, args.input_dir)
+
+            # Files already completed by an interrupted combined run
+            if combined_sink and combined_sink.position and file_index < combined_sink.position[0]:
+                continue
+
+            try:
+                if combined_sink:
+                    sink = CombinedFileSink(combined_sink, file_index, relative_path)
+                    pipeline = extract_pdf(pdf_path, layouts, executor, sink, args.dpi, not args.full_page,
+                                           args.ocr_mode, cache, not args.no_text_layer, metrics, profiler, storage, dedup,
+                                           scoring)
+                    # Mark the file as done
+                    combined_sink.write([], [file_index + 1, 0])
+                else:
+                    # Flatten subdirectories into the name so recursive runs don't collide
+                    stem = os.path.splitext(relative_path)[0].replace(os.sep, "_")
+                    output_file = os.path.join(args.output, f"{stem}.{args.format}")
+                    extraction_id = run_id(pdf_path, layouts, args.dpi, settings)
+                    with StreamingSink(output_file, columns, extraction_id, resume=not args.no_resume) as sink:
+                        pipeline = extract_pdf(pdf_path, layouts, executor, sink, args.dpi, not args.full_page,
+                                               args.ocr_mode, cache, not args.no_text_layer, metrics, profiler, storage,
+                                               dedup, scoring)
+                        with metrics.timer("export"):
+                            sink.close()
+            except Exception as e:
+                failures += 1
+                metrics.count("files_failed")
+                file_reports.append({"file": relative_path, "error": str(e)})
+                print(f"Failed to process {pdf_path}: {e}", file=sys.stderr)
+                continue
+
+            metrics.count("files")
+            file_reports.append({
+                "file": relative_path, "rows": sink.rows_written, "seconds": round(pipeline.elapsed, 3),
+                "pipeline": pipeline.stats(),
+            })
+            print(f"{pdf_path}: {sink.rows_written} values | {pipeline.stats_text()}")
+
+        if combined_sink:
+            with metrics.timer("export"):
+                combined_sink.close()
+
+        elapsed = time.perf_counter() - start
+        print(f"Processed {len(pdf_paths) - failures}/{len(pdf_paths)} files in {elapsed:.1f}s "
+              f"({executor.crops_per_second:.1f} crops/s)")
+        if metrics.counter("regions_skipped_empty"):
+            print(f"Skipped {metrics.counter('regions_skipped_empty')} empty regions without OCR")
+        if dedup and dedup.lookups:
+            print(dedup.stats_text())
+        if metrics.counter("regions_retried"):
+            print(f"Re-OCR'd {metrics.counter('regions_retried')} low-confidence regions at {args.retry_dpi} DPI, "
+                  f"{metrics.counter('regions_improved')} improved")
+        if layouts.anchors_found or layouts.anchors_missed:
+            print(f"Anchors: {layouts.anchors_found} found, {layouts.anchors_missed} not found")
+
+    if cache:
+        print(cache.stats_text())
+        cache.close()
+
+    if args.report:
+        metrics.write_report(
+            args.report,
+            files=file_reports,
+            cache={"hits": cache.hits, "misses": cache.misses} if cache else None,
+            dedup={"crops": dedup.lookups, "reused": dedup.reused, "ratio": round(dedup.ratio, 3)} if dedup else None,
+            anchors={"found": layouts.anchors_found, "not_found": layouts.anchors_missed},
+            settings={
+                "mode": args.ocr_mode, "region_only": not args.full_page, "workers": args.workers, "server": args.server,
+                "dpi": args.dpi, "preprocessing": preprocessing, "retry_below": args.retry_below,
+                "retry_dpi": args.retry_dpi,
+            },
+        )
+        print(f"Performance report written to {args.report}")
+    if profiler:
+        profiler.dump(args.profile)
+        print(f"Profile written to {args.profile}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
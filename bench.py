@@ -0,0 +1,431 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from difflib import SequenceMatcher
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+
+from extraction import ROW_COLUMNS, extract_to_sink, render_crops, results_to_rows, row_columns
+from instrumentation import peak_rss_mb
+from layouts import PageLayouts
+from ocr_engine import CROP_MODE, PAGE_MODE, OCRExecutor, recognize
+from pdf_pages import LazyPageSource
+from preprocess import make_settings, preprocess_crops
+from sinks import StreamingSink
+from templates import load_layouts
+from text_layer import TextLayer
+
+
+PAGE_WIDTH = 612.0  # US Letter, in points
+PAGE_HEIGHT = 792.0
+FONT_SIZE = 12  # Points
+DOCUMENT_KINDS = ("scanned", "text")
+STAGES = ("rasterize", "crop", "preprocess", "ocr", "text_layer", "export", "end_to_end", "startup")
+STARTUP_SCRIPTS = ("v1", "v2", "v3", "v4", "batch_cli")
+LAZY_MODULES = ("pandas", "pytesseract", "pdf2image")  # Imported on first use, never at startup
+IMPORT_BUDGET_MS = 400  # Default import-time budget per script
+WORDS = ["Invoice", "Total", "Amount", "Due", "Date", "Customer", "Account", "Order", "Tax", "Net", "Paid", "Balance"]
+
+
+def normalize_text(text):
+    # Compare text ignoring differences in whitespace and line breaks
+    return " ".join(text.split())
+
+
+def time_mode(pdf_path, layouts, mode, workers, dpi, region_only):
+    # A fresh page source per run so one mode doesn't profit from pages cached by the other
+    pages = LazyPageSource(pdf_path, dpi=dpi)
+    texts = {}
+
+    def on_result(result):
+        page_num, region_index, text = result[:3]
+        texts[page_num, region_index] = normalize_text(text) if isinstance(text, str) else text
+
+    with tempfile.TemporaryDirectory() as workdir, OCRExecutor(workers=workers) as executor, \
+            StreamingSink(os.path.join(workdir, "compare.csv"), row_columns(layouts), resume=False) as sink:
+        start = time.perf_counter()
+        extract_to_sink(executor, pages, layouts, mode, sink, region_only=region_only, progress=on_result)
+        elapsed = time.perf_counter() - start
+    return texts, elapsed
+
+
+def compare_modes(pdf_path, layouts, workers, dpi, region_only):
+    # Per-crop OCR is the reference; page mode is scored by how closely its text matches it
+    crop_texts, crop_seconds = time_mode(pdf_path, layouts, CROP_MODE, workers, dpi, region_only)
+    page_texts, page_seconds = time_mode(pdf_path, layouts, PAGE_MODE, workers, dpi, region_only)
+
+    similarities = [SequenceMatcher(None, text, page_texts.get(key, "")).ratio() for key, text in crop_texts.items()]
+    exact = sum(1 for key, text in crop_texts.items() if page_texts.get(key) == text)
+    crops = len(crop_texts)
+
+    return {
+        "pdf": pdf_path,
+        "regions": len(layouts),
+        "crops": crops,
+        CROP_MODE: {"seconds": round(crop_seconds, 3), "crops_per_second": round(crops / crop_seconds, 2) if crop_seconds else 0.0},
+        PAGE_MODE: {"seconds": round(page_seconds, 3), "crops_per_second": round(crops / page_seconds, 2) if page_seconds else 0.0},
+        "speedup": round(crop_seconds / page_seconds, 2) if page_seconds else 0.0,
+        "mean_similarity": round(sum(similarities) / len(similarities), 4) if similarities else 1.0,
+        "exact_matches": exact,
+    }
+
+
+def region_boxes(region_count):
+    # Field-sized boxes (PDF points) in two columns down the page
+    height, gap, margin = 24.0, 8.0, 54.0
+    per_column = int((PAGE_HEIGHT - 2 * margin) // (height + gap))
+    if region_count > 2 * per_column:
+        raise ValueError(f"At most {2 * per_column} regions fit on a synthetic page")
+    boxes = []
+    for i in range(region_count):
+        x = margin if i < per_column else PAGE_WIDTH / 2 + 12
+        y = margin + (i % per_column) * (height + gap)
+        boxes.append((x, y, x + 220.0, y + height))
+    return boxes
+
+
+def field_texts(page_count, boxes, seed=0):
+    # Deterministic field values per page and region, so runs are comparable
+    rng = random.Random(seed)
+    return [
+        [f"{rng.choice(WORDS)} {rng.randint(1000, 99999)}-{page_num + 1}" for _ in boxes]
+        for page_num in range(page_count)
+    ]
+
+
+def pdf_string(text):
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def write_text_pdf(path, boxes, texts):
+    # Born-digital PDF: the field values as real text (Helvetica), no images
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Page tree, written once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for page_texts in texts:
+        content = "".join(
+            f"BT /F1 {FONT_SIZE} Tf {box[0] + 4:.2f} {PAGE_HEIGHT - box[1] - 4 - FONT_SIZE:.2f} Td {pdf_string(text)} Tj ET\n"
+            for box, text in zip(boxes, page_texts)
+        ).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"endstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % (PAGE_WIDTH, PAGE_HEIGHT, len(objects))
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{object_id} 0 R" for object_id in page_ids).encode("ascii")
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for object_id, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % object_id + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+def write_scanned_pdf(path, boxes, texts, dpi, seed=0):
+    # Image-only PDF like a scanner produces: the same field values drawn on noisy gray pages
+    scale = dpi / 72.0
+    size = (int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale))
+    try:
+        font = ImageFont.load_default(size=int(FONT_SIZE * scale))
+    except TypeError:  # Pillow < 10.1 has only the small bitmap font
+        font = ImageFont.load_default()
+    rng = np.random.default_rng(seed)
+
+    images = []
+    for page_texts in texts:
+        noise = rng.normal(235, 12, (size[1], size[0])).clip(0, 255).astype(np.uint8)
+        image = Image.fromarray(noise, "L")
+        draw = ImageDraw.Draw(image)
+        for box, text in zip(boxes, page_texts):
+            draw.text(((box[0] + 4) * scale, (box[1] + 4) * scale), text, fill=20, font=font)
+        images.append(image)
+    images[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+
+
+def make_document(workdir, kind, page_count, dpi, region_count):
+    # Generate (or reuse) a synthetic PDF for a scenario; returns its path, boxes and field values
+    boxes = region_boxes(region_count)
+    texts = field_texts(page_count, boxes)
+    path = os.path.join(workdir, f"{kind}-p{page_count}-d{dpi}-r{region_count}.pdf")
+    if not os.path.exists(path):
+        if kind == "text":
+            write_text_pdf(path, boxes, texts)
+        else:
+            write_scanned_pdf(path, boxes, texts, dpi)
+    return path, boxes, texts
+
+
+def time_best(func, repeat):
+    # Best of repeat runs; the minimum is the least noisy estimate of the cost
+    best, result = None, None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def stage_result(seconds, unit, count):
+    return {
+        "seconds": round(seconds, 4),
+        f"{unit}_per_second": round(count / seconds, 2) if seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_scenario(workdir, kind, page_count, dpi, region_count, workers, repeat, stages):
+    # Time each stage of the extraction on one synthetic document. Stages run in pipeline
+    # order on the previous stage's output, so each one is measured on its own.
+    pdf_path, boxes, texts = make_document(workdir, kind, page_count, dpi, region_count)
+    layouts = PageLayouts.uniform(boxes)
+    page_boxes = dict(enumerate(boxes))
+    region_indexes = list(page_boxes)
+    crop_count = page_count * region_count
+    results = {}
+
+    def measure(stage, func, unit, count, needed=False):
+        # Time a selected stage and return its output. A stage that isn't selected still runs once,
+        # untimed, when a later stage needs its output. None when it failed or wasn't run.
+        timed = stage in stages
+        if not timed and not needed:
+            return None
+        try:
+            seconds, output = time_best(func, repeat if timed else 1)
+        except pytesseract.TesseractNotFoundError:
+            results[stage] = {"skipped": "tesseract not found"}
+            return None
+        except Exception as e:
+            results[stage] = {"error": str(e)}
+            return None
+        if timed:
+            results[stage] = stage_result(seconds, unit, count)
+        return output
+
+    def rasterize():
+        # Opening the document is part of the cost, as in the GUI's load_pdf
+        for _ in LazyPageSource(pdf_path, dpi=dpi, cache_size=1):
+            pass
+
+    def crop():
+        pages = LazyPageSource(pdf_path, dpi=dpi)
+        return [render_crops(pages, page_boxes, page_num, region_indexes) for page_num in range(page_count)]
+
+    settings = make_settings()
+    measure("rasterize", rasterize, "pages", page_count)
+    crops = measure("crop", crop, "crops", crop_count, needed="preprocess" in stages or "ocr" in stages)
+    if crops is not None:
+        binarized = measure("preprocess", lambda: [preprocess_crops(page, settings, dpi=dpi)[0] for page in crops],
+                            "crops", crop_count, needed="ocr" in stages)
+        if binarized is not None:
+            # Single-process recognition cost; the end-to-end stage shows what the worker pool adds
+            measure("ocr", lambda: [recognize(page) for page in binarized], "crops", crop_count)
+
+    if kind == "text":
+        def read_text_layer():
+            text_layer = TextLayer(pdf_path, page_count)
+            return [[text_layer.region_text(page_num, box) for box in boxes] for page_num in range(page_count)]
+
+        measure("text_layer", read_text_layer, "crops", crop_count)
+
+    rows = results_to_rows(
+        [(page_num, i, text) for page_num, page_texts in enumerate(texts) for i, text in enumerate(page_texts)],
+        page_boxes, dpi,
+    )
+
+    def export():
+        with StreamingSink(os.path.join(workdir, "export.xlsx"), ROW_COLUMNS, resume=False) as sink:
+            for page_num in range(page_count):
+                sink.write(rows[page_num * region_count:(page_num + 1) * region_count], page_num + 1)
+
+    measure("export", export, "rows", len(rows))
+
+    def end_to_end():
+        text_layer = TextLayer(pdf_path, page_count) if kind == "text" else None
+        with OCRExecutor(workers=workers) as executor, \
+                StreamingSink(os.path.join(workdir, "end_to_end.csv"), ROW_COLUMNS, resume=False) as sink:
+            extract_to_sink(executor, LazyPageSource(pdf_path, dpi=dpi), layouts, CROP_MODE, sink, text_layer=text_layer)
+
+    measure("end_to_end", end_to_end, "pages", page_count)
+    if "end_to_end" in results and "seconds" in results["end_to_end"]:
+        results["end_to_end"]["crops_per_second"] = round(crop_count / results["end_to_end"]["seconds"], 2)
+    return results
+
+
+def time_import(module, repeat):
+    # Import time of a script in a fresh interpreter (best of repeat), and which of the modules
+    # that should load lazily it imported anyway
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"print(json.dumps([elapsed, [name for name in {list(LAZY_MODULES)!r} if name in sys.modules]]))\n"
+    )
+    best, eager = None, []
+    for _ in range(max(1, repeat)):
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        elapsed, eager = json.loads(output.splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best, eager
+
+
+def run_startup(repeat, budget_ms):
+    # Startup cost of each entry script: how long importing it takes before the window (or the
+    # CLI) can do anything. A script is over budget when it takes longer than budget_ms or
+    # imports pandas, pytesseract or pdf2image up front.
+    results = {}
+    for script in STARTUP_SCRIPTS:
+        try:
+            seconds, eager = time_import(script, repeat)
+        except subprocess.CalledProcessError as e:
+            results[script] = {"error": (e.stderr.strip().splitlines() or [str(e)])[-1]}
+            continue
+        results[script] = {
+            "seconds": round(seconds, 4),
+            "eager_imports": eager,
+            "over_budget": seconds * 1000 > budget_ms or bool(eager),
+        }
+    return results
+
+
+def environment():
+    try:
+        tesseract = str(pytesseract.get_tesseract_version())
+    except Exception:
+        tesseract = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "tesseract": tesseract,
+    }
+
+
+def run_suite(kinds, page_counts, dpis, region_counts, workers, repeat, stages, workdir, import_budget_ms=IMPORT_BUDGET_MS):
+    scenarios = {}
+    if "startup" in stages:
+        print("Timing imports...", file=sys.stderr)
+        scenarios["startup"] = run_startup(repeat, import_budget_ms)
+    if not set(stages) - {"startup"}:
+        kinds = []
+    for kind in kinds:
+        for page_count in page_counts:
+            for dpi in dpis:
+                for region_count in region_counts:
+                    name = f"{kind}-p{page_count}-d{dpi}-r{region_count}"
+                    print(f"Running {name}...", file=sys.stderr)
+                    scenarios[name] = run_scenario(workdir, kind, page_count, dpi, region_count, workers, repeat, stages)
+    return {"environment": environment(), "workers": workers, "import_budget_ms": import_budget_ms, "scenarios": scenarios,
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    # (scenario, stage, baseline seconds, seconds, ratio, regressed) for every stage timed in both
+    rows = []
+    for name, stages in report["scenarios"].items():
+        for stage, result in stages.items():
+            before = baseline.get("scenarios", {}).get(name, {}).get(stage, {}).get("seconds")
+            after = result.get("seconds")
+            if not before or after is None:
+                continue
+            ratio = after / before
+            rows.append((name, stage, before, after, ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def print_comparison(rows, tolerance):
+    print(f"{'scenario':<28} {'stage':<12} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for name, stage, before, after, ratio, regressed in rows:
+        flag = "  REGRESSION" if regressed else ("  faster" if ratio < 1 - tolerance else "")
+        print(f"{name:<28} {stage:<12} {before:>10.3f} {after:>10.3f} {ratio:>7.2f}{flag}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks for the extraction hot path.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    modes = commands.add_parser("compare-modes", help="Compare per-crop and per-page OCR for speed and accuracy")
+    modes.add_argument("pdf", help="PDF to extract from")
+    modes.add_argument("template", help="Region template JSON saved from the GUI")
+    modes.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="Number of OCR worker processes")
+    modes.add_argument("--dpi", type=int, default=300, help="OCR resolution")
+    modes.add_argument("--full-page", action="store_true", help="Crop from full-page renders instead of rendering regions only")
+
+    suite = commands.add_parser("suite", help="Time every extraction stage on generated synthetic PDFs")
+    suite.add_argument("--kinds", nargs="+", choices=DOCUMENT_KINDS, default=list(DOCUMENT_KINDS),
+                       help="Scanned-like (image-only) and/or born-digital (text layer) documents")
+    suite.add_argument("--pages", nargs="+", type=int, default=[10], help="Page counts to test")
+    suite.add_argument("--dpi", nargs="+", type=int, default=[300], help="OCR resolutions to test")
+    suite.add_argument("--regions", nargs="+", type=int, default=[8], help="Region counts to test")
+    suite.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to time")
+    suite.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="OCR workers for the end-to-end stage")
+    suite.add_argument("--repeat", type=int, default=3, help="Runs per stage; the fastest is reported")
+    suite.add_argument("--workdir", help="Directory for the generated PDFs (kept and reused between runs)")
+    suite.add_argument("-o", "--output", help="Write the JSON report to this file")
+    suite.add_argument("--baseline", help="Compare against a stored report and fail on regressions")
+    suite.add_argument("--import-budget-ms", type=int, default=IMPORT_BUDGET_MS,
+                       help="Fail when importing an entry script takes longer, or loads pandas/pytesseract/pdf2image")
+    suite.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "compare-modes":
+        layouts = load_layouts(args.template)
+        report = compare_modes(args.pdf, layouts, args.workers, args.dpi, not args.full_page)
+        print(json.dumps(report, indent=2))
+
+    elif args.command == "suite":
+        workdir = args.workdir or tempfile.mkdtemp(prefix="pdf_extractor_bench_")
+        os.makedirs(workdir, exist_ok=True)
+        report = run_suite(args.kinds, args.pages, args.dpi, args.regions, args.workers, args.repeat, args.stages, workdir,
+                           args.import_budget_ms)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+            rows = compare_to_baseline(report, baseline, args.tolerance)
+            print_comparison(rows, args.tolerance)
+            if any(row[-1] for row in rows):
+                return 1
+
+        over_budget = [script for script, result in report["scenarios"].get("startup", {}).items() if result.get("over_budget")]
+        if over_budget:
+            print(f"Import budget of {args.import_budget_ms} ms exceeded (or heavy modules imported at startup) by: "
+                  f"{', '.join(over_budget)}", file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
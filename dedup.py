@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+HASH_SIZE = 8  # Difference hashes are taken on an 8 x 9 thumbnail: 64 bits
+MAX_DISTANCE = 6  # Hash bits in which two crops may differ and still be compared pixel by pixel
+MAX_SHIFT = 1  # Pixels a duplicate may be offset by in each direction
+MAX_MEMORY_MB = 128  # Crops kept for comparison; the least recently used are forgotten beyond this
+
+KNOWN = "known"  # An equal crop was OCR'd before: its result is returned
+WAIT = "wait"  # An equal crop is being OCR'd by the same run: the waiter gets its result
+NEW = "new"  # Not seen before: OCR it and resolve() the token with the result
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def difference_hashes(images):
+    # 64-bit perceptual hashes of a batch of crops. Each crop is shrunk to a gray thumbnail
+    # one column wider than the grid, and each bit tells whether a cell is darker than its
+    # right neighbour, so the hash follows the layout of the ink, not its exact pixels.
+    thumbnails = np.stack([
+        np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX), dtype=np.int16)
+        for image in images
+    ])
+    bits = thumbnails[:, :, :-1] < thumbnails[:, :, 1:]
+    return np.packbits(bits.reshape(len(images), -1), axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def hash_distances(hashes, value):
+    # Hamming distance of every hash in an array to one hash
+    return _POPCOUNT[(hashes ^ np.uint64(value)).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def same_ink(a, b, max_shift=MAX_SHIFT):
+    # Whether two binarized crops of the same shape show exactly the same ink, allowing the whole
+    # crop to be offset by up to max_shift pixels. Any tolerance for differing pixels would depend
+    # on the stroke width, and at low DPI a single pixel tells "5" from "6" or "." from ",".
+    if a.sum() != b.sum():
+        return False
+    # The padding keeps ink shifted past an edge from wrapping around
+    a = np.pad(a, max_shift)
+    b = np.pad(b, max_shift)
+    return any(
+        np.array_equal(a, np.roll(b, (dy, dx), axis=(0, 1)))
+        for dy in range(-max_shift, max_shift + 1) for dx in range(-max_shift, max_shift + 1)
+    )
+
+
+class CropDeduplicator:
+    # Reuses OCR results between crops that show the same thing: repeated cover sheets, terms
+    # pages and duplicated scans in a batch are OCR'd once. Crops are looked up by perceptual
+    # hash among earlier crops of the same shape and field settings (the context), and a hash
+    # match is only taken when the binarized pixels are equal (see same_ink), so different values
+    # never share a result. Safe to share between pipeline threads and between the files of a batch.
+
+    def __init__(self, max_distance=MAX_DISTANCE, max_memory_mb=MAX_MEMORY_MB):
+        self.max_distance = max_distance
+        self.max_bytes = max_memory_mb * 1024 * 1024
+        self.lookups = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._buckets = {}  # (context, shape) -> {"entries": [...], "hashes": array or None}
+        self._entries = OrderedDict()  # id(entry) -> entry, least recently used first
+        self._bytes = 0
+
+    @property
+    def ratio(self):
+        return self.reused / self.lookups if self.lookups else 0.0
+
+    def stats_text(self):
+        return f"Duplicates: {self.reused} of {self.lookups} crops reused ({100.0 * self.ratio:.0f}%)"
+
+    def claim(self, images, context, waiters, owner):
+        # Look up binarized crops that share a context (anything hashable the OCR result depends
+        # on besides the pixels). Returns (status, value) per crop: (KNOWN, result), (WAIT, None)
+        # when an equal crop of the same owner (one extraction run) is in flight, in which case
+        # its waiter is handed back by resolve(), or (NEW, token).
+        hashes = difference_hashes(images)
+        claims = []
+        with self._lock:
+            for image, value, waiter in zip(images, hashes, waiters):
+                self.lookups += 1
+                pixels = np.asarray(image.convert("L")) < 128
+                bucket = self._buckets.setdefault((context, pixels.shape), {"entries": [], "hashes": None})
+                entry = self._match(bucket, value, pixels, owner)
+                if entry is None:
+                    entry = {"bucket": bucket, "hash": int(value), "bits": np.packbits(pixels), "shape": pixels.shape,
+                             "result": None, "owner": owner, "waiters": []}
+                    self._add(entry)
+                    claims.append((NEW, entry))
+                    continue
+                self.reused += 1
+                self._entries.move_to_end(id(entry))
+                if entry["result"] is not None:
+                    claims.append((KNOWN, entry["result"]))
+                else:
+                    entry["waiters"].append(waiter)
+                    claims.append((WAIT, None))
+        return claims
+
+    def resolve(self, token, result):
+        # Store the OCR result of a NEW crop; returns the waiters of the crops equal to it
+        with self._lock:
+            token["result"] = result
+            waiters, token["waiters"] = token["waiters"], []
+            self._evict()
+        return waiters
+
+    def release(self, owner):
+        # Forget the owner's crops that never got a result (a cancelled or failed run), so later
+        # runs don't wait for them
+        with self._lock:
+            for entry in list(self._entries.values()):
+                if entry["owner"] is owner and entry["result"] is None:
+                    self._remove(entry)
+
+    def _match(self, bucket, value, pixels, owner):
+        entries = bucket["entries"]
+        if not entries:
+            return None
+        if bucket["hashes"] is None:
+            bucket["hashes"] = np.array([entry["hash"] for entry in entries], dtype=np.uint64)
+        distances = hash_distances(bucket["hashes"], value)
+        for k in np.argsort(distances, kind="stable"):
+            if distances[k] > self.max_distance:
+                break
+            entry = entries[k]
+            # Another run's crop still in flight can't be waited for; this one is OCR'd again
+            if entry["result"] is None and entry["owner"] is not owner:
+                continue
+            if same_ink(np.unpackbits(entry["bits"], count=pixels.size).reshape(pixels.shape).astype(bool), pixels):
+                return entry
+        return None
+
+    def _add(self, entry):
+        entry["bucket"]["entries"].append(entry)
+        entry["bucket"]["hashes"] = None
+        self._entries[id(entry)] = entry
+        self._bytes += entry["bits"].nbytes
+
+    def _remove(self, entry):
+        entry["bucket"]["entries"].remove(entry)
+        entry["bucket"]["hashes"] = None
+        del self._entries[id(entry)]
+        self._bytes -= entry["bits"].nbytes
+
+    def _evict(self):
+        # Crops still waiting for their OCR result are kept
+        for entry in list(self._entries.values()):
+            if self._bytes <= self.max_bytes:
+                break
+            if entry["result"] is not None:
+                self._remove(entry)
@@ -0,0 +1,503 @@
+import json
+import os
+import threading
+
+from dedup import KNOWN, NEW
+from fields import checkbox_text, field_options, parse_value
+from instrumentation import Metrics
+from layouts import as_layouts
+from ocr_engine import PAGE_MODE
+from pdf_pages import points_to_pixels
+from pipeline import Pipeline
+from preprocess import make_settings, preprocess_crops, settings_id
+from sinks import PageCommitter
+from tables import assemble_table, decode_table, table_cells, table_from_words
+
+
+ROW_COLUMNS = ["Page", "Extracted Data", "Region"]
+CONFIDENCE_COLUMNS = ["Confidence", "Re-OCR"]  # Mean word confidence (0-100) and whether the second pass read it
+
+RASTERIZE_THREADS = 2  # Concurrent pdftoppm renders in the pipeline
+PREPROCESS_THREADS = 2
+OCR_JOB_CROPS = 16  # Crops per OCR job; a page with more (a table's cells) is spread over several workers
+MIN_CONFIDENCE = 60  # Default retry threshold: regions read with a lower confidence are OCR'd again
+RETRY_DPI = 450  # Default resolution of that second pass
+ALTERNATE_THRESHOLD = {"otsu": "adaptive", "adaptive": "otsu", "fixed": "adaptive"}  # Tried when the retry DPI alone doesn't help
+
+
+def table_columns(count):
+    # Sheet columns holding a table's cells, left to right
+    return ["Extracted Data"] + [f"Column {k}" for k in range(2, count + 1)]
+
+
+def row_columns(layouts, confidence=False):
+    # Sheet columns for the regions of layouts: tables add columns after ROW_COLUMNS for their
+    # second and later cells, and confidence adds CONFIDENCE_COLUMNS at the end
+    counts = [field_options(region)["columns"] for region in as_layouts(layouts).regions if region.get("type") == "table"]
+    columns = ROW_COLUMNS + table_columns(max(counts))[1:] if counts else list(ROW_COLUMNS)
+    return columns + CONFIDENCE_COLUMNS if confidence else columns
+
+
+def render_crops(pages, boxes, page_num, region_indexes, region_only=True, dpis=None):
+    # Images of the given regions of one page; boxes maps region indexes to the page's boxes
+    dpi = pages.dpi
+    if region_only:
+        # Render just the clip box of each region at the OCR DPI, or at the region's own DPI
+        # from dpis ({region_index: dpi or None}) when its field type sets one
+        dpis = dpis or {}
+        return [pages.render_region(page_num, boxes[i], dpis.get(i) or dpi) for i in region_indexes]
+
+    # Crop the page image to the selected areas
+    image = pages[page_num]
+    return [image.crop(points_to_pixels(boxes[i], dpi)) for i in region_indexes]
+
+
+def render_page(pages, boxes, page_num, region_indexes, region_only=True):
+    # Image for page-mode OCR and the regions' pixel boxes in it. With region_only the page is
+    # rasterized only over the union of the regions, and the regions are shifted into that clip.
+    dpi = pages.dpi
+    pixel_regions = [points_to_pixels(boxes[i], dpi) for i in region_indexes]
+    if not region_only:
+        return pages[page_num], pixel_regions
+
+    clip = union_box([boxes[i] for i in region_indexes])
+    clip_x, clip_y = points_to_pixels(clip, dpi)[:2]
+    pixel_regions = [(x0 - clip_x, y0 - clip_y, x1 - clip_x, y1 - clip_y) for x0, y0, x1, y1 in pixel_regions]
+    return pages.render_region(page_num, clip, dpi), pixel_regions
+
+
+def union_box(boxes):
+    # Smallest box containing all the given boxes
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+class ResultLookup:
+    # Answers regions without rasterizing or OCR'ing them: from the PDF's own text layer, then
+    # from the OCR cache of regions already recognized under the same settings. fields holds the
+    # field_options() of every region when they are read as typed fields. With scoring (an id
+    # of the confidence settings) results are cached with their (confidence, re-OCR'd) scores,
+    # which cache hits put into scores.
+
+    def __init__(self, executor, pages, mode, cache=None, text_layer=None, fields=None, scoring=None, scores=None,
+                 region_only=True):
+        self.executor = executor
+        self.pages = pages
+        self.mode = mode
+        self.region_only = region_only
+        self.cache = cache
+        self.text_layer = text_layer
+        self.fields = fields
+        self.scoring = scoring
+        self.scores = scores
+        self.document_id = cache.document_id(pages.pdf_path) if cache is not None else None
+
+    def key_for(self, page_num, region_index, box):
+        # Keyed by the box actually read, so regions moved by an anchor are cached separately,
+        # and by everything that changes the pixels tesseract sees or what it returns: the
+        # page color mode, whether only the regions were rendered and the region's field settings
+        mode = f"{self.mode}|{self.pages.color_mode}|{'regions' if self.region_only else 'page'}"
+        if self.fields is not None:
+            mode = f"{mode}|{self.fields[region_index]['id']}"
+        if self.scoring is not None:
+            mode = f"{mode}|{self.scoring}"
+        return self.cache.make_key(self.document_id, page_num, box, self.pages.dpi, mode, self.executor.engine_id)
+
+    def missing(self, page_num, boxes, on_known):
+        # Regions of the page that still need OCR; on_known gets the results of the others
+        missing = []
+        for region_index, box in boxes.items():
+            text = None
+            # Checkboxes are graphics, not text, so they are always read from the image; tables
+            # are split into cells by the positions of their words
+            field_type = self.fields[region_index]["type"] if self.fields is not None else None
+            if self.text_layer is not None and field_type == "table":
+                text = table_from_words(self.text_layer.region_words(page_num, box), box) or None
+            elif self.text_layer is not None and field_type != "checkbox":
+                text = self.text_layer.region_text(page_num, box) or None
+            if text is None and self.cache is not None:
+                text = self.cache.get(self.key_for(page_num, region_index, box))
+                if text is not None and self.scoring is not None:
+                    text, confidence, retried = json.loads(text)
+                    self.scores[page_num, region_index] = (confidence, retried)
+
+            if text is None:
+                missing.append(region_index)
+            else:
+                on_known((page_num, region_index, text))
+
+        if self.text_layer is not None:
+            self.text_layer.release(page_num)
+        return missing
+
+    def remember(self, result, box, score=None):
+        # Store an OCR result in the cache for the next run
+        if self.cache is not None:
+            text = result[2] if self.scoring is None else json.dumps([result[2], *(score or (None, False))])
+            self.cache.put(self.key_for(result[0], result[1], box), text)
+
+
+def file_id(pdf_path):
+    # The file as it is now: a PDF replaced or edited since gets another id
+    stat = os.stat(pdf_path)
+    return [os.path.abspath(pdf_path), stat.st_size, stat.st_mtime]
+
+
+def extraction_spec(layouts, dpi, settings=None):
+    # The regions, their field settings, the DPI and settings (a JSON-able dict of whatever else
+    # changes the values written, such as the OCR mode and preprocessing)
+    layouts = as_layouts(layouts)
+    return [layouts.spec(), [field_options(region)["id"] for region in layouts.regions], dpi, settings]
+
+
+def run_id(pdf_path, layouts, dpi, settings=None):
+    # Identifies an extraction for resuming its output: same file read the same way
+    return json.dumps([*file_id(pdf_path), *extraction_spec(layouts, dpi, settings)], sort_keys=True)
+
+
+def extract_to_sink(executor, pages, layouts, mode, sink, region_only=True, progress=None, cancel_event=None,
+                    cache=None, text_layer=None, metrics=None, profiler=None, dedup=None, confidence=False,
+                    retry_below=None, retry_dpi=RETRY_DPI):
+    # Stream the extraction into a sink page by page, resuming after the sink's committed page.
+    # Rasterizing, preprocessing, OCR and writing run as concurrent pipeline stages, so pdftoppm,
+    # NumPy, tesseract and the writer all work at the same time. Returns the finished Pipeline,
+    # whose stats() show each stage's queue depth and busy time. Per-operation timings and
+    # counters go to metrics; profiler (a ThreadProfiler) also profiles the stage threads.
+    # Each region is read as its field type: crops are OCR'd with the type's PSM, whitelist,
+    # language and DPI, checkboxes from their ink alone, and values are typed for the output.
+    # Tables are split into cells that are OCR'd like regions of their own and put back together
+    # into one result per table. With dedup (a CropDeduplicator, possibly shared by the files of
+    # a batch) crops and page images equal to ones OCR'd before take their result instead.
+    # confidence writes each region's OCR confidence in CONFIDENCE_COLUMNS (the sink needs
+    # row_columns(layouts, True)). With retry_below, regions read with a lower confidence are
+    # rendered again at retry_dpi and re-OCR'd, and the more confident reading is kept.
+    start_page = sink.position or 0
+    metrics = metrics if metrics is not None else Metrics()
+    layouts = as_layouts(layouts)
+    fields = [field_options(region) for region in layouts.regions]
+    scored = confidence or retry_below is not None
+    scores = {}  # (page_num, region_index) -> (confidence, re-OCR'd) of results not yet written
+    scoring = json.dumps([retry_below, retry_dpi if retry_below is not None else None]) if scored else None
+    lookup = ResultLookup(executor, pages, mode, cache, text_layer, fields, scoring, scores, region_only)
+    page_boxes = {}  # page_num -> {region_index: box} for pages not yet written
+
+    def region_count(page_num):
+        boxes = page_boxes.get(page_num)
+        return None if boxes is None else len(boxes)
+
+    def to_rows(page_num, results):
+        # The page is committed: its decoded image (if any) isn't needed any more
+        pages.release(page_num)
+        boxes = page_boxes.pop(page_num)
+        page_scores = {i: scores.pop((page_num, i), None) for i in boxes}
+        return results_to_rows(results, boxes, pages.dpi, fields, page_scores if confidence else None)
+
+    committer = PageCommitter(sink, region_count, to_rows, start_page)
+    pipeline = Pipeline(cancel_event, profiler)
+    ocr_count = [0]
+    # (page_num, region_index) -> [grid shape, {cell: text}, cells still to come, cell confidences]
+    tables = {}
+    tables_lock = threading.Lock()
+    owner = object()  # This run's claim on in-flight crops in dedup
+    engine = (executor.config, settings_id(executor.preprocessing), scored)  # Part of every dedup context
+    retry_settings = [executor.preprocessing, make_settings(**dict(
+        executor.preprocessing, threshold=ALTERNATE_THRESHOLD[executor.preprocessing["threshold"]]))]
+
+    def finish(page_num, key, text, score=None):
+        # Write item for a recognized unit, key = (region_index, cell): the region's result, or
+        # for a table cell None until the table's last cell is in. score is the unit's
+        # (confidence, re-OCR'd); a table's confidence is the mean of its cells'.
+        region_index, cell = key
+        if cell is None:
+            if scored:
+                scores[page_num, region_index] = score or (None, False)
+            return (page_num, region_index, text), True
+        with tables_lock:
+            table = tables[page_num, region_index]
+            table[1][cell] = text
+            if score is not None and score[0] is not None:
+                table[3].append(score[0])
+            table[2] -= 1
+            if table[2]:
+                return None
+            del tables[page_num, region_index]
+        if scored:
+            scores[page_num, region_index] = (sum(table[3]) / len(table[3]) if table[3] else None, False)
+        return (page_num, region_index, assemble_table(table[0], table[1])), True
+
+    def finish_all(page_num, keys, texts, unit_scores=None):
+        for k, (key, text) in enumerate(zip(keys, texts)):
+            item = finish(page_num, key, text, unit_scores[k] if unit_scores else None)
+            if item is not None:
+                yield item
+
+    def rescan(page_num, keys, texts, unit_scores):
+        # Second pass over the regions among recognized units that were read with low
+        # confidence: each is rendered again at retry_dpi and OCR'd with the job's
+        # preprocessing, then with the alternate threshold, keeping the most confident reading.
+        # texts and unit_scores are updated in place. Table cells and checkboxes are left alone.
+        for k, (region_index, cell) in enumerate(keys):
+            field = fields[region_index]
+            confidence = unit_scores[k][0]
+            if cell is not None or field["type"] in ("checkbox", "table") or (field["dpi"] or pages.dpi) >= retry_dpi:
+                continue
+            # A crop that has ink but no readable words is retried; in page mode a region
+            # without words is usually just empty
+            if (confidence is None and mode == PAGE_MODE) or (confidence is not None and confidence >= retry_below):
+                continue
+            metrics.count("regions_retried")
+            with metrics.timer("retry_rasterize"):
+                image = pages.render_region(page_num, page_boxes[page_num][region_index], retry_dpi)
+            best = confidence if confidence is not None else -1.0
+            for settings in retry_settings:
+                with metrics.timer("retry_preprocess"):
+                    images, empty = preprocess_crops([image], settings, dpi=retry_dpi)
+                if empty[0]:
+                    break
+                with metrics.timer("retry_ocr"):
+                    retry_texts, retry_confidences, _ = executor.recognize_scored(images, field["config"], field["lang"])
+                if retry_confidences[0] is not None and retry_confidences[0] > best:
+                    best = retry_confidences[0]
+                    texts[k], unit_scores[k] = retry_texts[0], (best, True)
+                if best >= retry_below:
+                    break
+            if unit_scores[k][1]:
+                metrics.count("regions_improved")
+
+    def claim(page_num, keys, images, context):
+        # Units (crops, or a page image with all its keys) equal to ones OCR'd before are
+        # written with their texts, or with the texts of the equal unit in flight once it is
+        # done. Returns the dedup tokens of the units that need OCR, None for the others.
+        with metrics.timer("dedup"):
+            claims = dedup.claim(images, context, [(page_num, unit_keys) for unit_keys in keys], owner)
+        tokens = []
+        for unit_keys, (status, value) in zip(keys, claims):
+            tokens.append(value if status == NEW else None)
+            if status != NEW:
+                metrics.count("regions_deduplicated", len(unit_keys))
+            if status == KNOWN:
+                for item in finish_all(page_num, unit_keys, *value):
+                    pipeline.put("write", item)
+        return tokens
+
+    def pages_to_do():
+        # Runs in the calling thread: the page's layout is resolved (anchors located) here, and
+        # results known without OCR go straight to the writer
+        for page_num in range(start_page, len(pages)):
+            metrics.count("pages")
+            with metrics.timer("layout"):
+                boxes = page_boxes[page_num] = layouts.page_boxes(pages, page_num)
+            if not boxes:
+                # No regions on this page; let the writer commit it
+                metrics.count("pages_without_regions")
+                pipeline.put("write", (None, False))
+                continue
+            with metrics.timer("lookup"):
+                missing = lookup.missing(page_num, boxes, lambda result: pipeline.put("write", (result, False)))
+            metrics.count("regions_known", len(boxes) - len(missing))
+            if missing:
+                yield page_num, missing, boxes
+
+    def rasterize(job):
+        page_num, region_indexes, boxes = job
+        with metrics.timer("rasterize"):
+            if mode == PAGE_MODE:
+                image, pixel_regions = render_page(pages, boxes, page_num, region_indexes, region_only)
+                crops = {i: image.crop(box) for i, box in zip(region_indexes, pixel_regions)
+                         if fields[i]["type"] in ("checkbox", "table")}
+                dpis = {}
+            else:
+                dpis = {i: fields[i]["dpi"] for i in region_indexes}
+                images = render_crops(pages, boxes, page_num, region_indexes, region_only, dpis)
+                crops = dict(zip(region_indexes, images))
+
+        # What goes on to OCR, as keys (region_index, cell) with a crop image each, or in page
+        # mode a pixel box in the page image. Checkboxes are read from the raw crop and never
+        # reach OCR; tables are split into the cells that hold text.
+        keys, units = [], []
+        for k, i in enumerate(region_indexes):
+            field_type = fields[i]["type"]
+            if field_type == "checkbox":
+                with metrics.timer("checkbox"):
+                    text = checkbox_text(crops[i], executor.preprocessing)
+                metrics.count("regions_checkbox")
+                pipeline.put("write", ((page_num, i, text), True))
+            elif field_type == "table":
+                with metrics.timer("table_grid"):
+                    cells, shape = table_cells(crops[i], executor.preprocessing, dpis.get(i) or pages.dpi)
+                metrics.count("table_cells", len(cells))
+                if not cells:
+                    pipeline.put("write", ((page_num, i, ""), True))
+                    continue
+                with tables_lock:
+                    # Cell grid, cell texts, cells still to come and the cells' confidences
+                    tables[page_num, i] = [shape, {}, len(cells), []]
+                for r, c, (x0, y0, x1, y1) in cells:
+                    keys.append((i, (r, c)))
+                    if mode == PAGE_MODE:
+                        dx, dy = pixel_regions[k][:2]
+                        units.append((x0 + dx, y0 + dy, x1 + dx, y1 + dy))
+                    else:
+                        units.append(crops[i].crop((x0, y0, x1, y1)))
+            else:
+                keys.append((i, None))
+                units.append(pixel_regions[k] if mode == PAGE_MODE else images[k])
+
+        if keys and mode == PAGE_MODE:
+            yield page_num, keys, [image], units
+        elif keys:
+            # Big jobs (tables) are split so several OCR workers share them
+            for start in range(0, len(keys), OCR_JOB_CROPS):
+                yield page_num, keys[start:start + OCR_JOB_CROPS], units[start:start + OCR_JOB_CROPS], None
+
+    def preprocess(job):
+        page_num, keys, images, pixel_regions = job
+        keep_geometry = pixel_regions is not None
+        # Crops are rendered at their field's DPI; page images and their clips at the job's
+        dpis = pages.dpi if keep_geometry else [fields[i]["dpi"] or pages.dpi for i, _ in keys]
+        with metrics.timer("preprocess"):
+            images, empty = preprocess_crops(images, executor.preprocessing, keep_geometry, dpis)
+
+        if pixel_regions is not None:
+            if empty[0]:
+                # Nothing on the page clip: every region is empty
+                empty = [True] * len(keys)
+            elif dedup is None:
+                yield page_num, keys, images, pixel_regions, None
+                return
+            else:
+                # The same page image with the same regions reads the same
+                context = ("page", engine, tuple(keys), tuple(tuple(box) for box in pixel_regions))
+                tokens = claim(page_num, [keys], images, context)
+                if tokens[0] is not None:
+                    yield page_num, keys, images, pixel_regions, tokens
+                return
+
+        # Empty crops skip OCR and go straight to the writer as empty text
+        for key, blank in zip(keys, empty):
+            if blank:
+                metrics.count("regions_skipped_empty")
+                item = finish(page_num, key, "")
+                if item is not None:
+                    pipeline.put("write", item)
+        kept = [(key, image) for key, image, blank in zip(keys, images, empty) if not blank]
+        if kept and dedup is not None:
+            # Crops are only equal under the same field settings
+            groups = {}
+            for key, image in kept:
+                groups.setdefault(fields[key[0]]["id"], []).append((key, image))
+            kept = []
+            for field_id, group in groups.items():
+                tokens = claim(page_num, [[key] for key, _ in group], [image for _, image in group],
+                               (engine, field_id))
+                kept += [(key, image, token) for (key, image), token in zip(group, tokens) if token is not None]
+            if kept:
+                yield page_num, [unit[0] for unit in kept], [unit[1] for unit in kept], None, [unit[2] for unit in kept]
+        elif kept:
+            yield page_num, [key for key, _ in kept], [image for _, image in kept], None, None
+
+    def recognize(job):
+        page_num, keys, images, pixel_regions, tokens = job
+        if pixel_regions is not None:
+            with metrics.timer("ocr_page"):
+                if scored:
+                    texts, confidences = executor.recognize_page(images[0], pixel_regions, scored=True)
+                else:
+                    texts, confidences = executor.recognize_page(images[0], pixel_regions), [None] * len(keys)
+            unit_scores = [(confidence, False) for confidence in confidences]
+            if retry_below is not None:
+                rescan(page_num, keys, texts, unit_scores)
+            if tokens is not None:
+                for waiter_page, waiter_keys in dedup.resolve(tokens[0], (texts, unit_scores)):
+                    yield from finish_all(waiter_page, waiter_keys, texts, unit_scores)
+        else:
+            # Crops sharing a field config go to tesseract together. ocr_call includes the
+            # hand-off to the worker process; ocr_crop is tesseract alone.
+            groups = {}
+            for k, (key, image) in enumerate(zip(keys, images)):
+                field = fields[key[0]]
+                token = tokens[k] if tokens is not None else None
+                groups.setdefault((field["config"], field["lang"]), []).append((key, image, token))
+            keys, texts, unit_scores = [], [], []
+            for (config, lang), group in groups.items():
+                group_images = [unit[1] for unit in group]
+                with metrics.timer("ocr_call"):
+                    if scored:
+                        group_texts, confidences, seconds = executor.recognize_scored(group_images, config, lang)
+                    else:
+                        group_texts, seconds = executor.recognize_timed(group_images, config, lang)
+                        confidences = [None] * len(group)
+                for crop_seconds in seconds:
+                    metrics.record("ocr_crop", crop_seconds)
+                group_keys = [unit[0] for unit in group]
+                group_scores = [(confidence, False) for confidence in confidences]
+                if retry_below is not None:
+                    rescan(page_num, group_keys, group_texts, group_scores)
+                keys += group_keys
+                texts += group_texts
+                unit_scores += group_scores
+                # Crops equal to these that came in meanwhile get the same text
+                for (_, _, token), text, score in zip(group, group_texts, group_scores):
+                    if token is not None:
+                        for waiter_page, waiter_keys in dedup.resolve(token, ([text], [score])):
+                            yield from finish_all(waiter_page, waiter_keys, [text], [score])
+        metrics.count("regions_ocr", len(keys))
+        yield from finish_all(page_num, keys, texts, unit_scores)
+
+    def write(item):
+        result, from_ocr = item
+        with metrics.timer("write"):
+            if result is None:
+                committer.commit_ready()
+                return ()
+            if from_ocr:
+                ocr_count[0] += 1
+                lookup.remember(result, page_boxes[result[0]][result[1]], scores.get((result[0], result[1])))
+            committer.add(result)
+        if progress:
+            progress(result)
+        return ()
+
+    # rendering and preprocessing are subprocess / NumPy bound, so a couple of threads each
+    # keep them ahead of OCR; one OCR thread per pool worker keeps every tesseract busy
+    pipeline.add_stage("rasterize", rasterize, threads=RASTERIZE_THREADS)
+    pipeline.add_stage("preprocess", preprocess, threads=PREPROCESS_THREADS)
+    pipeline.add_stage("ocr", recognize, threads=executor.workers)
+    pipeline.add_stage("write", write, skip_when_stopped=False)
+    try:
+        pipeline.run(pages_to_do())
+    finally:
+        if dedup is not None:
+            dedup.release(owner)
+
+    executor.add_stats(ocr_count[0], pipeline.elapsed)
+    return pipeline
+
+
+def results_to_rows(results, boxes, dpi, fields=None, scores=None):
+    # Turn (page_num, region_index, text) results into spreadsheet rows, skipping empty text.
+    # boxes maps region indexes to the boxes the results were read from. With fields (the
+    # regions' field_options()) numbers, dates and checkboxes become typed cell values, and
+    # each row of a table becomes a row of its own with the cells in the table columns. scores
+    # maps region indexes to (confidence, re-OCR'd) for CONFIDENCE_COLUMNS; regions that weren't
+    # OCR'd (text layer, checkboxes) have no score and leave them empty.
+    rows = []
+    for page_num, region_index, text in results:
+        field = fields[region_index] if fields is not None else None
+        extra = {}
+        score = scores.get(region_index) if scores is not None else None
+        if score is not None and score[0] is not None:
+            extra = {"Confidence": round(score[0], 1), "Re-OCR": score[1]}
+        if field is not None and field["type"] == "table":
+            columns = table_columns(field["columns"])
+            for cells in decode_table(text):
+                # Cells past the last column are joined into it
+                cells = cells[:len(columns) - 1] + [" ".join(cells[len(columns) - 1:])]
+                row = {"Page": page_num + 1, "Region": points_to_pixels(boxes[region_index], dpi), **extra}
+                row.update((column, cell) for column, cell in zip(columns, cells) if cell)
+                rows.append(row)
+            continue
+        text = text.strip()
+        if text:
+            value = parse_value(text, field) if field is not None else text
+            rows.append({"Page": page_num + 1, "Extracted Data": value, "Region": points_to_pixels(boxes[region_index], dpi), **extra})
+    return rows
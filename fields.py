@@ -0,0 +1,131 @@
+import json
+import re
+from datetime import datetime
+
+import numpy as np
+
+
+# What each region type means for recognition: tesseract page segmentation mode (None keeps
+# tesseract's automatic layout analysis), allowed characters and rendering DPI (None uses the
+# job's OCR DPI). Checkboxes are not OCR'd at all but read from the ink inside the box.
+FIELD_TYPES = {
+    "text": {"psm": None, "whitelist": None, "dpi": None},  # Anything; the original behaviour
+    "block": {"psm": 6, "whitelist": None, "dpi": None},  # A uniform block of text
+    "line": {"psm": 7, "whitelist": None, "dpi": None},  # A single line of text
+    "number": {"psm": 7, "whitelist": "0123456789.,-+()$%", "dpi": None},
+    "date": {"psm": 7, "whitelist": "0123456789/-.", "dpi": None},  # Numeric dates
+    "checkbox": {"psm": None, "whitelist": None, "dpi": 100},
+    "table": {"psm": 6, "whitelist": None, "dpi": None},  # Split into cells, each read as a block
+}
+DEFAULT_FIELD_TYPE = "text"
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y", "%m/%d/%Y", "%d/%m/%y", "%d.%m.%y", "%Y%m%d")
+
+# One number with an optional sign or brackets, currency symbol and percent sign around it;
+# whitespace is allowed between those parts but not inside the digits
+NUMBER_PATTERN = re.compile(
+    r"\s*(?P<open>\()?\s*(?P<sign>[-+])?\s*[$€£¥]?\s*(?P<sign2>[-+])?\s*(?P<digits>\d(?:[\d.,]*\d)?)"
+    r"\s*[$€£¥]?\s*(?P<percent>%)?\s*(?P<trailing>-)?\s*(?P<close>\))?\s*"
+)
+
+CHECKED = "checked"
+UNCHECKED = "unchecked"
+CHECKBOX_MIN_FILL = 0.08  # Fraction of the inner box that must be ink for a checkbox to be ticked
+TABLE_COLUMNS = 8  # Sheet columns a table's cells are spread over; further cells join the last one
+
+
+def field_options(region):
+    # Recognition settings of a region from its type, with the region's own overrides
+    field_type = region.get("type") or DEFAULT_FIELD_TYPE
+    if field_type not in FIELD_TYPES:
+        raise ValueError(f"Unknown field type: {field_type}")
+    spec = FIELD_TYPES[field_type]
+
+    config = []
+    if spec["psm"] is not None:
+        config.append(f"--psm {spec['psm']}")
+    if spec["whitelist"]:
+        config.append(f"-c tessedit_char_whitelist={spec['whitelist']}")
+    options = {
+        "type": field_type,
+        "config": " ".join(config),
+        "lang": region.get("lang") or None,
+        "dpi": region.get("dpi") or spec["dpi"],
+        "date_format": region.get("date_format"),
+        "columns": region.get("columns") or TABLE_COLUMNS,
+    }
+    # Part of the OCR cache key: the same box read as another type is a different result
+    options["id"] = json.dumps([field_type, options["config"], options["lang"], options["dpi"]])
+    return options
+
+
+def checkbox_text(image, settings):
+    # Ticked when the middle of the box holds enough ink. Only the inner 60% is looked at so
+    # the printed box outline doesn't count; ink is judged against the crop's paper level.
+    gray = np.asarray(image.convert("L"), dtype=np.float64)
+    h, w = gray.shape
+    inner = gray[int(h * 0.2):max(int(h * 0.8), int(h * 0.2) + 1), int(w * 0.2):max(int(w * 0.8), int(w * 0.2) + 1)]
+    if not inner.size:
+        return UNCHECKED
+    paper = np.percentile(gray, 95)
+    fill = (inner < paper - settings["ink_contrast"]).mean()
+    return CHECKED if fill >= CHECKBOX_MIN_FILL else UNCHECKED
+
+
+def parse_number(text):
+    # "1,234.56", "1.234,56", "(12.00)", "-5", "$ 3" -> int or float; "42%" -> 0.42 (a percent
+    # cell's value). None if the text is anything but one number: letters, several numbers
+    # ("1 2", "Qty 3 of 12") or unbalanced brackets.
+    match = NUMBER_PATTERN.fullmatch(text)
+    if match is None or bool(match["open"]) != bool(match["close"]):
+        return None
+    signs = [s for s in (match["sign"], match["sign2"], match["trailing"]) if s]
+    if len(signs) > 1 or (signs and match["open"]):
+        return None
+    negative = bool(match["open"]) or signs == ["-"]
+    digits = match["digits"]
+
+    if "," in digits and "." in digits:
+        # The separator that comes last is the decimal one
+        if digits.rfind(",") > digits.rfind("."):
+            digits = digits.replace(".", "").replace(",", ".")
+        else:
+            digits = digits.replace(",", "")
+    elif "," in digits:
+        # A single comma followed by exactly three digits groups thousands; otherwise it is decimal
+        head, _, tail = digits.rpartition(",")
+        digits = digits.replace(",", "") if len(tail) == 3 and digits.count(",") >= 1 and head else digits.replace(",", ".")
+    elif digits.count(".") > 1:
+        digits = digits.replace(".", "")
+
+    try:
+        value = float(digits) if "." in digits else int(digits)
+    except ValueError:
+        return None
+    if match["percent"]:
+        value = value / 100
+    return -value if negative else value
+
+
+def parse_date(text, date_format=None):
+    cleaned = "".join(text.split())
+    for fmt in [date_format] if date_format else DATE_FORMATS:
+        try:
+            return datetime.strptime(cleaned, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_value(text, options):
+    # Typed cell value of a region's text; text that doesn't parse is kept as it is
+    field_type = options["type"] if options else DEFAULT_FIELD_TYPE
+    if field_type == "number":
+        value = parse_number(text)
+    elif field_type == "date":
+        value = parse_date(text, options["date_format"])
+    elif field_type == "checkbox":
+        value = {CHECKED: True, UNCHECKED: False}.get(text)
+    else:
+        value = None
+    return text if value is None else value
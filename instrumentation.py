@@ -0,0 +1,156 @@
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Upper bounds (milliseconds) of the latency histogram buckets; the last bucket is unbounded
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+def peak_rss_mb():
+    # Peak resident memory of this process or of its largest child (pdftoppm, tesseract)
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class Timing:
+    # Running totals and a bucketed histogram of one kind of operation. Memory stays constant
+    # however many operations are recorded; percentiles are read from the buckets.
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        milliseconds = seconds * 1000.0
+        for i, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if milliseconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of the operations
+        target = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets[:-1]):
+            seen += n
+            if seen >= target:
+                return min(float(HISTOGRAM_BUCKETS_MS[i]), round(self.max * 1000.0, 3))
+        return round(self.max * 1000.0, 3)
+
+    def summary(self):
+        labels = [f"<={bound}" for bound in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 4),
+            "mean_ms": round(self.total * 1000.0 / self.count, 3) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max * 1000.0, 3),
+            "histogram_ms": {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+
+class Metrics:
+    # Timings and counters of one extraction run, recorded from any thread, and the JSON
+    # report built from them
+
+    def __init__(self):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._timings = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = Timing()
+            timing.add(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def report(self, **sections):
+        # sections are added to the report as-is (pipeline stats, cache stats, settings...)
+        with self._lock:
+            report = {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "elapsed_seconds": round(time.perf_counter() - self._start, 3),
+                "peak_rss_mb": peak_rss_mb(),
+                "timings": {name: timing.summary() for name, timing in sorted(self._timings.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+        report.update(sections)
+        return report
+
+    def write_report(self, path, **sections):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**sections), f, indent=2, default=str)
+
+
+class ThreadProfiler:
+    # cProfile dump of a run whose work is spread over threads. Before Python 3.12 a profile
+    # only sees the thread it was enabled in, so each pipeline thread gets its own and they
+    # are merged on dump; from 3.12 the first profile sees every thread and the others are skipped.
+    # OCR itself runs in worker processes, which the per-crop latency histogram covers instead.
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def thread(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profile is already active and sees this thread too
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                self._profiles.append(profile)
+
+    def dump(self, path):
+        # Write the merged profile for pstats / snakeviz
+        with self._lock:
+            profiles = list(self._profiles)
+        if profiles:
+            pstats.Stats(*profiles).dump_stats(path)
@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from dedup import CropDeduplicator
+from extraction import RETRY_DPI, extract_to_sink, row_columns, run_id
+from ocr_cache import OCRCache
+from ocr_engine import OCRExecutor
+from pdf_pages import DEFAULT_MEMORY_BUDGET_MB, LazyPageSource
+from preprocess import load_settings
+from sinks import StreamingSink
+from templates import load_layouts, save_layouts
+from text_layer import TextLayer
+
+
+DEFAULT_QUEUE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pdf_extractor", "queue")
+MAX_CONCURRENT_FILES = 2  # PDFs extracted at the same time; they share the OCR worker pool
+SAVE_INTERVAL = 1.0  # Seconds between state file writes for progress updates
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    # PDFs waiting to be extracted with a template. The queue is persisted to a JSON state file
+    # (and each job's template next to it), so it survives restarts. A job writes its output
+    # through a StreamingSink, so an interrupted job resumes after its last committed page.
+
+    def __init__(self, directory=DEFAULT_QUEUE_DIR):
+        self.directory = directory
+        self.state_path = os.path.join(directory, "queue.json")
+        self._lock = threading.Lock()
+        self._saved = 0.0
+        self.jobs = self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                jobs = json.load(f)["jobs"]
+        except (OSError, ValueError, KeyError):
+            return []
+        for job in jobs:
+            # Jobs that were running when the program stopped continue from their committed pages
+            if job["status"] == RUNNING:
+                job["status"] = PENDING
+        return jobs
+
+    def save(self, force=True):
+        # Write the state file atomically; progress updates (force=False) are throttled
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._saved < SAVE_INTERVAL:
+                return
+            self._saved = now
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = self.state_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "jobs": self.jobs}, f, indent=1)
+            os.replace(temp_path, self.state_path)
+
+    def add(self, pdf_paths, layouts, output_dir, output_format, options):
+        # Queue PDFs to be extracted with layouts into output_dir/<name><output_format>. The
+        # layouts are saved as a template file so the jobs don't depend on the GUI state.
+        template_dir = os.path.join(self.directory, "templates")
+        os.makedirs(template_dir, exist_ok=True)
+        template = os.path.join(template_dir, f"{uuid.uuid4().hex}.json")
+        save_layouts(template, layouts)
+
+        with self._lock:
+            taken = {job["output_file"] for job in self.jobs}
+            for pdf_path in pdf_paths:
+                stem = os.path.splitext(os.path.basename(pdf_path))[0]
+                output_file = os.path.join(output_dir, stem + output_format)
+                n = 2
+                while output_file in taken:
+                    output_file = os.path.join(output_dir, f"{stem}_{n}{output_format}")
+                    n += 1
+                taken.add(output_file)
+                self.jobs.append({
+                    "id": uuid.uuid4().hex,
+                    "pdf_path": os.path.abspath(pdf_path),
+                    "output_file": os.path.abspath(output_file),
+                    "template": template,
+                    "options": options,
+                    "status": PENDING,
+                    "pages": None,
+                    "pages_done": 0,
+                    "rows": 0,
+                    "error": None,
+                })
+        self.save()
+
+    def snapshot(self):
+        # Copies of the jobs, for display
+        with self._lock:
+            return [dict(job) for job in self.jobs]
+
+    def claim_next(self):
+        # The next pending job, marked running; None when there is none
+        with self._lock:
+            for job in self.jobs:
+                if job["status"] == PENDING:
+                    job["status"] = RUNNING
+                    job["error"] = None
+                    claimed = dict(job)
+                    break
+            else:
+                return None
+        self.save()
+        return claimed
+
+    def update(self, job_id, force=True, **changes):
+        with self._lock:
+            for job in self.jobs:
+                if job["id"] == job_id:
+                    job.update(changes)
+        self.save(force)
+
+    def retry(self, job_ids):
+        # Queue failed jobs again; they resume after their committed pages
+        with self._lock:
+            for job in self.jobs:
+                if job["id"] in job_ids and job["status"] == FAILED:
+                    job["status"] = PENDING
+        self.save()
+
+    def remove(self, job_ids):
+        # Drop jobs that aren't running, and the templates of the dropped jobs that no other job
+        # uses. Only those templates are deleted, under the lock, so a template add() has just
+        # written for a job it is about to queue is never taken for an unused one.
+        with self._lock:
+            removed = [job for job in self.jobs if job["id"] in job_ids and job["status"] != RUNNING]
+            self.jobs = [job for job in self.jobs if job["id"] not in job_ids or job["status"] == RUNNING]
+            used = {job["template"] for job in self.jobs}
+            for template in {job["template"] for job in removed} - used:
+                if os.path.exists(template):
+                    os.remove(template)
+        self.save()
+
+
+class JobRunner:
+    # Works through a JobQueue in the background, max_files PDFs at a time. The jobs share the
+    # OCR cache, the duplicate crop index and one OCR worker pool per worker count /
+    # preprocessing settings / OCR server.
+
+    def __init__(self, job_queue, max_files=MAX_CONCURRENT_FILES):
+        self.queue = job_queue
+        self.max_files = max(1, max_files)
+        self.stop_event = threading.Event()
+        self._threads = []
+        self._active = 0  # Worker threads that haven't finished
+        self._executors = {}
+        self._cache = None
+        self._dedup = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        self._active = self.max_files
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.max_files)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        # Running jobs stop after the pages in flight and go back to pending, resumable
+        self.stop_event.set()
+
+    def _work(self):
+        try:
+            while not self.stop_event.is_set():
+                job = self.queue.claim_next()
+                if job is None:
+                    break
+                self._run_job(job)
+        finally:
+            with self._lock:
+                # The last thread out releases the worker processes and the cache
+                self._active -= 1
+                if not self._active:
+                    for executor in self._executors.values():
+                        executor.close()
+                    self._executors = {}
+                    if self._cache is not None:
+                        self._cache.close()
+                        self._cache = None
+                    self._dedup = None
+
+    def _resources(self, options):
+        with self._lock:
+            # Jobs queued by an earlier version may carry settings that have changed since
+            preprocessing = load_settings(options["preprocessing"])
+            key = json.dumps([options["workers"], preprocessing, options.get("server")], sort_keys=True)
+            if key not in self._executors:
+                self._executors[key] = OCRExecutor(workers=options["workers"], preprocessing=preprocessing,
+                                                   server=options.get("server"))
+            if options["use_cache"] and self._cache is None:
+                self._cache = OCRCache()
+            if options.get("dedup", True) and self._dedup is None:
+                self._dedup = CropDeduplicator()
+            cache = self._cache if options["use_cache"] else None
+            return self._executors[key], cache, self._dedup if options.get("dedup", True) else None
+
+    def _run_job(self, job):
+        options = job["options"]
+        pages = None
+        try:
+            executor, cache, dedup = self._resources(options)
+            layouts = load_layouts(job["template"])
+            pages = LazyPageSource(
+                job["pdf_path"], dpi=options["dpi"], color_mode=options.get("page_colors", "gray"),
+                memory_budget_mb=options.get("page_memory_mb", DEFAULT_MEMORY_BUDGET_MB), spill=options.get("spill_pages", False),
+            )
+            text_layer = TextLayer(job["pdf_path"], len(pages)) if options["use_text_layer"] else None
+
+            # Same file, template and DPI as an interrupted run of the job: the sink continues after
+            # its committed page
+            extraction_id = run_id(job["pdf_path"], layouts, pages.dpi)
+            with StreamingSink(job["output_file"], row_columns(layouts, options.get("confidence", False)),
+                               extraction_id) as sink:
+                self.queue.update(job["id"], pages=len(pages), pages_done=sink.position or 0)
+
+                def progress(result):
+                    self.queue.update(job["id"], force=False, pages_done=sink.position or 0, rows=sink.rows_written)
+
+                extract_to_sink(executor, pages, layouts, options["mode"], sink, region_only=options["region_only"],
+                                progress=progress, cancel_event=self.stop_event, cache=cache, text_layer=text_layer, dedup=dedup,
+                                confidence=options.get("confidence", False), retry_below=options.get("retry_below"),
+                                retry_dpi=options.get("retry_dpi", RETRY_DPI))
+                stopped = self.stop_event.is_set()
+                sink.close(keep_progress=stopped)
+            self.queue.update(job["id"], status=PENDING if stopped else DONE, pages_done=sink.position or 0,
+                              rows=sink.rows_written)
+        except Exception as e:
+            self.queue.update(job["id"], status=FAILED, error=str(e))
+        finally:
+            if pages is not None:
+                pages.clear()
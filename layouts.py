@@ -0,0 +1,180 @@
+import hashlib
+
+import numpy as np
+
+from fields import DEFAULT_FIELD_TYPE
+
+
+ANCHOR_DPI = 100  # Anchors are matched on low-resolution renders; a printed label is still distinct
+ANCHOR_MARGIN = 36.0  # How far (in points) around its template position an anchor is searched for
+ANCHOR_MIN_SCORE = 0.6  # Normalized cross-correlation above which the anchor counts as found
+
+
+def parse_pages(spec):
+    # Page selection like "1", "2-", "-3" or "1,4-6" (1-based, inclusive) as (first, last) ranges,
+    # last None meaning "to the end". An empty spec selects every page.
+    if not spec:
+        return [(1, None)]
+    ranges = []
+    for part in str(spec).split(","):
+        part = part.strip()
+        if "-" in part:
+            first, last = part.split("-", 1)
+            ranges.append((int(first) if first.strip() else 1, int(last) if last.strip() else None))
+        elif part:
+            ranges.append((int(part), int(part)))
+    return ranges
+
+
+def page_in(ranges, page_num):
+    # page_num is 0-based like everywhere else in the extraction code
+    page = page_num + 1
+    return any(first <= page and (last is None or page <= last) for first, last in ranges)
+
+
+def make_layout(regions, name="All pages", pages=None, anchors=None, require_anchor=False):
+    # A set of regions for the pages selected by pages. With require_anchor the layout only
+    # applies to pages where its anchors are found, which is how page classes are told apart.
+    return {
+        "name": name,
+        "pages": pages or "",
+        "regions": list(regions),
+        "anchors": list(anchors or []),
+        "require_anchor": bool(require_anchor),
+    }
+
+
+def make_anchor(pages, page_num, box, name="Anchor", dpi=ANCHOR_DPI):
+    # Capture the printed label inside box (PDF points) on a page as an anchor template
+    image = pages.render_region(page_num, box, dpi).convert("L")
+    return {"name": name, "box": tuple(float(v) for v in box), "dpi": dpi, "image": image}
+
+
+def anchor_template(anchor):
+    # Zero-mean template and its norm, computed once per anchor
+    if "_template" not in anchor:
+        template = np.asarray(anchor["image"], dtype=np.float64)
+        template = template - template.mean()
+        anchor["_template"] = (template, np.sqrt((template ** 2).sum()))
+    return anchor["_template"]
+
+
+def window_sums(window, h, w):
+    # Sums of every h x w window of a 2-D array, via an integral image
+    integral = np.zeros((window.shape[0] + 1, window.shape[1] + 1))
+    integral[1:, 1:] = window.cumsum(axis=0).cumsum(axis=1)
+    return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+
+def match_template(window, template, template_norm):
+    # Normalized cross-correlation of a zero-mean template at every position inside window,
+    # all positions at once: the correlation through one FFT product, the local window
+    # statistics through integral images. Returns (score, y, x) of the best match.
+    H, W = window.shape
+    h, w = template.shape
+    if h > H or w > W or template_norm == 0:
+        return 0.0, 0, 0
+
+    spectrum = np.fft.rfft2(window, s=(H, W)) * np.fft.rfft2(template[::-1, ::-1], s=(H, W))
+    correlation = np.fft.irfft2(spectrum, s=(H, W))[h - 1:, w - 1:]
+
+    n = h * w
+    sums = window_sums(window, h, w)
+    variance = window_sums(window ** 2, h, w) - sums ** 2 / n
+    denominator = template_norm * np.sqrt(np.maximum(variance, 0))
+    scores = np.where(denominator > 1e-6, correlation / np.maximum(denominator, 1e-6), 0.0)
+
+    y, x = np.unravel_index(np.argmax(scores), scores.shape)
+    return float(scores[y, x]), int(y), int(x)
+
+
+def locate_anchor(pages, page_num, anchor, margin=ANCHOR_MARGIN):
+    # Offset (dx, dy) in points of the anchor on this page relative to its template position,
+    # or None when it isn't found
+    dpi = anchor["dpi"]
+    scale = dpi / 72.0
+    x0, y0, x1, y1 = anchor["box"]
+    width, height = pages.page_size(page_num)
+    search = (max(x0 - margin, 0.0), max(y0 - margin, 0.0), min(x1 + margin, width), min(y1 + margin, height))
+
+    window = np.asarray(pages.render_region(page_num, search, dpi).convert("L"), dtype=np.float64)
+    template, template_norm = anchor_template(anchor)
+    score, y, x = match_template(window, template, template_norm)
+    if score < ANCHOR_MIN_SCORE:
+        return None
+
+    # Renders start at their box's pixel origin rounded like points_to_pixels does, both for
+    # the search window and for the anchor image itself
+    dx = int(round(search[0] * scale)) + x - int(round(x0 * scale))
+    dy = int(round(search[1] * scale)) + y - int(round(y0 * scale))
+    return dx / scale, dy / scale
+
+
+def shift_box(box, dx, dy):
+    return (box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy)
+
+
+class PageLayouts:
+    # Which regions apply to each page. Layouts are tried in order; the first one whose page
+    # selection includes the page (and whose anchors are found, if it requires them) is used.
+    # Regions are numbered across all layouts, so a result's region index is unambiguous.
+    # When a layout has anchors, its regions move with them on pages that are shifted.
+
+    def __init__(self, layouts):
+        self.layouts = layouts
+        self.regions = []  # Every region of every layout; region indexes refer to this list
+        self._indexes = []  # Per layout: its regions' indexes
+        self._ranges = []
+        for layout in layouts:
+            start = len(self.regions)
+            self.regions.extend(layout["regions"])
+            self._indexes.append(range(start, len(self.regions)))
+            self._ranges.append(parse_pages(layout["pages"]))
+        self.anchors_found = 0
+        self.anchors_missed = 0
+
+    @classmethod
+    def uniform(cls, boxes):
+        # The same boxes on every page
+        return cls([make_layout([{"name": f"Region {i + 1}", "box": tuple(box)} for i, box in enumerate(boxes)])])
+
+    def __len__(self):
+        return len(self.regions)
+
+    def spec(self):
+        # JSON-able description of everything that decides the regions, for run ids
+        return [
+            [layout["name"], layout["pages"], [[list(region["box"]), region.get("type", DEFAULT_FIELD_TYPE), region.get("lang"), region.get("dpi"), region.get("date_format"),
+               region.get("columns")]
+              for region in layout["regions"]],
+             [[list(anchor["box"]), hashlib.sha256(anchor["image"].tobytes()).hexdigest()[:16]] for anchor in layout["anchors"]],
+             layout["require_anchor"]]
+            for layout in self.layouts
+        ]
+
+    def page_boxes(self, pages, page_num):
+        # Boxes (PDF points) of the regions on a page, as {region index: box}; empty when no
+        # layout applies to the page
+        for layout_index, layout in enumerate(self.layouts):
+            if not page_in(self._ranges[layout_index], page_num):
+                continue
+
+            offsets = [locate_anchor(pages, page_num, anchor) for anchor in layout["anchors"]]
+            found = [offset for offset in offsets if offset is not None]
+            self.anchors_found += len(found)
+            self.anchors_missed += len(offsets) - len(found)
+            if layout["require_anchor"] and (not offsets or len(found) < len(offsets)):
+                continue
+
+            # Anchors found on the page move all the layout's regions by their mean offset
+            dx = sum(offset[0] for offset in found) / len(found) if found else 0.0
+            dy = sum(offset[1] for offset in found) / len(found) if found else 0.0
+            return {i: shift_box(self.regions[i]["box"], dx, dy) for i in self._indexes[layout_index]}
+        return {}
+
+
+def as_layouts(boxes):
+    # Accept either PageLayouts or a plain list of boxes applied to every page
+    if isinstance(boxes, PageLayouts):
+        return boxes
+    return PageLayouts.uniform(boxes)
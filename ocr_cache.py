@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pdf_extractor", "ocr_cache.sqlite3")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+BUSY_TIMEOUT = 30.0  # Seconds to wait for another process's (or cache's) write to finish
+TOUCH_EVERY = 200  # Cache hits whose last-used time is written to the database together
+
+
+def file_hash(path):
+    # Hash the PDF content, so a renamed or copied file still hits the cache
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OCRCache:
+    # On-disk cache of OCR results, keyed by everything that can change the text of a region:
+    # document content, page, region, DPI, engine mode, preprocessing and tesseract version/config.
+    # Least recently used entries are evicted once the cache grows past max_bytes. Several caches
+    # (the GUI, its job queue, batch_cli runs) may use the same file at once: it is in WAL mode,
+    # so readers never wait, and every write is its own short transaction.
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._touched = {}  # key -> last-used time of hits not yet written
+        self._document_ids = {}  # (path, size, mtime) -> content hash
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Lookups and stores may come from different pipeline threads, so access is serialized
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # A commit in WAL mode doesn't need to reach the disk before returning; a crash can only
+        # lose the last results, which are OCR'd again
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self.evict()
+                self._db.close()
+                self._db = None
+
+    def document_id(self, pdf_path):
+        # Hashing a large PDF takes a while, so remember it while the file is unchanged
+        stat = os.stat(pdf_path)
+        file_key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime)
+        if file_key not in self._document_ids:
+            self._document_ids[file_key] = file_hash(pdf_path)
+        return self._document_ids[file_key]
+
+    def make_key(self, document_id, page_num, box, dpi, mode, engine_id):
+        # Round the region so float noise from canvas scaling doesn't cause misses
+        region = [round(v, 1) for v in box]
+        data = json.dumps([document_id, page_num, region, dpi, mode, engine_id])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT text FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            # Hits only write their last-used time now and then, so reading never holds a lock
+            self._touched[key] = time.time()
+            if len(self._touched) >= TOUCH_EVERY:
+                self._write_touched()
+            return row[0]
+
+    def put(self, key, text):
+        size = len(key) + len(text.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, text, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, text, size, time.time()),
+            )
+            self._db.commit()
+
+    def evict(self):
+        # Drop least recently used results until the cache fits in max_bytes
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        self._write_touched()
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        stale_keys = []
+        for key, size in self._db.execute("SELECT key, size FROM results ORDER BY last_used"):
+            stale_keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM results WHERE key = ?", stale_keys)
+        self._db.commit()
+
+    def stats_text(self):
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return f"Cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+    def _write_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE results SET last_used = ? WHERE key = ?",
+                                 [(used, key) for key, used in self._touched.items()])
+            self._db.commit()
+            self._touched = {}
@@ -0,0 +1,344 @@
+import os
+import shlex
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from preprocess import make_settings, settings_id
+
+
+# Engine modes: one tesseract call per region crop, or one call per page whose
+# word boxes are then distributed over the regions
+CROP_MODE = "crop"
+PAGE_MODE = "page"
+
+GRID_CELL_SIZE = 256  # Pixel size of the spatial index cells used to look up regions
+WARM_APIS = 4  # Loaded tesserocr engines (one per language / config) kept by each warm worker thread
+TSV_COLUMNS = ["level", "page_num", "block_num", "par_num", "line_num", "word_num",
+               "left", "top", "width", "height", "conf", "text"]
+
+# pytesseract is imported where it is used, not here: it imports pandas, which would add a
+# large share of the startup time of the GUI and the batch CLI before anything is OCR'd
+
+_warm = None  # WarmTesseract of a warm worker process, see _init_worker()
+
+
+def _init_worker(warm=False):
+    # Each worker runs a single tesseract thread; the pool provides the parallelism.
+    # Without this every tesseract process spawns one OpenMP thread per core and they fight.
+    # warm workers keep tesseract loaded between crops when tesserocr is installed.
+    global _warm
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    if warm and _warm is None and WarmTesseract.available():
+        _warm = WarmTesseract()
+
+
+class WarmTesseract:
+    # libtesseract engines kept loaded through tesserocr, so a crop costs only its recognition
+    # instead of starting a tesseract process that reads the language data again. Engines are
+    # created per language and config and kept per thread (they aren't thread-safe); the least
+    # recently used ones beyond WARM_APIS are freed.
+
+    def __init__(self, max_apis=WARM_APIS):
+        self.max_apis = max_apis
+        self._local = threading.local()
+
+    @staticmethod
+    def available():
+        try:
+            import tesserocr  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    @staticmethod
+    def version():
+        import tesserocr
+        return tesserocr.tesseract_version().split()[1]
+
+    def image_to_string(self, image, lang=None, config=""):
+        api = self._api(lang, config)
+        api.SetImage(image)
+        return api.GetUTF8Text()
+
+    def image_to_data(self, image, lang=None, config=""):
+        # Word data in pytesseract's Output.DICT layout
+        api = self._api(lang, config)
+        api.SetImage(image)
+        data = {column: [] for column in TSV_COLUMNS}
+        for line in api.GetTSVText(0).splitlines():
+            values = (line.split("\t") + [""])[:len(TSV_COLUMNS)]
+            for column, value in zip(TSV_COLUMNS, values):
+                data[column].append(value if column == "text" else float(value) if column == "conf" else int(value))
+        return data
+
+    def _api(self, lang, config):
+        import tesserocr
+        apis = getattr(self._local, "apis", None)
+        if apis is None:
+            apis = self._local.apis = OrderedDict()
+        key = (lang, config)
+        if key in apis:
+            apis.move_to_end(key)
+            return apis[key]
+
+        # The options the field types use: --psm, --oem and -c variables
+        psm, oem, variables = tesserocr.PSM.AUTO, tesserocr.OEM.DEFAULT, {}
+        tokens = shlex.split(config)
+        for option, value in zip(tokens[::2], tokens[1::2]):
+            if option == "--psm":
+                psm = int(value)
+            elif option == "--oem":
+                oem = int(value)
+            elif option == "-c":
+                name, _, setting = value.partition("=")
+                variables[name] = setting
+            else:
+                raise ValueError(f"Unsupported tesseract option for the warm engine: {option}")
+        api = tesserocr.PyTessBaseAPI(lang=lang or "eng", psm=psm, oem=oem)
+        for name, setting in variables.items():
+            api.SetVariable(name, setting)
+
+        apis[key] = api
+        while len(apis) > self.max_apis:
+            apis.popitem(last=False)[1].End()
+        return api
+
+
+def _image_to_string(image, lang, config):
+    if _warm is not None:
+        return _warm.image_to_string(image, lang, config)
+    import pytesseract
+    return pytesseract.image_to_string(image, lang=lang, config=config)
+
+
+def _image_to_data(image, lang, config):
+    if _warm is not None:
+        return _warm.image_to_data(image, lang, config)
+    import pytesseract
+    return pytesseract.image_to_data(image, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+
+
+def recognize(images, config="", lang=None):
+    # OCR crops that have already been preprocessed; lang None is tesseract's default language
+    return [_image_to_string(image, lang, config) for image in images]
+
+
+def recognize_timed(images, config="", lang=None):
+    # recognize() plus the time each crop took, measured in the worker so it excludes queueing
+    texts, seconds = [], []
+    for image in images:
+        start = time.perf_counter()
+        texts.append(_image_to_string(image, lang, config))
+        seconds.append(time.perf_counter() - start)
+    return texts, seconds
+
+
+def recognize_scored(images, config="", lang=None):
+    # recognize_timed() with a confidence per crop. The text is rebuilt from tesseract's word
+    # data (one tesseract run, like image_to_string) and the confidence is the mean word
+    # confidence weighted by word length, None when no word was found.
+    texts, confidences, seconds = [], [], []
+    for image in images:
+        start = time.perf_counter()
+        words = read_words(image, config, lang)
+        seconds.append(time.perf_counter() - start)
+        texts.append(words_to_text(words))
+        confidences.append(words_confidence(words))
+    return texts, confidences, seconds
+
+
+def words_confidence(words):
+    # Mean tesseract confidence (0-100) of words, weighted by their length
+    chars = sum(len(word["text"]) for word in words)
+    if not chars:
+        return None
+    return sum(word["conf"] * len(word["text"]) for word in words) / chars
+
+
+def read_words(image, config="", lang=None):
+    # Run tesseract once on a preprocessed image and return its recognized words with their
+    # boxes, reading order and confidence
+    data = _image_to_data(image, lang, config)
+
+    words = []
+    for i, text in enumerate(data["text"]):
+        if not text.strip() or float(data["conf"][i]) < 0:
+            continue
+        words.append({
+            "text": text,
+            "box": (data["left"][i], data["top"][i], data["left"][i] + data["width"][i], data["top"][i] + data["height"][i]),
+            "line": (data["block_num"][i], data["par_num"][i], data["line_num"][i]),
+            "order": i,
+            "conf": float(data["conf"][i]),
+        })
+    return words
+
+
+class RegionIndex:
+    # Uniform grid over the page so each word is only tested against the regions
+    # that overlap its grid cell, instead of against every region
+
+    def __init__(self, pixel_regions, cell_size=GRID_CELL_SIZE):
+        self.regions = pixel_regions
+        self.cell_size = cell_size
+        self.cells = {}
+        for region_index, (x0, y0, x1, y1) in enumerate(pixel_regions):
+            for cx in range(int(x0) // cell_size, int(x1) // cell_size + 1):
+                for cy in range(int(y0) // cell_size, int(y1) // cell_size + 1):
+                    self.cells.setdefault((cx, cy), []).append(region_index)
+
+    def regions_at(self, x, y):
+        # Indexes of the regions containing the point
+        candidates = self.cells.get((int(x) // self.cell_size, int(y) // self.cell_size), ())
+        return [
+            i for i in candidates
+            if self.regions[i][0] <= x < self.regions[i][2] and self.regions[i][1] <= y < self.regions[i][3]
+        ]
+
+
+def words_to_text(words):
+    # Rebuild text from words in tesseract's reading order: spaces within a line,
+    # a newline between lines and a blank line between paragraphs
+    text = ""
+    previous_line = None
+    for word in sorted(words, key=lambda w: w["order"]):
+        if previous_line is None:
+            pass
+        elif word["line"] == previous_line:
+            text += " "
+        elif word["line"][:2] == previous_line[:2]:
+            text += "\n"
+        else:
+            text += "\n\n"
+        text += word["text"]
+        previous_line = word["line"]
+    return text
+
+
+def assign_words(words, pixel_regions):
+    # A word belongs to every region that contains its center
+    index = RegionIndex(pixel_regions)
+    region_words = [[] for _ in pixel_regions]
+    for word in words:
+        x0, y0, x1, y1 = word["box"]
+        for region_index in index.regions_at((x0 + x1) / 2, (y0 + y1) / 2):
+            region_words[region_index].append(word)
+    return region_words
+
+
+def recognize_page(image, pixel_regions, config="", scored=False):
+    # Page mode on a page that has already been preprocessed. scored also returns each region's
+    # confidence (see words_confidence).
+    region_words = assign_words(read_words(image, config), pixel_regions)
+    texts = [words_to_text(words) for words in region_words]
+    if scored:
+        return texts, [words_confidence(words) for words in region_words]
+    return texts
+
+
+def engine_name(warm=False):
+    # The tesseract build that reads the text: through tesserocr in warm workers, else the CLI
+    if warm and WarmTesseract.available():
+        return f"tesserocr-{WarmTesseract.version()}"
+    import pytesseract
+    return f"tesseract-{pytesseract.get_tesseract_version()}"
+
+
+def engine_id(config="", preprocessing=None, engine=None):
+    # Everything about the engine that can change the recognized text
+    return f"{engine or engine_name()}|{settings_id(preprocessing)}|{config}"
+
+
+class OCRExecutor:
+    # Fans (page, region) OCR jobs out over a process pool and returns the results
+    # in page/region order, whatever order the workers finish in.
+    # warm keeps tesseract loaded in the workers (see WarmTesseract). With server (the address
+    # of an ocr_server.py, "host:port" or "unix:/path") the OCR runs there instead of in local
+    # processes, and workers is the number of requests kept in flight.
+
+    def __init__(self, workers=None, config="", preprocessing=None, warm=False, server=None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.config = config
+        self.preprocessing = preprocessing or make_settings()
+        self.warm = warm
+        self.server = server
+        self.crops_done = 0  # Regions OCR'd over the executor's lifetime
+        self.elapsed = 0.0  # Wall time spent in extractions
+        self._stats_lock = threading.Lock()  # Several extractions (the job queue's files) share an executor
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._engine_id = None
+        self._client = None
+        if server:
+            from ocr_server import OCRClient
+            self._client = OCRClient(server)
+        elif warm and self.workers == 1:
+            # OCR runs in this process
+            _init_worker(warm=True)
+
+    @property
+    def engine_id(self):
+        if self._engine_id is None:
+            engine = self._client.status()["engine"] if self._client else engine_name(self.warm)
+            self._engine_id = engine_id(self.config, self.preprocessing, engine)
+        return self._engine_id
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        if self._client is not None:
+            self._client.close()
+
+    @property
+    def crops_per_second(self):
+        return self.crops_done / self.elapsed if self.elapsed else 0.0
+
+    def add_stats(self, crops, elapsed):
+        with self._stats_lock:
+            self.crops_done += crops
+            self.elapsed += elapsed
+
+    def recognize_timed(self, images, config="", lang=None):
+        # OCR a batch of preprocessed crops on the pool and wait for the texts and each crop's
+        # tesseract time. Safe to call from several threads at once, which is how the pipeline
+        # keeps every worker busy. config is added to the executor's own (a field type's PSM and
+        # whitelist), lang picks the language.
+        return self._call(recognize_timed, images, f"{self.config} {config}".strip(), lang)
+
+    def recognize_scored(self, images, config="", lang=None):
+        # Like recognize_timed(), also returning each crop's confidence: (texts, confidences, seconds)
+        return self._call(recognize_scored, images, f"{self.config} {config}".strip(), lang)
+
+    def recognize_page(self, image, pixel_regions, scored=False):
+        # Page mode for a preprocessed page, like recognize_timed(); scored adds the regions' confidences
+        return self._call(recognize_page, image, pixel_regions, self.config, scored)
+
+    def call(self, func, *args):
+        # Run one of this module's OCR functions on the pool and wait for its result (ocr_server's entry)
+        return self._call(func, *args)
+
+    def _call(self, func, *args):
+        if self._client is not None:
+            return self._client.call(func.__name__, *args)
+        if self.workers == 1:
+            return func(*args)
+        return self._get_pool().submit(func, *args).result()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                if self._client is not None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     initargs=(self.warm,))
+            return self._pool
@@ -0,0 +1,252 @@
+import argparse
+import http.client
+import io
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ocr_engine import OCRExecutor, engine_name, recognize, recognize_page, recognize_scored, recognize_timed
+
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+REQUEST_TIMEOUT = 600  # Seconds a client waits for one batch; a page of a large table can take a while
+PNG_COMPRESSION = 1  # Crops are binarized, so even the fastest PNG level makes them small
+
+# The engine functions a client can run; their images travel as PNG, everything else as JSON
+FUNCTIONS = {func.__name__: func for func in (recognize, recognize_timed, recognize_scored, recognize_page)}
+
+
+def encode_request(name, args):
+    # Body of a call: a 4-byte header length, the JSON header (function, arguments with images
+    # replaced by {"__image__": n}, PNG sizes) and the PNGs one after another
+    from PIL import Image
+    pngs = []
+
+    def encode(value):
+        if isinstance(value, Image.Image):
+            buffer = io.BytesIO()
+            value.save(buffer, format="PNG", compress_level=PNG_COMPRESSION)
+            pngs.append(buffer.getvalue())
+            return {"__image__": len(pngs) - 1}
+        if isinstance(value, (list, tuple)):
+            return [encode(item) for item in value]
+        if isinstance(value, dict):
+            return {key: encode(item) for key, item in value.items()}
+        return value
+
+    header = json.dumps({"func": name, "args": encode(list(args)), "images": [len(png) for png in pngs]}).encode()
+    return struct.pack(">I", len(header)) + header + b"".join(pngs)
+
+
+def decode_request(body):
+    from PIL import Image
+    (size,) = struct.unpack(">I", body[:4])
+    header = json.loads(body[4:4 + size])
+    images = []
+    offset = 4 + size
+    for length in header["images"]:
+        image = Image.open(io.BytesIO(body[offset:offset + length]))
+        image.load()
+        images.append(image)
+        offset += length
+
+    def decode(value):
+        if isinstance(value, list):
+            return [decode(item) for item in value]
+        if isinstance(value, dict):
+            return images[value["__image__"]] if "__image__" in value else {key: decode(item) for key, item in value.items()}
+        return value
+
+    return header["func"], decode(header["args"]), len(images)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class OCRRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so a client's pooled connections carry many batches each
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path != "/status":
+            return self._reply(404, {"error": f"Unknown path {self.path}"})
+        self._reply(200, self.server.ocr.status())
+
+    def do_POST(self):
+        if self.path != "/call":
+            return self._reply(404, {"error": f"Unknown path {self.path}"})
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            name, args, crops = decode_request(body)
+            if name not in FUNCTIONS:
+                raise ValueError(f"Unknown function {name}")
+            result = self.server.ocr.call(FUNCTIONS[name], args, crops)
+        except Exception as e:
+            return self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+        self._reply(200, {"result": result})
+
+    def _reply(self, code, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Unix socket clients have no address; requests are counted in status() instead
+        pass
+
+
+class OCRServer:
+    # Long-lived local OCR service: an OCRExecutor whose worker processes stay up between
+    # batches, with tesseract kept loaded through tesserocr when it is installed (see
+    # WarmTesseract), so a crop costs only its recognition. Listens on "host:port" or
+    # "unix:/path" and serves any number of GUI, batch CLI and job queue instances, which then
+    # share this machine's cores through one pool.
+
+    def __init__(self, address=DEFAULT_ADDRESS, workers=None, warm=True):
+        self.address = address
+        self.executor = OCRExecutor(workers=workers, warm=warm)
+        self.engine = engine_name(warm)
+        self.requests = 0
+        self.crops = 0
+        self.busy = 0.0  # Seconds spent in calls, summed over concurrent requests
+        self._lock = threading.Lock()
+
+        if address.startswith("unix:"):
+            path = address[len("unix:"):]
+            if os.path.exists(path):
+                os.remove(path)  # Left behind by a server that didn't shut down cleanly
+            self.httpd = ThreadingUnixHTTPServer(path, OCRRequestHandler)
+        else:
+            host, _, port = address.rpartition(":")
+            self.httpd = ThreadingHTTPServer((host or "127.0.0.1", int(port)), OCRRequestHandler)
+        self.httpd.ocr = self
+
+    def call(self, func, args, crops):
+        start = time.perf_counter()
+        result = self.executor.call(func, *args)
+        with self._lock:
+            self.requests += 1
+            self.crops += crops
+            self.busy += time.perf_counter() - start
+        return result
+
+    def status(self):
+        with self._lock:
+            return {"engine": self.engine, "workers": self.executor.workers, "requests": self.requests,
+                    "crops": self.crops, "busy_seconds": round(self.busy, 3)}
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.executor.close()
+        if self.address.startswith("unix:") and os.path.exists(self.address[len("unix:"):]):
+            os.remove(self.address[len("unix:"):])
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=REQUEST_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class OCRClient:
+    # Calls an OCRServer over a pool of keep-alive connections; safe to use from several
+    # threads, each request takes an idle connection or opens one
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=REQUEST_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.address.startswith("unix:"):
+            return UnixHTTPConnection(self.address[len("unix:"):], self.timeout)
+        address = self.address.split("://", 1)[-1]
+        host, _, port = address.rpartition(":")
+        return http.client.HTTPConnection(host or "127.0.0.1", int(port), timeout=self.timeout)
+
+    def _request(self, method, path, body=None):
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        for attempt in range(2):
+            reused = connection is not None
+            if connection is None:
+                connection = self._connect()
+            try:
+                connection.request(method, path, body, {"Content-Type": "application/octet-stream"})
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                connection = None
+                # The server closes idle keep-alive connections; a fresh one is tried once
+                if not reused or attempt:
+                    raise
+        with self._lock:
+            self._idle.append(connection)
+
+        payload = json.loads(data)
+        if response.status != 200:
+            raise RuntimeError(f"OCR server {self.address}: {payload.get('error')}")
+        return payload
+
+    def call(self, name, *args):
+        # Run one of FUNCTIONS on the server and return its result (tuples come back as lists)
+        return self._request("POST", "/call", encode_request(name, args))["result"]
+
+    def status(self):
+        # engine, workers and the server's counters
+        return self._request("GET", "/status")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Serve OCR to the GUI and batch_cli.py with warm tesseract workers.")
+    parser.add_argument("--listen", default=DEFAULT_ADDRESS,
+                        help=f"host:port, or unix:/path for a unix socket (default {DEFAULT_ADDRESS})")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="Number of OCR worker processes")
+    parser.add_argument("--no-warm", action="store_true",
+                        help="Run the tesseract command per crop even when tesserocr is installed")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = OCRServer(args.listen, args.workers, warm=not args.no_warm)
+    print(f"Serving OCR on {args.listen} with {server.executor.workers} workers ({server.engine})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
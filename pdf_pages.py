@@ -0,0 +1,284 @@
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+POINTS_PER_INCH = 72.0
+
+# How rasterized pages are held: "gray" (8-bit, a third of RGB and all OCR needs), "mono"
+# (1-bit at a fixed threshold, an eighth of gray) or "rgb". Previews are always in color.
+PAGE_COLOR_MODES = ("gray", "mono", "rgb")
+DEFAULT_MEMORY_BUDGET_MB = 256  # Decoded pages kept in RAM by a LazyPageSource
+
+
+def points_to_pixels(box, dpi):
+    # Convert a page-space box in PDF points to pixel coordinates at the given DPI
+    scale = dpi / POINTS_PER_INCH
+    return tuple(int(round(v * scale)) for v in box)
+
+
+def read_page_sizes(pdf_path, first_page, last_page):
+    # pdfinfo prints one "Page N size: W x H pts" (and "rot") line per page in the range
+    output = subprocess.run(
+        ["pdfinfo", "-f", str(first_page), "-l", str(last_page), pdf_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True, errors="replace",
+    ).stdout
+
+    sizes = {}
+    rotations = {}
+    for line in output.splitlines():
+        match = re.match(r"Page\s+(\d+)\s+size:\s+([\d.]+)\s+x\s+([\d.]+)", line)
+        if match:
+            sizes[int(match.group(1))] = (float(match.group(2)), float(match.group(3)))
+            continue
+        match = re.match(r"Page\s+(\d+)\s+rot:\s+(\d+)", line)
+        if match:
+            rotations[int(match.group(1))] = int(match.group(2)) % 360
+
+    # Rendered pages are rotated, so swap the size of pages turned on their side
+    result = []
+    for page in range(first_page, last_page + 1):
+        width, height = sizes[page]
+        if rotations.get(page) in (90, 270):
+            width, height = height, width
+        result.append((width, height))
+    return result
+
+
+def image_bytes(image):
+    # Memory taken by a decoded image
+    if image.mode == "1":
+        return (image.width + 7) // 8 * image.height
+    return image.width * image.height * len(image.getbands())
+
+
+def to_color_mode(image, color_mode):
+    if color_mode == "mono":
+        return image.convert("L").point(lambda v: 255 if v >= 128 else 0, "1")
+    if color_mode == "gray":
+        return image.convert("L")
+    return image
+
+
+class SpilledPage:
+    # A page image written to a temporary file and memory-mapped back when used, so it costs
+    # disk and page cache instead of process memory, and needn't be rendered again
+
+    def __init__(self, image, directory=None):
+        self.mode = image.mode
+        self.size = image.size
+        with tempfile.NamedTemporaryFile(dir=directory, prefix="page-", suffix=".raw", delete=False) as f:
+            f.write(image.tobytes())
+            self.path = f.name
+
+    def image(self):
+        data = np.memmap(self.path, dtype=np.uint8, mode="r")
+        return Image.frombuffer(self.mode, self.size, data, "raw", self.mode, 0, 1)
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            # Still mapped on Windows; the temp directory is cleaned up eventually
+            pass
+
+
+class LazyPageSource:
+    # Rasterizes PDF pages on demand instead of converting the whole document up front.
+    # Behaves like the list returned by convert_from_path (len, indexing, iteration),
+    # but only keeps a bounded number of decoded pages in memory: at most cache_size pages
+    # and memory_budget_mb of them, stored in color_mode (see PAGE_COLOR_MODES). With spill,
+    # pages pushed out of the budget go to memory-mapped temp files instead of being dropped.
+    # Callers that are done with a page release() it.
+
+    def __init__(self, pdf_path, dpi=300, cache_size=4, chunk_size=4, color_mode="gray",
+                 memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, spill=False, spill_dir=None):
+        if color_mode not in PAGE_COLOR_MODES:
+            raise ValueError(f"Unknown page color mode: {color_mode}")
+        self.pdf_path = pdf_path
+        self.dpi = dpi
+        self.cache_size = max(1, cache_size)
+        self.chunk_size = max(1, chunk_size)
+        self.color_mode = color_mode
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb else None
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self.cached_bytes = 0  # Decoded pages held in RAM now
+        self.peak_bytes = 0  # and at most so far
+
+        # Only the page count is read here, no page is rendered yet. pdf2image is imported on
+        # first use, so the GUI starts without it.
+        from pdf2image import pdfinfo_from_path
+        info = pdfinfo_from_path(pdf_path)
+        self.page_count = int(info["Pages"])
+
+        self._cache = OrderedDict()  # page index -> PIL image, least recently used first
+        self._spilled = {}  # page index -> SpilledPage
+        self._page_sizes = None  # Page sizes in points, read on first use
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.page_count
+
+    def __getitem__(self, page_number):
+        if page_number < 0:
+            page_number += self.page_count
+        if not 0 <= page_number < self.page_count:
+            raise IndexError("page index out of range")
+        return self.get_page(page_number)
+
+    def __iter__(self):
+        # Render pages in small first_page/last_page ranges so a full pass over the
+        # document costs one pdftoppm call per chunk instead of one per page
+        for start in range(0, self.page_count, self.chunk_size):
+            stop = min(start + self.chunk_size, self.page_count)
+            for image in self.get_pages(start, stop):
+                yield image
+
+    def get_page(self, page_number):
+        with self._lock:
+            image = self._cache.get(page_number)
+            if image is not None:
+                self._cache.move_to_end(page_number)
+                return image
+            spilled = self._spilled.get(page_number)
+        if spilled is not None:
+            return spilled.image()
+
+        image = self._render(page_number, page_number)[0]
+        self._remember(page_number, image)
+        return image
+
+    def get_pages(self, start, stop):
+        # Return pages start..stop-1, rendering only the ones that are not cached
+        with self._lock:
+            cached = {n: self._cache[n] for n in range(start, stop) if n in self._cache}
+            spilled = {n: self._spilled[n] for n in range(start, stop) if n in self._spilled and n not in cached}
+        cached.update((n, page.image()) for n, page in spilled.items())
+
+        missing = [n for n in range(start, stop) if n not in cached]
+        if missing:
+            rendered = self._render(missing[0], missing[-1])
+            for offset, image in enumerate(rendered):
+                page_number = missing[0] + offset
+                cached[page_number] = image
+                self._remember(page_number, image)
+
+        return [cached[n] for n in range(start, stop)]
+
+    def set_dpi(self, dpi):
+        # Pages cached at the old resolution are no longer valid
+        if dpi != self.dpi:
+            self.dpi = dpi
+            self.clear()
+
+    def set_storage(self, color_mode=None, memory_budget_mb=None, spill=None):
+        # Change how pages are held; None keeps a setting. Pages already decoded in another
+        # color mode are dropped.
+        if color_mode is not None and color_mode != self.color_mode:
+            if color_mode not in PAGE_COLOR_MODES:
+                raise ValueError(f"Unknown page color mode: {color_mode}")
+            self.color_mode = color_mode
+            self.clear()
+        if memory_budget_mb is not None:
+            self.memory_budget = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb else None
+        if spill is not None:
+            self.spill = spill
+
+    def page_size(self, page_number):
+        # Size of a page in PDF points (1/72 inch), as rendered
+        if self._page_sizes is None:
+            self._page_sizes = read_page_sizes(self.pdf_path, 1, self.page_count)
+        return self._page_sizes[page_number]
+
+    def render_preview(self, page_number, max_width, max_height):
+        # Render a page directly at the resolution that fits the canvas, so the preview
+        # never goes through a full OCR-resolution bitmap. Returns the image and its DPI.
+        width_pt, height_pt = self.page_size(page_number)
+        dpi = min(max_width / width_pt, max_height / height_pt) * POINTS_PER_INCH
+        dpi = max(dpi, 1.0)
+        from pdf2image import convert_from_path
+        image = convert_from_path(self.pdf_path, dpi=dpi, first_page=page_number + 1, last_page=page_number + 1)[0]
+        return image, dpi
+
+    def render_region(self, page_number, box, dpi=None):
+        # Rasterize only the clip box (in PDF points) of a page at the OCR DPI.
+        # pdftoppm crops while rendering, so the rest of the page is never drawn.
+        dpi = dpi or self.dpi
+        x0, y0, x1, y1 = points_to_pixels(box, dpi)
+        command = [
+            "pdftoppm",
+            "-f", str(page_number + 1), "-l", str(page_number + 1),
+            "-r", str(dpi),
+            "-x", str(x0), "-y", str(y0),
+            "-W", str(max(x1 - x0, 1)), "-H", str(max(y1 - y0, 1)),
+            "-png", "-singlefile",
+            self.pdf_path,
+        ]
+        if self.color_mode != "rgb":
+            # pdftoppm renders gray or bilevel directly
+            command[-3:-3] = ["-gray" if self.color_mode == "gray" else "-mono"]
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+        image = Image.open(BytesIO(output))
+        image.load()
+        return image
+
+    def release(self, page_number):
+        # Forget a page that is no longer needed (all its regions are done)
+        with self._lock:
+            image = self._cache.pop(page_number, None)
+            if image is not None:
+                self.cached_bytes -= image_bytes(image)
+            spilled = self._spilled.pop(page_number, None)
+        if spilled is not None:
+            spilled.close()
+
+    def clear(self):
+        # Drop every decoded page, e.g. when another PDF is opened
+        with self._lock:
+            self._cache.clear()
+            self.cached_bytes = 0
+            spilled, self._spilled = list(self._spilled.values()), {}
+        for page in spilled:
+            page.close()
+
+    def _render(self, first, last):
+        # pdf2image page numbers are 1-based and inclusive
+        from pdf2image import convert_from_path
+        images = convert_from_path(self.pdf_path, dpi=self.dpi, first_page=first + 1, last_page=last + 1,
+                                   grayscale=self.color_mode != "rgb")
+        return [to_color_mode(image, self.color_mode) for image in images]
+
+    def _remember(self, page_number, image):
+        with self._lock:
+            old = self._cache.pop(page_number, None)
+            if old is not None:
+                self.cached_bytes -= image_bytes(old)
+            self._cache[page_number] = image
+            self.cached_bytes += image_bytes(image)
+            self.peak_bytes = max(self.peak_bytes, self.cached_bytes)
+
+            # Evict the least recently used pages beyond the page count or the memory budget;
+            # the page just added stays even when it alone is over the budget
+            evicted = []
+            while len(self._cache) > 1 and (len(self._cache) > self.cache_size or
+                                            (self.memory_budget is not None and self.cached_bytes > self.memory_budget)):
+                number, old = self._cache.popitem(last=False)
+                self.cached_bytes -= image_bytes(old)
+                evicted.append((number, old))
+
+        if self.spill:
+            for number, old in evicted:
+                spilled = SpilledPage(old, self.spill_dir)
+                with self._lock:
+                    previous = self._spilled.pop(number, None)
+                    self._spilled[number] = spilled
+                if previous is not None:
+                    previous.close()
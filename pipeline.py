@@ -0,0 +1,156 @@
+import queue
+import threading
+import time
+
+
+QUEUE_SIZE = 4  # Items waiting in front of each stage, per stage thread
+
+_DONE = object()  # End-of-input marker passed down the stages
+
+
+class Stage:
+    # One step of the pipeline: threads taking items from a bounded input queue and passing
+    # func's outputs to the next stage. Keeps the counters used to find the bottleneck.
+
+    def __init__(self, name, func, threads=1, queue_size=None, skip_when_stopped=True):
+        self.name = name
+        self.func = func  # item -> iterable of items for the next stage
+        self.threads = max(1, threads)
+        self.queue = queue.Queue(queue_size or QUEUE_SIZE * self.threads)
+        self.skip_when_stopped = skip_when_stopped  # Drop remaining items after a cancel or error
+
+        self.items = 0
+        self.busy = 0.0  # Seconds spent in func, summed over threads
+        self.max_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+        self._running = self.threads
+        self._lock = threading.Lock()
+
+    def record(self, depth, busy=None):
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+            self._depth_total += depth
+            self._depth_samples += 1
+            if busy is not None:
+                self.items += 1
+                self.busy += busy
+
+    def thread_done(self):
+        # True for the last thread of the stage to finish
+        with self._lock:
+            self._running -= 1
+            return self._running == 0
+
+    def stats(self, elapsed):
+        return {
+            "threads": self.threads,
+            "items": self.items,
+            "busy_seconds": round(self.busy, 3),
+            "utilization": round(self.busy / (elapsed * self.threads), 3) if elapsed else 0.0,
+            "max_queue": self.max_depth,
+            "mean_queue": round(self._depth_total / self._depth_samples, 2) if self._depth_samples else 0.0,
+        }
+
+
+class Pipeline:
+    # Concurrent stages connected by bounded queues. A stage that falls behind fills its input
+    # queue, which blocks the stage feeding it (backpressure), so memory stays bounded by the
+    # queue sizes whatever the document length. The last stage's outputs are discarded.
+
+    def __init__(self, cancel_event=None, profiler=None):
+        self.stages = []
+        self.cancel_event = cancel_event
+        self.profiler = profiler  # ThreadProfiler covering the stage threads, if profiling
+        self.elapsed = 0.0
+        self._error = None
+        self._failed = threading.Event()
+
+    def add_stage(self, name, func, threads=1, queue_size=None, skip_when_stopped=True):
+        self.stages.append(Stage(name, func, threads, queue_size, skip_when_stopped))
+
+    def stopped(self):
+        return self._failed.is_set() or (self.cancel_event is not None and self.cancel_event.is_set())
+
+    def put(self, stage_name, item):
+        # Hand an item straight to a later stage, e.g. a result that needed no OCR
+        stage = next(s for s in self.stages if s.name == stage_name)
+        stage.queue.put(item)
+
+    def run(self, source):
+        # Feed the items of source to the first stage from the calling thread and wait until
+        # every stage has drained. Re-raises the first error raised by a stage.
+        start = time.perf_counter()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            for n in range(stage.threads):
+                thread = threading.Thread(target=self._work, args=(stage, next_stage), name=f"{stage.name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        first = self.stages[0]
+        try:
+            for item in source:
+                if self.stopped():
+                    break
+                first.queue.put(item)
+        finally:
+            for _ in range(first.threads):
+                first.queue.put(_DONE)
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.perf_counter() - start
+
+        if self._error is not None:
+            raise self._error
+
+    def _work(self, stage, next_stage):
+        if self.profiler is not None:
+            with self.profiler.thread():
+                self._work_loop(stage, next_stage)
+        else:
+            self._work_loop(stage, next_stage)
+
+    def _work_loop(self, stage, next_stage):
+        while True:
+            item = stage.queue.get()
+            if item is _DONE:
+                break
+
+            if stage.skip_when_stopped and self.stopped():
+                stage.record(stage.queue.qsize())
+                continue
+
+            begin = time.perf_counter()
+            try:
+                outputs = list(stage.func(item))
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+                self._failed.set()
+                continue
+            stage.record(stage.queue.qsize(), time.perf_counter() - begin)
+
+            if next_stage is not None:
+                for output in outputs:
+                    next_stage.queue.put(output)
+
+        # The last thread out passes the end marker on to every thread of the next stage
+        if stage.thread_done() and next_stage is not None:
+            for _ in range(next_stage.threads):
+                next_stage.queue.put(_DONE)
+
+    def stats(self):
+        return {stage.name: stage.stats(self.elapsed) for stage in self.stages}
+
+    def bottleneck(self):
+        # The busiest stage is the one limiting throughput
+        stats = self.stats()
+        return max(stats, key=lambda name: stats[name]["utilization"]) if stats else None
+
+    def stats_text(self):
+        parts = []
+        for name, stage in self.stats().items():
+            parts.append(f"{name}: {stage['utilization']:.0%} busy, queue max {stage['max_queue']}")
+        return f"Pipeline ({self.bottleneck()} is the bottleneck): " + ", ".join(parts)
@@ -0,0 +1,246 @@
+import json
+
+import numpy as np
+from PIL import Image
+
+from pdf_pages import POINTS_PER_INCH
+
+
+THRESHOLD_METHODS = ("fixed", "otsu", "adaptive")
+DEFAULT_DPI = 300  # Resolution assumed for crops whose DPI isn't given
+
+DEFAULT_SETTINGS = {
+    "threshold": "otsu",  # "fixed" (global level), "otsu" (per crop) or "adaptive" (local mean)
+    "fixed_level": 128,  # Gray level below which a pixel is ink with the fixed threshold
+    "block_size": 31,  # Window of the adaptive threshold, in pixels (odd)
+    "offset": 10,  # Adaptive: how much darker than its surroundings a pixel must be to be ink
+    "min_contrast": 32,  # Crops with a smaller gray range are treated as blank
+    "despeckle": True,  # Remove isolated ink pixels
+    "trim_border": True,  # Cut ruling lines and dark scan borders along the crop edges
+    "deskew": False,  # Straighten slightly rotated text
+    "max_skew": 5.0,  # Largest rotation searched by deskew, in degrees
+    "skip_empty": True,  # Don't OCR crops without enough ink to hold text
+    "ink_contrast": 80,  # Checkboxes and table rules: gray levels below the paper a pixel must be to count as ink
+    "min_ink_blocks": 2,  # Empty: fewer blocks than this hold a stroke's worth of ink
+    "ink_block_pt": 1.0,  # Side of those blocks in points (1/72 inch), about a stroke of 10-12pt text
+    "min_line_pt": 36.0,  # Empty test: ink runs this long (and across most of the crop) are form lines
+}
+
+
+def make_settings(**overrides):
+    # Preprocessing settings with the given overrides; None keeps the default
+    settings = dict(DEFAULT_SETTINGS)
+    for name, value in overrides.items():
+        if name not in settings:
+            raise ValueError(f"Unknown preprocessing setting: {name}")
+        if value is not None:
+            settings[name] = value
+    if settings["threshold"] not in THRESHOLD_METHODS:
+        raise ValueError(f"Unknown threshold method: {settings['threshold']}")
+    return settings
+
+
+def load_settings(stored):
+    # Settings saved by an earlier version (a queued job's): names that no longer exist are
+    # dropped and new ones take their defaults
+    return make_settings(**{name: value for name, value in stored.items() if name in DEFAULT_SETTINGS})
+
+
+def settings_id(settings):
+    # Stable text form of the settings, used in the OCR cache key
+    return json.dumps(settings, sort_keys=True)
+
+
+def to_gray(image):
+    # Read-only view of the grayscale pixels; nothing below writes into it
+    if image.mode != "L":
+        image = image.convert("L")
+    return np.asarray(image)
+
+
+def otsu_levels(stack):
+    # Otsu's threshold for every crop of an (N, H, W) stack at once, from per-crop histograms
+    n = stack.shape[0]
+    offsets = (np.arange(n, dtype=np.int64) * 256)[:, None]
+    hist = np.bincount((stack.reshape(n, -1) + offsets).ravel(), minlength=256 * n).reshape(n, 256).astype(np.float64)
+
+    levels = np.arange(256, dtype=np.float64)
+    weight_dark = np.cumsum(hist, axis=1)
+    weight_light = weight_dark[:, -1:] - weight_dark
+    sum_dark = np.cumsum(hist * levels, axis=1)
+    mean_dark = sum_dark / np.maximum(weight_dark, 1)
+    mean_light = (sum_dark[:, -1:] - sum_dark) / np.maximum(weight_light, 1)
+
+    # Pick the level maximizing the variance between the dark and light classes
+    between = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    return np.argmax(between, axis=1)
+
+
+def local_mean(stack, block_size):
+    # Mean of the block_size x block_size window around every pixel, via an integral image
+    block_size |= 1
+    r = block_size // 2
+    padded = np.pad(stack, ((0, 0), (r + 1, r), (r + 1, r)), mode="edge").astype(np.int64)
+    integral = padded.cumsum(axis=1).cumsum(axis=2)
+    sums = (
+        integral[:, block_size:, block_size:]
+        - integral[:, :-block_size, block_size:]
+        - integral[:, block_size:, :-block_size]
+        + integral[:, :-block_size, :-block_size]
+    )
+    return sums / float(block_size * block_size)
+
+
+def threshold_stack(stack, settings):
+    # Boolean ink mask (True = ink) for an (N, H, W) stack of same-sized grayscale crops
+    method = settings["threshold"]
+    if method == "fixed":
+        ink = stack < settings["fixed_level"]
+    elif method == "otsu":
+        ink = stack <= otsu_levels(stack)[:, None, None]
+    else:
+        ink = stack < local_mean(stack, settings["block_size"]) - settings["offset"]
+
+    # A crop with almost no gray range is blank paper; any threshold would only pick up noise
+    contrast = stack.max(axis=(1, 2)).astype(np.int16) - stack.min(axis=(1, 2))
+    ink[contrast < settings["min_contrast"]] = False
+    return ink
+
+
+def despeckle(ink):
+    # Drop ink pixels with no ink among their 8 neighbours (scanner dust)
+    padded = np.pad(ink, ((0, 0), (1, 1), (1, 1)))
+    h, w = ink.shape[1:]
+    neighbours = np.zeros(ink.shape, dtype=np.uint8)
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            if dy != 1 or dx != 1:
+                neighbours += padded[:, dy:dy + h, dx:dx + w]
+    return ink & (neighbours > 0)
+
+
+def trim_border(ink, max_fraction=0.1, density=0.5):
+    # Cut dense rows/columns along the edges (form lines the rectangle caught, dark scan
+    # margins), looking at most max_fraction into the crop. Returns a view, not a copy.
+    h, w = ink.shape
+    row_density = ink.mean(axis=1)
+    col_density = ink.mean(axis=0)
+
+    top, bottom, left, right = 0, h, 0, w
+    while top < int(h * max_fraction) and row_density[top] > density:
+        top += 1
+    while h - bottom < int(h * max_fraction) and row_density[bottom - 1] > density:
+        bottom -= 1
+    while left < int(w * max_fraction) and col_density[left] > density:
+        left += 1
+    while w - right < int(w * max_fraction) and col_density[right - 1] > density:
+        right -= 1
+    return ink[top:bottom, left:right]
+
+
+def skew_angle(ink, max_skew, step=0.5, max_points=20000):
+    # Angle (degrees) whose row projection of the ink is sharpest, i.e. the text line slope.
+    # All candidate angles are scored together on a sample of the ink pixels.
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 50:
+        return 0.0
+    if len(ys) > max_points:
+        keep = np.linspace(0, len(ys) - 1, max_points).astype(np.int64)
+        ys, xs = ys[keep], xs[keep]
+
+    angles = np.arange(-max_skew, max_skew + step / 2, step)
+    radians = np.deg2rad(angles)
+    rows = np.rint(np.outer(ys, np.cos(radians)) - np.outer(xs, np.sin(radians))).astype(np.int64)
+    rows -= rows.min()
+
+    span = rows.max() + 1
+    offsets = np.arange(len(angles), dtype=np.int64) * span
+    hist = np.bincount((rows + offsets).ravel(), minlength=span * len(angles)).reshape(len(angles), span)
+    scores = (hist.astype(np.float64) ** 2).sum(axis=1)
+
+    # Only rotate when it clearly sharpens the lines; short single lines score about the same at any angle
+    best = np.argmax(scores)
+    if scores[best] < scores[np.argmin(np.abs(angles))] * 1.05:
+        return 0.0
+    return float(angles[best])
+
+
+def empty_crops(stack, settings, dpi=DEFAULT_DPI):
+    # Cheap test for crops with nothing to read, for a whole (N, H, W) grayscale stack at once.
+    # Ink is measured against the crop's own contrast: the dark side of its Otsu split, and at
+    # least min_contrast below its paper (the median, which holds however much ink there is).
+    # Faded text a few dozen levels darker than the paper counts; Otsu's split of blank paper
+    # into lighter and darker noise doesn't. Rows and columns that are mostly ink and at least
+    # min_line_pt long are form lines and don't count. A crop is empty when its ink fills fewer
+    # than min_ink_blocks stroke-sized blocks: scattered specks do, a single "1" or "." doesn't.
+    # The sizes are physical, so the test reads the same at any DPI whatever the crop's size;
+    # the block count stands in for a connected-component count at a fraction of the cost.
+    scale = dpi / POINTS_PER_INCH
+    n, height, width = stack.shape
+    paper = np.median(stack.reshape(n, -1), axis=1)
+    ink = (stack <= otsu_levels(stack)[:, None, None]) & (stack < (paper - settings["min_contrast"])[:, None, None])
+    min_line = settings["min_line_pt"] * scale
+    lines = ink.sum(axis=2) > max(0.6 * width, min_line)
+    ink &= ~lines[:, :, None]
+    lines = ink.sum(axis=1) > max(0.6 * height, min_line)
+    ink &= ~lines[:, None, :]
+
+    size = max(2, int(round(settings["ink_block_pt"] * scale)))
+    # Pad to whole blocks so ink along the bottom and right edges counts
+    pad_h, pad_w = -height % size, -width % size
+    if pad_h or pad_w:
+        ink = np.pad(ink, ((0, 0), (0, pad_h), (0, pad_w)))
+    blocks = ink.reshape(n, (height + pad_h) // size, size, (width + pad_w) // size, size).sum(axis=(2, 4))
+    return (blocks >= size).sum(axis=(1, 2)) < settings["min_ink_blocks"]
+
+
+def to_image(ink):
+    # Black text on white, as tesseract expects
+    return Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), "L")
+
+
+def preprocess_crops(images, settings=None, keep_geometry=False, dpi=DEFAULT_DPI):
+    # Grayscale + threshold + despeckle a batch of crops at once. Crops of the same size (the
+    # same region on different pages) are stacked and processed as one array. keep_geometry
+    # disables trimming and deskewing, for callers that map pixel coordinates back (page mode).
+    # Also tells which crops are empty (see empty_crops), so their OCR can be skipped. Returns
+    # (images, empty flags); with skip_empty off no crop is empty. dpi is the crops'
+    # resolution, or a list with one per crop.
+    settings = settings or DEFAULT_SETTINGS
+    dpis = list(dpi) if isinstance(dpi, (list, tuple)) else [dpi] * len(images)
+    grays = [to_gray(image) for image in images]
+    results = [None] * len(images)
+    empty = [False] * len(images)
+
+    groups = {}
+    for i, gray in enumerate(grays):
+        groups.setdefault((gray.shape, dpis[i]), []).append(i)
+
+    for (_, group_dpi), indexes in groups.items():
+        # A single crop is used as a view; only real batches are copied into a stack
+        if len(indexes) == 1:
+            stack = grays[indexes[0]][None]
+        else:
+            stack = np.stack([grays[i] for i in indexes])
+
+        if settings["skip_empty"]:
+            for k, blank in enumerate(empty_crops(stack, settings, group_dpi)):
+                empty[indexes[k]] = bool(blank)
+
+        ink = threshold_stack(stack, settings)
+        if settings["despeckle"]:
+            ink = despeckle(ink)
+
+        for k, i in enumerate(indexes):
+            crop_ink = ink[k]
+            if not keep_geometry and settings["trim_border"]:
+                crop_ink = trim_border(crop_ink)
+
+            image = to_image(crop_ink)
+            if not keep_geometry and settings["deskew"] and not empty[i]:
+                angle = skew_angle(crop_ink, settings["max_skew"])
+                if abs(angle) >= 0.25:
+                    image = image.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=255)
+            results[i] = image
+
+    return results, empty
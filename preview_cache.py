@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import ImageTk
+
+
+CACHE_SIZE = 16  # Rendered previews kept in memory (about 1.5 MB each at canvas size)
+PHOTO_RADIUS = 2  # PhotoImages are kept for the pages this close to the current one
+PREFETCH_RADIUS = 1  # Pages on each side of the current one rendered in the background
+
+
+class PreviewCache:
+    # Canvas-resolution previews of the pages around the one on screen. Pages are rendered
+    # straight at the canvas size by the page source (no full-DPI bitmap, no resampling),
+    # the neighbouring pages are rendered on a background thread before they are asked for,
+    # and their PhotoImages are built ahead so a page flip is only a canvas update.
+    # PhotoImages belong to Tk and are only created or dropped from the GUI thread.
+
+    def __init__(self, pages, cache_size=CACHE_SIZE, photo_radius=PHOTO_RADIUS, prefetch_radius=PREFETCH_RADIUS):
+        self.pages = pages  # LazyPageSource of the open PDF
+        self.cache_size = max(1, cache_size)
+        self.photo_radius = photo_radius
+        self.prefetch_radius = prefetch_radius
+
+        self._previews = OrderedDict()  # (page, width, height) -> (image, dpi), least recently used first
+        self._pending = {}  # (page, width, height) -> future of a background render
+        self._photos = {}  # (page, width, height) -> PhotoImage
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview")
+
+    def close(self):
+        # Drop queued renders; the one already running finishes in the background
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._previews.clear()
+            self._pending.clear()
+        self._photos.clear()
+
+    def get(self, page_number, width, height):
+        # PhotoImage and DPI of a page fitted to a width x height canvas
+        key = (page_number, width, height)
+        image, dpi = self.preview(page_number, width, height)
+        photo = self._photos.get(key)
+        if photo is None:
+            photo = self._photos[key] = ImageTk.PhotoImage(image)
+        return photo, dpi
+
+    def preview(self, page_number, width, height):
+        # Rendered PIL image and DPI, waiting for a background render of the page if one is running
+        key = (page_number, width, height)
+        with self._lock:
+            cached = self._previews.get(key)
+            if cached is not None:
+                self._previews.move_to_end(key)
+                return cached
+            future = self._pending.get(key)
+
+        if future is not None and not future.cancelled():
+            return future.result()
+        return self._render(key)
+
+    def prefetch(self, page_number, width, height):
+        # Queue background renders of the pages around page_number and forget photos of far pages
+        for offset in range(1, self.prefetch_radius + 1):
+            for neighbour in (page_number + offset, page_number - offset):
+                if 0 <= neighbour < len(self.pages):
+                    self._submit((neighbour, width, height))
+
+        for key in list(self._photos):
+            if abs(key[0] - page_number) > self.photo_radius or key[1:] != (width, height):
+                del self._photos[key]
+
+    def warm(self, page_number, width, height):
+        # Build the PhotoImages of the neighbouring pages whose render has finished. Called from
+        # the GUI thread when idle; returns True while some neighbours are still rendering.
+        waiting = False
+        for offset in range(1, self.prefetch_radius + 1):
+            for neighbour in (page_number + offset, page_number - offset):
+                key = (neighbour, width, height)
+                if not 0 <= neighbour < len(self.pages) or key in self._photos:
+                    continue
+                with self._lock:
+                    cached = self._previews.get(key)
+                if cached is None:
+                    waiting = waiting or key in self._pending
+                    continue
+                self._photos[key] = ImageTk.PhotoImage(cached[0])
+        return waiting
+
+    def _submit(self, key):
+        with self._lock:
+            if key in self._previews or key in self._pending:
+                return
+            try:
+                self._pending[key] = self._executor.submit(self._render, key)
+            except RuntimeError:
+                # The cache was closed (another PDF was opened)
+                pass
+
+    def _render(self, key):
+        page_number, width, height = key
+        try:
+            result = self.pages.render_preview(page_number, width, height)
+        except Exception:
+            with self._lock:
+                self._pending.pop(key, None)
+            raise
+
+        # Store the preview before dropping the pending entry, so a concurrent preview() always finds one
+        with self._lock:
+            self._pending.pop(key, None)
+            self._previews[key] = result
+            self._previews.move_to_end(key)
+            while len(self._previews) > self.cache_size:
+                self._previews.popitem(last=False)
+        return result
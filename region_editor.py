@@ -0,0 +1,155 @@
+FRAME_MS = 16  # Drag updates are applied at most once per frame (~60 per second)
+HANDLE = 6  # Pixels around a region's edges that grab the edge for resizing
+MIN_SIZE = 3  # Smaller rectangles are treated as a click, not a region
+
+BAND_TAG = "rubber_band"
+ITEM_TAG = "region_item"
+
+
+def normalized(rect):
+    x0, y0, x1, y1 = rect
+    return (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+
+class RegionEditor:
+    # The region layer of the page canvas: draws rectangles above the page image and lets the
+    # user draw new ones, move or resize existing ones by dragging their inside or edges, and
+    # delete them with a right click. The page image is never touched. While dragging, one
+    # rubber-band item is moved with coords() and motion events are coalesced to the frame rate,
+    # so slow displays don't fall behind. Rectangles are in canvas pixels; callers keep the
+    # regions themselves and are told about changes through the callbacks:
+    #   on_new(rect), on_change(key, rect), on_delete(key)
+
+    def __init__(self, canvas, on_new, on_change, on_delete, band_color=None, frame_ms=FRAME_MS):
+        self.canvas = canvas
+        self.on_new = on_new
+        self.on_change = on_change
+        self.on_delete = on_delete
+        self.band_color = band_color or (lambda: "red")
+        self.frame_ms = frame_ms
+
+        self._items = []  # (key, rect) of the editable rectangles, in drawing order
+        self._drag = None  # Current drag: mode, key, starting rect, press point, edges
+        self._pointer = None  # Latest pointer position not yet applied
+        self._pending = None  # after() id of the scheduled drag update
+
+        canvas.bind("<ButtonPress-1>", self.press)
+        canvas.bind("<B1-Motion>", self.motion)
+        canvas.bind("<ButtonRelease-1>", self.release)
+        canvas.bind("<ButtonPress-3>", self.delete_at)
+        canvas.bind("<Motion>", self.hover)
+
+    def set_items(self, items):
+        # Replace the drawn rectangles. items are dicts with "rect" and optionally "key" (None
+        # for rectangles that can't be edited), "outline", "dash", "width" and "label".
+        self.canvas.delete(ITEM_TAG)
+        self._items = []
+        for item in items:
+            x0, y0, x1, y1 = item["rect"]
+            color = item.get("outline", "red")
+            self.canvas.create_rectangle(x0, y0, x1, y1, outline=color, dash=item.get("dash", ()),
+                                         width=item.get("width", 1), tags=ITEM_TAG)
+            if item.get("label"):
+                self.canvas.create_text(x0 + 2, y0, text=item["label"], anchor="sw", fill=color, tags=ITEM_TAG)
+            if item.get("key") is not None:
+                self._items.append((item["key"], normalized(item["rect"])))
+        self.canvas.tag_raise(BAND_TAG)
+
+    def hit(self, x, y):
+        # The topmost editable rectangle at the point and the edges grabbed there, or (None, None)
+        for key, (x0, y0, x1, y1) in reversed(self._items):
+            if not (x0 - HANDLE <= x <= x1 + HANDLE and y0 - HANDLE <= y <= y1 + HANDLE):
+                continue
+            edges = set()
+            if abs(x - x0) <= HANDLE:
+                edges.add("left")
+            elif abs(x - x1) <= HANDLE:
+                edges.add("right")
+            if abs(y - y0) <= HANDLE:
+                edges.add("top")
+            elif abs(y - y1) <= HANDLE:
+                edges.add("bottom")
+            if edges or (x0 < x < x1 and y0 < y < y1):
+                return key, edges
+        return None, None
+
+    def hover(self, event):
+        # Cursor showing what a press would do
+        key, edges = self.hit(event.x, event.y)
+        if key is None:
+            cursor = "crosshair"
+        elif not edges:
+            cursor = "fleur"
+        elif edges in ({"left"}, {"right"}):
+            cursor = "sb_h_double_arrow"
+        elif edges in ({"top"}, {"bottom"}):
+            cursor = "sb_v_double_arrow"
+        else:
+            cursor = "sizing"
+        self.canvas.configure(cursor=cursor)
+
+    def press(self, event):
+        key, edges = self.hit(event.x, event.y)
+        if key is None:
+            rect = (event.x, event.y, event.x, event.y)
+            self._drag = {"mode": "new", "key": None, "rect": rect, "start": (event.x, event.y), "edges": set()}
+        else:
+            rect = dict(self._items)[key]
+            mode = "resize" if edges else "move"
+            self._drag = {"mode": mode, "key": key, "rect": rect, "start": (event.x, event.y), "edges": edges}
+
+        # The rubber band is created once per drag and only moved afterwards
+        self.canvas.delete(BAND_TAG)
+        self.canvas.create_rectangle(*rect, outline=self.band_color(), width=2, dash=(3, 2), tags=BAND_TAG)
+
+    def motion(self, event):
+        if self._drag is None:
+            return
+        self._pointer = (event.x, event.y)
+        if self._pending is None:
+            self._pending = self.canvas.after(self.frame_ms, self._apply_motion)
+
+    def _apply_motion(self):
+        self._pending = None
+        if self._drag is not None and self._pointer is not None:
+            self.canvas.coords(BAND_TAG, *self._dragged_rect(*self._pointer))
+            self._pointer = None
+
+    def _dragged_rect(self, x, y):
+        drag = self._drag
+        x0, y0, x1, y1 = drag["rect"]
+        start_x, start_y = drag["start"]
+        if drag["mode"] == "new":
+            return normalized((start_x, start_y, x, y))
+        dx, dy = x - start_x, y - start_y
+        if drag["mode"] == "move":
+            return (x0 + dx, y0 + dy, x1 + dx, y1 + dy)
+        edges = drag["edges"]
+        return normalized((
+            x0 + dx if "left" in edges else x0,
+            y0 + dy if "top" in edges else y0,
+            x1 + dx if "right" in edges else x1,
+            y1 + dy if "bottom" in edges else y1,
+        ))
+
+    def release(self, event):
+        if self._drag is None:
+            return
+        if self._pending is not None:
+            self.canvas.after_cancel(self._pending)
+            self._pending = None
+        self._pointer = None
+
+        rect = self._dragged_rect(event.x, event.y)
+        drag, self._drag = self._drag, None
+        self.canvas.delete(BAND_TAG)
+        if drag["mode"] == "new":
+            if rect[2] - rect[0] >= MIN_SIZE and rect[3] - rect[1] >= MIN_SIZE:
+                self.on_new(rect)
+        elif rect != drag["rect"] and rect[2] - rect[0] >= MIN_SIZE and rect[3] - rect[1] >= MIN_SIZE:
+            self.on_change(drag["key"], rect)
+
+    def delete_at(self, event):
+        key, _ = self.hit(event.x, event.y)
+        if key is not None:
+            self.on_delete(key)
@@ -0,0 +1,246 @@
+import csv
+import json
+import os
+from datetime import date
+
+
+SYNC_EVERY = 10  # Pages written between fsyncs of the output and its progress file
+OUTPUT_FORMATS = (".xlsx", ".csv", ".parquet")
+
+
+def cell_value(value):
+    # Spreadsheet cells hold scalars; regions and other tuples are written as text
+    if isinstance(value, (tuple, list)):
+        return str(tuple(value))
+    return value
+
+
+def encode_value(value):
+    # JSON has no date type; dates are journaled as {"date": "YYYY-MM-DD"} and restored on conversion
+    if isinstance(value, date):
+        return {"date": value.isoformat()}
+    raise TypeError(f"Cannot journal {type(value).__name__} values")
+
+
+def decode_value(obj):
+    return date.fromisoformat(obj["date"]) if set(obj) == {"date"} else obj
+
+
+def load_progress(output_file):
+    # Progress of an interrupted run writing to output_file, or None
+    try:
+        with open(output_file + ".progress.json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_rows(output_file, rows, columns=None):
+    # Write a finished list of row dicts in one go, in the format of the file's extension and
+    # without pandas. Columns default to the rows' keys in first-seen order.
+    if columns is None:
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+    with StreamingSink(output_file, columns, resume=False) as sink:
+        sink.write(rows, len(rows))
+
+
+class StreamingSink:
+    # Appends rows to the output as each page finishes instead of holding them all in memory.
+    # CSV is written in place. Excel and Parquet files are only valid once complete, so their
+    # rows are journaled to a JSON-lines file and converted in one streaming pass on close().
+    # A progress file records how far the output is committed, so a run that crashed can be
+    # resumed: rows after the last committed position are discarded and writing continues.
+
+    def __init__(self, output_file, columns, run_id="", resume=True, sync_every=SYNC_EVERY):
+        self.output_file = output_file
+        self.columns = list(columns)
+        self.run_id = run_id
+        self.sync_every = max(1, sync_every)
+        self.format = os.path.splitext(output_file)[1].lower()
+        if self.format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {self.format or output_file}")
+
+        self.journal_path = output_file if self.format == ".csv" else output_file + ".partial.jsonl"
+        self.progress_path = output_file + ".progress.json"
+        self.position = None  # Where the committed output ends, as given to write()
+        self.rows_written = 0
+        self._writes_since_sync = 0
+
+        progress = load_progress(output_file) if resume else None
+        if progress and progress.get("run_id") == run_id and progress.get("columns") == self.columns \
+                and os.path.exists(self.journal_path):
+            # Continue after the last committed position, dropping rows written after it
+            self.position = progress["position"]
+            self.rows_written = progress["rows"]
+            self._journal = open(self.journal_path, "r+", newline="", encoding="utf-8")
+            self._journal.truncate(progress["offset"])
+            self._journal.seek(progress["offset"])
+        else:
+            self._journal = open(self.journal_path, "w", newline="", encoding="utf-8")
+            if self.format == ".csv":
+                csv.writer(self._journal).writerow(self.columns)
+
+        self._csv = csv.writer(self._journal) if self.format == ".csv" else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        # Stop writing after a failure; the journal and progress file are kept so the run can be resumed
+        if not self._journal.closed:
+            self.sync()
+            self._journal.close()
+
+    def write(self, rows, position):
+        # Append the rows of one finished unit of work (a page) and mark the output committed
+        # up to position, which is stored as-is in the progress file
+        for row in rows:
+            values = [cell_value(row.get(column)) for column in self.columns]
+            if self._csv:
+                self._csv.writerow(values)
+            else:
+                self._journal.write(json.dumps(values, default=encode_value) + "\n")
+        self.rows_written += len(rows)
+        self.position = position
+
+        self._writes_since_sync += 1
+        if self._writes_since_sync >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        # Make the journal durable, then record it as committed
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._writes_since_sync = 0
+
+        progress = {
+            "run_id": self.run_id,
+            "columns": self.columns,
+            "position": self.position,
+            "rows": self.rows_written,
+            "offset": self._journal.tell(),
+        }
+        temp_path = self.progress_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(progress, f)
+        os.replace(temp_path, self.progress_path)
+
+    def close(self, keep_progress=False):
+        # Produce the final output. keep_progress leaves the journal and progress file in place
+        # (e.g. after a cancel) so a later run can still resume.
+        if self._journal.closed:
+            return
+        self.sync()
+        self._journal.close()
+
+        if self.format == ".xlsx":
+            self._write_xlsx()
+        elif self.format == ".parquet":
+            self._write_parquet()
+
+        if not keep_progress:
+            os.remove(self.progress_path)
+            if self.journal_path != self.output_file:
+                os.remove(self.journal_path)
+
+    def _journal_rows(self):
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line, object_hook=decode_value)
+
+    def _write_xlsx(self):
+        from openpyxl import Workbook
+
+        # Write-only workbooks stream rows to disk, so memory stays constant
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(self.columns)
+        for values in self._journal_rows():
+            sheet.append(values)
+        workbook.save(self.output_file)
+
+    def _write_parquet(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Writing Parquet files requires pyarrow (pip install pyarrow)")
+
+        # Convert the journal in chunks so only one row group is held at a time
+        schema = self._parquet_schema(pa)
+        writer = pq.ParquetWriter(self.output_file, schema)
+        chunk = []
+        for values in self._journal_rows():
+            chunk.append(values)
+            if len(chunk) >= 10000:
+                self._write_parquet_chunk(pa, writer, schema, chunk)
+                chunk = []
+        if chunk:
+            self._write_parquet_chunk(pa, writer, schema, chunk)
+        writer.close()
+
+    def _parquet_schema(self, pa):
+        # Every row group needs the same schema, so the column types come from a first pass over
+        # the whole journal: a column holding only numbers, dates or checkbox flags keeps that
+        # type, and one that mixes them (or holds text) is written as text
+        kinds = [set() for _ in self.columns]
+        for values in self._journal_rows():
+            for i, value in enumerate(values):
+                if value is not None:
+                    kinds[i].add(type(value))
+
+        fields = []
+        for column, types in zip(self.columns, kinds):
+            if types == {bool}:
+                fields.append((column, pa.bool_()))
+            elif types == {int}:
+                fields.append((column, pa.int64()))
+            elif types and types <= {int, float}:
+                fields.append((column, pa.float64()))
+            elif types == {date}:
+                fields.append((column, pa.date32()))
+            else:
+                fields.append((column, pa.string()))
+        return pa.schema(fields)
+
+    def _write_parquet_chunk(self, pa, writer, schema, chunk):
+        data = {}
+        for i, field in enumerate(schema):
+            column = [values[i] for values in chunk]
+            if field.type == pa.string():
+                column = [None if value is None else str(value) for value in column]
+            elif field.type == pa.float64():
+                column = [None if value is None else float(value) for value in column]
+            data[field.name] = column
+        writer.write_table(pa.table(data, schema=schema))
+
+
+class PageCommitter:
+    # Results arrive out of order from the workers; pages are written to the sink in page order
+    # as soon as all their regions are in, so the sink's committed position only moves forward
+
+    def __init__(self, sink, region_count, to_rows, start_page=0):
+        self.sink = sink
+        # Regions per page: a number, or a function of the page returning None while the
+        # page's regions are not known yet
+        self.region_count = region_count if callable(region_count) else (lambda page_num: region_count)
+        self.to_rows = to_rows  # Turns one page's results into rows: to_rows(page_num, results)
+        self.next_page = start_page
+        self._pending = {}  # page_num -> results received so far
+
+    def add(self, result):
+        self._pending.setdefault(result[0], []).append(result)
+        self.commit_ready()
+
+    def commit_ready(self):
+        # Write every complete page at the front of the queue, including pages without regions
+        while len(self._pending.get(self.next_page, ())) == self.region_count(self.next_page):
+            page_results = sorted(self._pending.pop(self.next_page, []), key=lambda r: r[1])
+            self.sink.write(self.to_rows(self.next_page, page_results), self.next_page + 1)
+            self.next_page += 1
@@ -0,0 +1,134 @@
+import numpy as np
+
+from ocr_engine import words_to_text
+from pdf_pages import POINTS_PER_INCH
+
+
+LINE_DENSITY = 0.5  # Rows/columns of a table crop at least this much ink are ruling lines
+MIN_RULES = 3  # Fewer rules than this (an outline, a header underline) don't make a grid
+ROW_GAP_PT = 2.0  # Blank height separating text rows of a table without horizontal rules
+COLUMN_GAP_PT = 8.0  # Blank width separating columns without vertical rules; wider than a word space
+MIN_CELL_PT = 4.0  # Narrower spans between rules are double rules, not cells
+
+
+def runs(mask):
+    # (start, stop) of each run of True in a 1-D mask
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()))
+
+
+def spans_between(lines, size, min_size):
+    # Spans between ruling lines (and the crop edges) at least min_size wide
+    bounds = [0] + [v for line in lines for v in line] + [size]
+    spans = [(bounds[k], bounds[k + 1]) for k in range(0, len(bounds), 2)]
+    return [(start, stop) for start, stop in spans if stop - start >= min_size]
+
+
+def spans_from_gaps(profile, min_gap):
+    # Spans of a projection profile's content separated by blank gaps at least min_gap wide.
+    # Each span reaches halfway into the gaps around it, so together they cover the profile.
+    content = runs(profile > 0)
+    if not content:
+        return []
+    merged = [list(content[0])]
+    for start, stop in content[1:]:
+        if start - merged[-1][1] < min_gap:
+            merged[-1][1] = stop
+        else:
+            merged.append([start, stop])
+    bounds = [0] + [(merged[k][1] + merged[k + 1][0]) // 2 for k in range(len(merged) - 1)] + [len(profile)]
+    return [(bounds[k], bounds[k + 1]) for k in range(len(merged))]
+
+
+def detect_grid(image, settings, dpi):
+    # Row and column pixel spans of a table crop, and its text ink (ink without the rules).
+    # Ruled tables are split along their ruling lines; otherwise rows and columns are split at
+    # blank gaps in the row/column projection profiles of the ink.
+    gray = np.asarray(image.convert("L"))
+    ink = gray < np.percentile(gray, 90) - settings["ink_contrast"]
+    height, width = ink.shape
+    scale = dpi / POINTS_PER_INCH
+
+    row_lines = runs(ink.mean(axis=1) >= LINE_DENSITY)
+    col_lines = runs(ink.mean(axis=0) >= LINE_DENSITY)
+    text = ink.copy()
+    for start, stop in row_lines:
+        text[start:stop] = False
+    for start, stop in col_lines:
+        text[:, start:stop] = False
+
+    min_cell = max(1, int(MIN_CELL_PT * scale))
+    if len(row_lines) >= MIN_RULES:
+        rows = spans_between(row_lines, height, min_cell)
+    else:
+        rows = spans_from_gaps(text.sum(axis=1), max(1, int(ROW_GAP_PT * scale)))
+    if len(col_lines) >= MIN_RULES:
+        cols = spans_between(col_lines, width, min_cell)
+    else:
+        cols = spans_from_gaps(text.sum(axis=0), max(1, int(COLUMN_GAP_PT * scale)))
+
+    # Rows and columns without any text (margins, empty ruled rows) are dropped
+    rows = [(start, stop) for start, stop in rows if text[start:stop].any()]
+    cols = [(start, stop) for start, stop in cols if text[:, start:stop].any()]
+    return rows, cols, text
+
+
+def table_cells(image, settings, dpi):
+    # Cells of a table crop that hold text, as (row, column, pixel box), and the grid's
+    # (rows, columns). Cells without ink are left out, so they are never OCR'd.
+    rows, cols, text = detect_grid(image, settings, dpi)
+    cells = []
+    for r, (y0, y1) in enumerate(rows):
+        filled = text[y0:y1].any(axis=0)
+        for c, (x0, x1) in enumerate(cols):
+            if filled[x0:x1].any():
+                cells.append((r, c, (x0, y0, x1, y1)))
+    return cells, (len(rows), len(cols))
+
+
+def encode_table(grid):
+    # A table result as text: cells separated by tabs, rows by newlines. This is what is cached
+    # and written to the sink, like the text of any other region.
+    lines = ["\t".join(" ".join(cell.split()) for cell in row) for row in grid]
+    return "\n".join(line for line in lines if line.strip())
+
+
+def decode_table(text):
+    return [line.split("\t") for line in text.split("\n") if line.strip()]
+
+
+def assemble_table(shape, cell_texts):
+    # Table text from the OCR'd cells, {(row, column): text}; cells not given are empty
+    rows, cols = shape
+    grid = [[""] * cols for _ in range(rows)]
+    for (r, c), text in cell_texts.items():
+        grid[r][c] = text
+    return encode_table(grid)
+
+
+def table_from_words(words, box):
+    # Table text of a born-digital region from its text-layer words (boxes in PDF points),
+    # split with the same gap profiles at one-point resolution
+    if not words:
+        return ""
+    x0, y0, x1, y1 = box
+    row_profile = np.zeros(int(np.ceil(y1 - y0)) + 1)
+    col_profile = np.zeros(int(np.ceil(x1 - x0)) + 1)
+    for word in words:
+        wx0, wy0, wx1, wy1 = word["box"]
+        row_profile[max(0, int(wy0 - y0)):max(0, int(np.ceil(wy1 - y0)))] += 1
+        col_profile[max(0, int(wx0 - x0)):max(0, int(np.ceil(wx1 - x0)))] += 1
+
+    # Any blank point between words separates rows; line boxes don't overlap
+    rows = spans_from_gaps(row_profile, 1)
+    cols = spans_from_gaps(col_profile, COLUMN_GAP_PT)
+    row_starts = np.array([start for start, _ in rows])
+    col_starts = np.array([start for start, _ in cols])
+
+    cell_words = {}
+    for word in words:
+        wx0, wy0, wx1, wy1 = word["box"]
+        r = int(np.searchsorted(row_starts, (wy0 + wy1) / 2 - y0, side="right")) - 1
+        c = int(np.searchsorted(col_starts, (wx0 + wx1) / 2 - x0, side="right")) - 1
+        cell_words.setdefault((max(r, 0), max(c, 0)), []).append(word)
+    return assemble_table((len(rows), len(cols)), {cell: words_to_text(ws) for cell, ws in cell_words.items()})
@@ -0,0 +1,114 @@
+import base64
+import json
+from io import BytesIO
+
+from PIL import Image
+
+from fields import DEFAULT_FIELD_TYPE, FIELD_TYPES
+from layouts import ANCHOR_DPI, PageLayouts, make_layout
+
+
+TEMPLATE_VERSION = 2  # 2 adds layouts (region sets per page range or page class) and anchors
+REGION_OPTIONS = ("lang", "dpi", "date_format", "columns")  # Optional per-region field settings
+
+
+def make_region(box, name=None, index=0, field_type=DEFAULT_FIELD_TYPE, lang=None, dpi=None, date_format=None,
+                columns=None):
+    # A template region: a name for the output, a box in page space (PDF points, origin top-left)
+    # and the field type it is read as, optionally with its own OCR language, DPI, date format and
+    # (for tables) number of sheet columns
+    if field_type not in FIELD_TYPES:
+        raise ValueError(f"Unknown field type: {field_type}")
+    x0, y0, x1, y1 = (float(v) for v in box)
+    region = {"name": name or f"Region {index + 1}", "box": (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)),
+              "type": field_type}
+    for key, value in (("lang", lang), ("dpi", dpi), ("date_format", date_format), ("columns", columns)):
+        if value:
+            region[key] = value
+    return region
+
+
+def encode_image(image):
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def decode_image(data):
+    image = Image.open(BytesIO(base64.b64decode(data)))
+    image.load()
+    return image.convert("L")
+
+
+def save_layouts(path, layouts):
+    # Regions are stored in page space rather than canvas pixels, so a template
+    # applies to any PDF with the same layout whatever size the preview was.
+    # Anchor images are embedded, so the template doesn't depend on the PDF it was made from.
+    data = {
+        "version": TEMPLATE_VERSION,
+        "units": "pt",
+        "layouts": [
+            {
+                "name": layout["name"],
+                "pages": layout["pages"],
+                "require_anchor": layout["require_anchor"],
+                "regions": [
+                    dict({"name": region["name"], "box": list(region["box"]), "type": region.get("type", DEFAULT_FIELD_TYPE)},
+                         **{key: region[key] for key in REGION_OPTIONS if key in region})
+                    for region in layout["regions"]
+                ],
+                "anchors": [
+                    {"name": anchor["name"], "box": list(anchor["box"]), "dpi": anchor["dpi"], "image": encode_image(anchor["image"])}
+                    for anchor in layout["anchors"]
+                ],
+            }
+            for layout in layouts.layouts
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def load_regions(entries):
+    regions = []
+    for index, entry in enumerate(entries):
+        if len(entry.get("box", ())) != 4:
+            raise ValueError(f"Invalid region in template: {entry}")
+        # Regions saved before field types were added are plain text
+        regions.append(make_region(
+            entry["box"], entry.get("name"), index, entry.get("type", DEFAULT_FIELD_TYPE),
+            entry.get("lang"), entry.get("dpi"), entry.get("date_format"), entry.get("columns"),
+        ))
+    return regions
+
+
+def load_layouts(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    if data.get("version") not in (1, TEMPLATE_VERSION):
+        raise ValueError(f"Unsupported template version: {data.get('version')}")
+    if data.get("units") != "pt":
+        raise ValueError(f"Unsupported template units: {data.get('units')}")
+
+    if data["version"] == 1:
+        # Version 1 templates hold one set of regions for every page
+        return PageLayouts([make_layout(load_regions(data.get("regions", [])))])
+
+    layouts = []
+    for index, entry in enumerate(data.get("layouts", [])):
+        anchors = []
+        for anchor in entry.get("anchors", []):
+            if len(anchor.get("box", ())) != 4 or "image" not in anchor:
+                raise ValueError(f"Invalid anchor in template: {anchor.get('name')}")
+            anchors.append({
+                "name": anchor.get("name", "Anchor"),
+                "box": tuple(float(v) for v in anchor["box"]),
+                "dpi": anchor.get("dpi", ANCHOR_DPI),
+                "image": decode_image(anchor["image"]),
+            })
+        layouts.append(make_layout(
+            load_regions(entry.get("regions", [])), entry.get("name") or f"Layout {index + 1}",
+            entry.get("pages"), anchors, entry.get("require_anchor", False),
+        ))
+    return PageLayouts(layouts)
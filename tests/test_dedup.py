@@ -0,0 +1,26 @@
+import numpy as np
+
+from dedup import same_ink
+
+
+def glyphs():
+    ink = np.zeros((30, 60), dtype=bool)
+    ink[5:25, 10:13] = True
+    ink[5:8, 20:40] = True
+    return ink
+
+
+def test_same_ink_allows_a_one_pixel_offset():
+    ink = glyphs()
+    assert same_ink(ink, ink.copy())
+    assert same_ink(ink, np.roll(ink, (1, -1), axis=(0, 1)))
+    assert not same_ink(ink, np.roll(ink, 2, axis=1))
+
+
+def test_same_ink_rejects_a_single_differing_pixel():
+    ink = glyphs()
+    other = ink.copy()
+    other[25, 10] = True
+    assert not same_ink(ink, other)
+    other[5, 10] = False
+    assert not same_ink(ink, other)
@@ -0,0 +1,29 @@
+from extraction import ResultLookup
+
+
+class Pages:
+    pdf_path = "doc.pdf"
+    dpi = 300
+    color_mode = "gray"
+
+
+class Executor:
+    engine_id = "tesseract|settings|"
+
+
+class Cache:
+    def document_id(self, pdf_path):
+        return "doc"
+
+    def make_key(self, *parts):
+        return repr(parts)
+
+
+def test_cache_key_changes_with_page_rendering():
+    pages = Pages()
+    box = (10.0, 20.0, 110.0, 40.0)
+    key = ResultLookup(Executor(), pages, "crop", Cache()).key_for(0, 0, box)
+    assert ResultLookup(Executor(), pages, "crop", Cache()).key_for(0, 0, box) == key
+    assert ResultLookup(Executor(), pages, "crop", Cache(), region_only=False).key_for(0, 0, box) != key
+    pages.color_mode = "mono"
+    assert ResultLookup(Executor(), pages, "crop", Cache()).key_for(0, 0, box) != key
@@ -0,0 +1,32 @@
+from datetime import date
+
+import pytest
+
+from fields import parse_date, parse_number
+
+
+@pytest.mark.parametrize("text, value", [
+    ("1,234.56", 1234.56),
+    ("1.234,56", 1234.56),
+    ("(12.00)", -12.0),
+    ("-5", -5),
+    ("5-", -5),
+    ("$ 3", 3),
+    ("3 €", 3),
+    ("42%", 0.42),
+    ("1.234.567", 1234567),
+])
+def test_parse_number(text, value):
+    assert parse_number(text) == pytest.approx(value)
+
+
+@pytest.mark.parametrize("text", ["1 2", "Qty 3 of 12", "ink535", "12abc", "(5", "--5", "", "$"])
+def test_parse_number_rejects_anything_but_one_number(text):
+    assert parse_number(text) is None
+
+
+def test_parse_date():
+    assert parse_date("2024-01-31") == date(2024, 1, 31)
+    assert parse_date("31 / 01 / 2024", "%d/%m/%Y") == date(2024, 1, 31)
+    assert parse_date("01/31/2024", "%d/%m/%Y") is None
+    assert parse_date("Total") is None
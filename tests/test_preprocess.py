@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from preprocess import empty_crops, make_settings
+
+PAPER = 235
+
+
+def crop(ink=None, noise=0, seed=0):
+    # A 12pt text line at 300 DPI: 4 px strokes, 35 px tall, drawn at gray level ink
+    rng = np.random.default_rng(seed)
+    image = np.full((60, 400), PAPER, dtype=np.int16) + rng.integers(-noise, noise + 1, (60, 400))
+    if ink is not None:
+        for x in range(20, 380, 30):
+            image[12:47, x:x + 4] = ink
+            image[12:16, x:x + 16] = ink
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def test_blank_crops_are_empty():
+    stack = np.stack([crop(), crop(noise=6)])
+    assert empty_crops(stack, make_settings(), 300).tolist() == [True, True]
+
+
+@pytest.mark.parametrize("ink", [0, 120, 170, 180])
+def test_text_is_not_empty(ink):
+    assert not empty_crops(crop(ink, noise=6)[None], make_settings(), 300)[0]
+
+
+def test_form_line_alone_is_empty():
+    image = crop()
+    image[50:53, :] = 0
+    assert empty_crops(image[None], make_settings(), 300)[0]
@@ -0,0 +1,100 @@
+import csv
+from datetime import date
+
+import pytest
+
+from sinks import PageCommitter, StreamingSink, load_progress
+
+COLUMNS = ["Page", "Extracted Data"]
+
+
+def rows(page):
+    return [{"Page": page, "Extracted Data": f"value {page}"}]
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_interrupted_sink_resumes_after_committed_page(tmp_path):
+    output = str(tmp_path / "out.csv")
+    sink = StreamingSink(output, COLUMNS, "run", sync_every=1)
+    sink.write(rows(1), 1)
+    sink.write(rows(2), 2)
+    sink._journal.write("3,uncommitted\n")  # Written after the last sync, then the run stopped
+    sink._journal.close()
+    assert load_progress(output)["position"] == 2
+
+    with StreamingSink(output, COLUMNS, "run") as sink:
+        assert sink.position == 2
+        assert sink.rows_written == 2
+        sink.write(rows(3), 3)
+    assert read_csv(output) == [COLUMNS, ["1", "value 1"], ["2", "value 2"], ["3", "value 3"]]
+    assert load_progress(output) is None
+
+
+def test_other_run_starts_over(tmp_path):
+    output = str(tmp_path / "out.csv")
+    sink = StreamingSink(output, COLUMNS, "run", sync_every=1)
+    sink.write(rows(1), 1)
+    sink.abort()
+
+    with StreamingSink(output, COLUMNS, "other run") as sink:
+        assert sink.position is None
+        sink.write(rows(5), 1)
+    assert read_csv(output) == [COLUMNS, ["5", "value 5"]]
+
+
+def test_journaled_format_resumes(tmp_path):
+    output = str(tmp_path / "out.parquet")
+    sink = StreamingSink(output, COLUMNS, "run", sync_every=1)
+    sink.write(rows(1), 1)
+    sink.abort()
+
+    sink = StreamingSink(output, COLUMNS, "run")
+    assert sink.position == 1
+    sink.write(rows(2), 2)
+    sink.sync()
+    assert list(sink._journal_rows()) == [[1, "value 1"], [2, "value 2"]]
+    sink.abort()
+
+
+class ListSink:
+    def __init__(self):
+        self.writes = []
+
+    def write(self, rows, position):
+        self.writes.append((rows, position))
+
+
+def test_page_committer_writes_pages_in_order():
+    sink = ListSink()
+    committer = PageCommitter(sink, 2, lambda page_num, results: [text for _, _, text in results])
+    committer.add((1, 0, "b0"))
+    committer.add((0, 1, "a1"))
+    committer.add((1, 1, "b1"))
+    assert sink.writes == []
+    committer.add((0, 0, "a0"))
+    assert sink.writes == [(["a0", "a1"], 1), (["b0", "b1"], 2)]
+
+
+def test_page_committer_passes_pages_without_regions():
+    sink = ListSink()
+    counts = {0: 1, 1: 0, 2: 1}
+    committer = PageCommitter(sink, lambda page_num: counts.get(page_num), lambda page_num, results: results, 0)
+    committer.add((2, 0, "c"))
+    committer.add((0, 0, "a"))
+    assert [position for _, position in sink.writes] == [1, 2, 3]
+
+
+def test_parquet_keeps_value_types(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    output = str(tmp_path / "out.parquet")
+    columns = ["Page", "Amount", "Due", "Paid", "Mixed"]
+    with StreamingSink(output, columns) as sink:
+        sink.write([{"Page": 1, "Amount": 3, "Due": date(2024, 1, 31), "Paid": True, "Mixed": 7}], 1)
+        sink.write([{"Page": 2, "Amount": 2.5, "Due": None, "Paid": False, "Mixed": "seven"}], 2)
+    table = pq.read_table(output)
+    assert [str(field.type) for field in table.schema] == ["int64", "double", "date32[day]", "bool", "string"]
+    assert table.column("Mixed").to_pylist() == ["7", "seven"]
@@ -0,0 +1,38 @@
+import numpy as np
+from PIL import Image
+
+from preprocess import make_settings
+from tables import table_cells
+
+
+def ruled_table(filled):
+    # 3 columns x 4 rows of 100 x 40 px cells with 2 px rules; filled cells get a text-sized mark
+    image = np.full((162, 302), 255, dtype=np.uint8)
+    for y in range(0, 162, 40):
+        image[y:y + 2] = 0
+    for x in range(0, 302, 100):
+        image[:, x:x + 2] = 0
+    for row, column in filled:
+        image[row * 40 + 12:row * 40 + 30, column * 100 + 20:column * 100 + 60] = 0
+    return Image.fromarray(image)
+
+
+def test_ruled_table_cells():
+    cells, shape = table_cells(ruled_table([(0, 0), (0, 2), (1, 1), (3, 0)]), make_settings(), 300)
+    # The empty third row is dropped, and empty cells aren't returned
+    assert shape == (3, 3)
+    assert [(row, column) for row, column, _ in cells] == [(0, 0), (0, 2), (1, 1), (2, 0)]
+    x0, y0, x1, y1 = cells[0][2]
+    assert x0 <= 20 and y0 <= 12 and x1 >= 60 and y1 >= 30
+
+
+def test_unruled_table_is_split_at_gaps():
+    # Two rows of two words each: strokes 3 px wide, far apart between the words
+    image = np.full((120, 300), 255, dtype=np.uint8)
+    for top, offset in ((10, 0), (70, 5)):
+        for left in (10, 180):
+            for x in range(left + offset, left + 80, 10):
+                image[top:top + 30, x:x + 3] = 0
+    cells, shape = table_cells(Image.fromarray(image), make_settings(), 300)
+    assert shape == (2, 2)
+    assert len(cells) == 4
@@ -0,0 +1,82 @@
+import subprocess
+import xml.etree.ElementTree as ET
+
+from ocr_engine import words_to_text
+
+
+CHUNK_PAGES = 50  # Pages read per pdftotext call
+
+
+def _local_name(element):
+    # pdftotext writes XHTML, so every tag carries the XHTML namespace
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def read_words(pdf_path, first_page, last_page):
+    # Words of the embedded text layer with their boxes in PDF points (origin top-left),
+    # using poppler's pdftotext like pdf2image uses pdftoppm
+    output = subprocess.run(
+        ["pdftotext", "-bbox-layout", "-f", str(first_page), "-l", str(last_page), pdf_path, "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+    ).stdout
+    root = ET.fromstring(output)
+
+    pages = []
+    for page in root.iter():
+        if _local_name(page) != "page":
+            continue
+
+        words = []
+        for block_num, block in enumerate(e for e in page.iter() if _local_name(e) == "block"):
+            for line_num, line in enumerate(e for e in block.iter() if _local_name(e) == "line"):
+                for word in (e for e in line if _local_name(e) == "word"):
+                    if not (word.text or "").strip():
+                        continue
+                    words.append({
+                        "text": word.text.strip(),
+                        "box": tuple(float(word.get(k)) for k in ("xMin", "yMin", "xMax", "yMax")),
+                        "line": (block_num, 0, line_num),
+                        "order": len(words),
+                    })
+        pages.append(words)
+    return pages
+
+
+class TextLayer:
+    # Reads region text straight from a born-digital PDF, so only scanned pages need OCR
+
+    def __init__(self, pdf_path, page_count):
+        self.pdf_path = pdf_path
+        self.page_count = page_count
+        self.regions_read = 0  # Regions answered from the text layer instead of OCR
+        self._pages = {}  # page index -> words, loaded a chunk at a time
+
+    def page_words(self, page_num):
+        if page_num not in self._pages:
+            first = page_num - page_num % CHUNK_PAGES
+            last = min(first + CHUNK_PAGES, self.page_count)
+            for offset, words in enumerate(read_words(self.pdf_path, first + 1, last)):
+                self._pages[first + offset] = words
+        return self._pages.get(page_num, [])
+
+    def region_text(self, page_num, box):
+        # Text of the words whose center lies inside the box (in PDF points); "" if none
+        return words_to_text(self.region_words(page_num, box))
+
+    def region_words(self, page_num, box):
+        # The words themselves, with their boxes
+        x0, y0, x1, y1 = box
+        words = []
+        for word in self.page_words(page_num):
+            wx0, wy0, wx1, wy1 = word["box"]
+            cx, cy = (wx0 + wx1) / 2, (wy0 + wy1) / 2
+            if x0 <= cx < x1 and y0 <= cy < y1:
+                words.append(word)
+
+        if words:
+            self.regions_read += 1
+        return words
+
+    def release(self, page_num):
+        # Forget a page's words once its regions are done
+        self._pages.pop(page_num, None)
@@ -1,8 +1,8 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from PIL import Image, ImageTk
-import pandas as pd
-from pdf2image import convert_from_path
+
+from sinks import write_rows
 
 
 class PDFExtractorApp:
@@ -36,7 +36,8 @@ class PDFExtractorApp:
             self.load_pdf(file_path)
 
     def load_pdf(self, pdf_path):
-        # Convert PDF pages to images
+        # Convert PDF pages to images; pdf2image is only imported once a PDF is opened
+        from pdf2image import convert_from_path
         self.images = convert_from_path(pdf_path)
 
         # Display the first page as an image
@@ -137,15 +138,12 @@ class PDFExtractorApp:
             return ""
 
     def export_to_excel(self, extracted_data):
-        # Convert the extracted data to a pandas DataFrame
-        df = pd.DataFrame(extracted_data)
-
         try:
             # Ask the user where to save the Excel file
             output_file = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel Files", "*.xlsx")])
             if output_file:
                 # Save the data to the selected Excel file
-                df.to_excel(output_file, index=False)
+                write_rows(output_file, extracted_data)
                 messagebox.showinfo("Success", "Data exported to Excel successfully.")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to export data to Excel: {str(e)}")
@@ -1,9 +1,26 @@
+import os
+import queue
+import threading
+import time
 import tkinter as tk
-from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
-import pandas as pd
-from pdf2image import convert_from_path
-import pytesseract
+from contextlib import nullcontext
+from tkinter import filedialog, messagebox, ttk
+
+from dedup import CropDeduplicator
+from extraction import MIN_CONFIDENCE, RETRY_DPI, extract_to_sink, row_columns, run_id
+from fields import DEFAULT_FIELD_TYPE, FIELD_TYPES
+from instrumentation import Metrics, ThreadProfiler
+from job_queue import DONE, FAILED, MAX_CONCURRENT_FILES, PENDING, RUNNING, JobQueue, JobRunner
+from layouts import PageLayouts, make_anchor, make_layout, parse_pages
+from ocr_cache import OCRCache
+from ocr_engine import CROP_MODE, PAGE_MODE, OCRExecutor
+from preprocess import THRESHOLD_METHODS, make_settings
+from sinks import OUTPUT_FORMATS, StreamingSink, load_progress
+from pdf_pages import DEFAULT_MEMORY_BUDGET_MB, PAGE_COLOR_MODES, LazyPageSource, POINTS_PER_INCH
+from preview_cache import PreviewCache
+from region_editor import RegionEditor
+from text_layer import TextLayer
+from templates import load_layouts, make_region, save_layouts
 
 
 class PDFExtractorApp:
@@ -25,18 +42,164 @@ class PDFExtractorApp:
         self.extract_button = tk.Button(self.root, text="Extract to Excel", command=self.extract_and_export)
         self.extract_button.pack(pady=10)
 
+        # Save the selected regions as a page-space template (usable by batch_cli.py), or load one
+        self.save_template_button = tk.Button(self.root, text="Save Template", command=self.save_template)
+        self.save_template_button.pack(pady=5)
+        self.load_template_button = tk.Button(self.root, text="Load Template", command=self.load_template)
+        self.load_template_button.pack(pady=5)
+
+        # Queue many PDFs for extraction with the current regions; the queue runs in the background
+        # and is kept on disk, so it carries on after a restart
+        self.queue_button = tk.Button(self.root, text="Job Queue", command=self.open_job_queue)
+        self.queue_button.pack(pady=5)
+
+        # Rectangles drawn while this is checked are anchors: printed labels located on every
+        # page to shift the regions of scans that are slightly off
+        self.draw_anchor = tk.BooleanVar(value=False)
+        self.draw_anchor_check = tk.Checkbutton(self.root, text="Draw anchor", variable=self.draw_anchor)
+        self.draw_anchor_check.pack()
+
+        # Field type of the regions drawn next: sets the OCR segmentation mode, allowed characters
+        # and DPI, and the cell type the value is exported as (checkboxes are read without OCR)
+        self.field_type = tk.StringVar(value=DEFAULT_FIELD_TYPE)
+        self.field_type_label = tk.Label(self.root, text="Field type")
+        self.field_type_label.pack()
+        self.field_type_menu = tk.OptionMenu(self.root, self.field_type, *FIELD_TYPES)
+        self.field_type_menu.pack()
+
+        # Rasterize only the selected rectangles at OCR resolution instead of whole pages
+        self.region_only = tk.BooleanVar(value=True)
+        self.region_only_check = tk.Checkbutton(self.root, text="Rasterize regions only", variable=self.region_only)
+        self.region_only_check.pack()
+
+        # Read regions of born-digital pages from the PDF's text layer and only OCR scanned ones
+        self.use_text_layer = tk.BooleanVar(value=True)
+        self.use_text_layer_check = tk.Checkbutton(self.root, text="Use PDF text layer", variable=self.use_text_layer)
+        self.use_text_layer_check.pack()
+
+        # Reuse OCR results of regions already extracted with the same settings
+        self.use_cache = tk.BooleanVar(value=True)
+        self.use_cache_check = tk.Checkbutton(self.root, text="Use OCR cache", variable=self.use_cache)
+        self.use_cache_check.pack()
+
+        # Crops identical to one already OCR'd in this run (repeated cover or terms pages) reuse its text
+        self.use_dedup = tk.BooleanVar(value=True)
+        self.use_dedup_check = tk.Checkbutton(self.root, text="Reuse OCR of duplicate crops", variable=self.use_dedup)
+        self.use_dedup_check.pack()
+
+        # Run tesseract once per region crop, or once per page and assign its words to the regions
+        self.ocr_mode = tk.StringVar(value=CROP_MODE)
+        self.crop_mode_radio = tk.Radiobutton(self.root, text="OCR each region", variable=self.ocr_mode, value=CROP_MODE)
+        self.crop_mode_radio.pack()
+        self.page_mode_radio = tk.Radiobutton(self.root, text="OCR each page once", variable=self.ocr_mode, value=PAGE_MODE)
+        self.page_mode_radio.pack()
+
+        # Preprocessing: thresholding method and deskew; better binarization allows a lower OCR DPI
+        self.threshold_method = tk.StringVar(value="otsu")
+        self.threshold_label = tk.Label(self.root, text="Threshold")
+        self.threshold_label.pack()
+        self.threshold_menu = tk.OptionMenu(self.root, self.threshold_method, *THRESHOLD_METHODS)
+        self.threshold_menu.pack()
+        self.deskew = tk.BooleanVar(value=False)
+        self.deskew_check = tk.Checkbutton(self.root, text="Deskew", variable=self.deskew)
+        self.deskew_check.pack()
+        self.skip_empty = tk.BooleanVar(value=True)
+        self.skip_empty_check = tk.Checkbutton(self.root, text="Skip empty regions", variable=self.skip_empty)
+        self.skip_empty_check.pack()
+        self.ocr_dpi = tk.IntVar(value=300)
+        self.dpi_label = tk.Label(self.root, text="OCR DPI")
+        self.dpi_label.pack()
+        self.dpi_spinbox = tk.Spinbox(self.root, from_=100, to=600, increment=50, width=5, textvariable=self.ocr_dpi)
+        self.dpi_spinbox.pack()
+
+        # OCR confidence of each value in the output, and a second pass at a higher DPI for
+        # regions read with a confidence below the threshold (0 turns the second pass off)
+        self.record_confidence = tk.BooleanVar(value=False)
+        self.record_confidence_check = tk.Checkbutton(self.root, text="Record OCR confidence", variable=self.record_confidence)
+        self.record_confidence_check.pack()
+        self.retry_below = tk.IntVar(value=0)
+        self.retry_below_label = tk.Label(self.root, text=f"Re-OCR below confidence (0 = off, e.g. {MIN_CONFIDENCE})")
+        self.retry_below_label.pack()
+        self.retry_below_spinbox = tk.Spinbox(self.root, from_=0, to=100, increment=5, width=5, textvariable=self.retry_below)
+        self.retry_below_spinbox.pack()
+        self.retry_dpi = tk.IntVar(value=RETRY_DPI)
+        self.retry_dpi_label = tk.Label(self.root, text="Re-OCR DPI")
+        self.retry_dpi_label.pack()
+        self.retry_dpi_spinbox = tk.Spinbox(self.root, from_=150, to=900, increment=50, width=5, textvariable=self.retry_dpi)
+        self.retry_dpi_spinbox.pack()
+
+        # How rasterized pages are held in memory while they are needed: gray or 1-bit instead of
+        # RGB, within a memory budget, and optionally moved to memory-mapped temp files
+        self.page_colors = tk.StringVar(value="gray")
+        self.page_colors_label = tk.Label(self.root, text="Page storage")
+        self.page_colors_label.pack()
+        self.page_colors_menu = tk.OptionMenu(self.root, self.page_colors, *PAGE_COLOR_MODES)
+        self.page_colors_menu.pack()
+        self.page_memory = tk.IntVar(value=DEFAULT_MEMORY_BUDGET_MB)
+        self.page_memory_label = tk.Label(self.root, text="Page memory (MB)")
+        self.page_memory_label.pack()
+        self.page_memory_spinbox = tk.Spinbox(self.root, from_=32, to=8192, increment=32, width=6, textvariable=self.page_memory)
+        self.page_memory_spinbox.pack()
+        self.spill_pages = tk.BooleanVar(value=False)
+        self.spill_pages_check = tk.Checkbutton(self.root, text="Spill pages to disk", variable=self.spill_pages)
+        self.spill_pages_check.pack()
+
+        # Number of tesseract worker processes used for extraction
+        self.ocr_workers = tk.IntVar(value=os.cpu_count() or 1)
+        self.workers_label = tk.Label(self.root, text="OCR workers")
+        self.workers_label.pack()
+        self.workers_spinbox = tk.Spinbox(self.root, from_=1, to=64, width=5, textvariable=self.ocr_workers)
+        self.workers_spinbox.pack()
+
+        # Address of a running ocr_server.py (host:port or unix:/path); empty OCRs in local processes
+        self.ocr_server = tk.StringVar(value="")
+        self.server_label = tk.Label(self.root, text="OCR server (optional)")
+        self.server_label.pack()
+        self.server_entry = tk.Entry(self.root, textvariable=self.ocr_server, width=24)
+        self.server_entry.pack()
+
+        # Timings, latency histograms and counters of each run as JSON next to the output,
+        # and optionally a cProfile dump of the extraction threads
+        self.write_report = tk.BooleanVar(value=False)
+        self.write_report_check = tk.Checkbutton(self.root, text="Write performance report", variable=self.write_report)
+        self.write_report_check.pack()
+        self.profile_run = tk.BooleanVar(value=False)
+        self.profile_run_check = tk.Checkbutton(self.root, text="Profile (cProfile)", variable=self.profile_run)
+        self.profile_run_check.pack()
+
+        # Extraction progress and cancellation
+        self.progress_bar = ttk.Progressbar(self.root, mode="determinate", length=300)
+        self.progress_bar.pack(pady=5)
+        self.progress_label = tk.Label(self.root, text="")
+        self.progress_label.pack()
+        self.cancel_button = tk.Button(self.root, text="Cancel", command=self.cancel_extraction, state="disabled")
+        self.cancel_button.pack(pady=5)
+
         self.canvas = tk.Canvas(self.root, width=600, height=800)
         self.canvas.pack(fill="both", expand=True)
 
-        self.rectangles = []  # List to store rectangle coordinates
-        self.rectangle_ids = []  # List to store canvas rectangle IDs
-        self.start_x = None
-        self.start_y = None
+        # Regions are drawn, moved, resized (drag inside / drag an edge) and deleted (right click)
+        # on a layer above the page image, so editing never re-renders or redraws the page
+        self.region_editor = RegionEditor(
+            self.canvas, self.add_region, self.change_region, self.delete_region,
+            band_color=lambda: "blue" if self.draw_anchor.get() else "red",
+        )
+
+        # Regions are kept per page in page space (PDF points). A page's regions apply to it and to
+        # the following pages until the next page with regions of its own.
+        self.page_regions = {}  # page index -> list of regions (make_region dicts) drawn on that page
+        self.page_anchors = {}  # page index -> list of anchors drawn on that page
         self.pdf_path = None
-        self.images = None  # To hold images of the PDF pages
+        self.images = None  # Lazy page source for the open PDF
+        self.previews = None  # Canvas-size renders and PhotoImages of the pages around the current one
         self.current_page = 0  # Current page index
-        self.pil_image = None  # Original image
-        self.display_image = None  # Resized image for display
+        self.preview_dpi = None  # DPI the displayed page was rendered at
+        self.extraction_queue = queue.Queue()  # Messages from the extraction thread
+        self.cancel_event = threading.Event()  # Set to stop a running extraction
+        self.extraction_thread = None
+        self.job_queue = JobQueue()
+        self.job_runner = JobRunner(self.job_queue)
+        self.queue_window = None
 
     def open_pdf(self):
         # Open file dialog to select a PDF
@@ -47,8 +210,15 @@ class PDFExtractorApp:
 
     def load_pdf(self, pdf_path):
         try:
-            # Convert PDF pages to images with a higher DPI (e.g., 300)
-            self.images = convert_from_path(pdf_path, dpi=300)
+            # Release the pages of the previously opened PDF
+            if self.images:
+                self.images.clear()
+            if self.previews:
+                self.previews.close()
+
+            # Pages are rasterized at 300 DPI only when they are OCR'd; the preview is rendered at canvas size
+            self.images = LazyPageSource(pdf_path, dpi=300)
+            self.previews = PreviewCache(self.images)
             self.current_page = 0
             self.display_pdf_page(self.current_page)
         except Exception as e:
@@ -58,131 +228,508 @@ class PDFExtractorApp:
         if not self.images:
             return
 
-        # Load the specified page and display as an image
-        self.pil_image = self.images[page_number]  # Store the original image
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
-
-        # Resize the image to fit the canvas while maintaining aspect ratio
-        self.display_image = self.pil_image.copy()
-        self.display_image.thumbnail((canvas_width, canvas_height), Image.Resampling.LANCZOS)
-
-        # Convert the resized PIL image to a Tkinter PhotoImage object
-        self.img_tk = ImageTk.PhotoImage(self.display_image)
+        canvas_width = max(self.canvas.winfo_width(), 1)
+        canvas_height = max(self.canvas.winfo_height(), 1)
 
-        # Clear the canvas before adding the new image
-        self.canvas.delete("all")
+        # Page rendered directly at a resolution that fits the canvas; pages next to the last one
+        # shown were rendered in the background, so this is usually a cache hit
+        self.img_tk, self.preview_dpi = self.previews.get(page_number, canvas_width, canvas_height)
 
-        # Create an image on the canvas
-        self.canvas.create_image(0, 0, anchor="nw", image=self.img_tk)
+        # One page image item, replaced only when the page or the preview changes
+        self.canvas.delete("page_image")
+        self.canvas.create_image(0, 0, anchor="nw", image=self.img_tk, tags="page_image")
+        self.canvas.tag_lower("page_image")
+        self.draw_regions()
 
-        # Redraw rectangles for the current page
-        for rect in self.rectangles:
-            self.rectangle_ids.append(self.canvas.create_rectangle(*rect, outline="red"))
+        # Render the previous and next pages while the user looks at this one
+        self.previews.prefetch(page_number, canvas_width, canvas_height)
+        self.root.after(50, self.warm_previews, page_number, canvas_width, canvas_height)
 
-        # Bind mouse events to select multiple regions
-        self.canvas.bind("<ButtonPress-1>", self.on_button_press)
-        self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
-        self.canvas.bind("<ButtonRelease-1>", self.on_button_release)
-
-    def on_button_press(self, event):
-        # Start the rectangle selection
-        self.start_x = event.x
-        self.start_y = event.y
-
-    def on_mouse_drag(self, event):
-        # Update the rectangle while dragging the mouse
-        if self.rectangle_ids:
-            self.canvas.delete(self.rectangle_ids[-1])  # Remove the last drawn rectangle
-        self.rectangle_ids.append(self.canvas.create_rectangle(self.start_x, self.start_y, event.x, event.y, outline="red"))
+    def warm_previews(self, page_number, canvas_width, canvas_height):
+        # Turn finished background renders into PhotoImages (Tk objects, so on this thread)
+        if self.previews is None or page_number != self.current_page:
+            return
+        if self.previews.warm(page_number, canvas_width, canvas_height):
+            self.root.after(50, self.warm_previews, page_number, canvas_width, canvas_height)
 
-    def on_button_release(self, event):
-        # Store the selected area coordinates
-        coords = (self.start_x, self.start_y, event.x, event.y)
-        self.rectangles.append(coords)  # Store the coordinates
-        print(f"Selected Area: {coords}")
+    def draw_regions(self):
+        # Redraw only the region layer of the current page. Regions that apply to this page are
+        # dashed and read-only when they are inherited from an earlier page.
+        if not self.images or self.preview_dpi is None:
+            return
+        items = []
+        layout_page = self.layout_page(self.current_page)
+        own = layout_page == self.current_page
+        for index, region in enumerate(self.page_regions.get(layout_page, [])):
+            label = region["type"] if region["type"] != DEFAULT_FIELD_TYPE else None
+            items.append({"key": ("region", index) if own else None, "rect": self.page_to_canvas(region["box"]),
+                          "dash": () if own else (4, 2), "label": label})
+        for index, anchor in enumerate(self.page_anchors.get(self.current_page, [])):
+            items.append({"key": ("anchor", index), "rect": self.page_to_canvas(anchor["box"]),
+                          "outline": "blue", "width": 2})
+        self.region_editor.set_items(items)
+
+    def add_region(self, rect):
+        # A rectangle drawn on the canvas becomes a region (or anchor) of the current page, in page space
+        if not self.images:
+            return
+        regions = self.page_regions.setdefault(self.current_page, [])
+        region = make_region(self.canvas_to_page(rect), index=len(regions), field_type=self.field_type.get())
+        if self.draw_anchor.get():
+            anchors = self.page_anchors.setdefault(self.current_page, [])
+            try:
+                anchors.append(make_anchor(self.images, self.current_page, region["box"], f"Anchor {len(anchors) + 1}"))
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to capture anchor: {str(e)}")
+        else:
+            regions.append(region)
+        print(f"Selected Area: {rect}")
+        self.draw_regions()
+
+    def change_region(self, key, rect):
+        # A region or anchor was moved or resized; it keeps its name, type and options
+        kind, index = key
+        box = self.canvas_to_page(rect)
+        if kind == "region":
+            regions = self.page_regions[self.current_page]
+            regions[index] = dict(regions[index], box=make_region(box)["box"])
+        else:
+            # The anchor's reference image is captured again at the new position
+            anchors = self.page_anchors[self.current_page]
+            try:
+                anchors[index] = make_anchor(self.images, self.current_page, box, anchors[index]["name"])
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to capture anchor: {str(e)}")
+        self.draw_regions()
+
+    def delete_region(self, key):
+        kind, index = key
+        if kind == "region":
+            del self.page_regions[self.current_page][index]
+        else:
+            del self.page_anchors[self.current_page][index]
+        self.draw_regions()
 
     def prev_page(self):
         if self.images and self.current_page > 0:
             self.current_page -= 1
-            self.rectangles = []  # Clear previous rectangles
-            self.rectangle_ids = []  # Clear canvas rectangle IDs
             self.display_pdf_page(self.current_page)
 
     def next_page(self):
         if self.images and self.current_page < len(self.images) - 1:
             self.current_page += 1
-            self.rectangles = []  # Clear previous rectangles
-            self.rectangle_ids = []  # Clear canvas rectangle IDs
             self.display_pdf_page(self.current_page)
 
-    def extract_and_export(self):
-        if not self.rectangles:
+    def canvas_to_page(self, rect):
+        # Map a canvas rectangle to page space (PDF points), independent of the preview size
+        scale = POINTS_PER_INCH / self.preview_dpi
+        x0, x1 = sorted((rect[0], rect[2]))
+        y0, y1 = sorted((rect[1], rect[3]))
+        return (x0 * scale, y0 * scale, x1 * scale, y1 * scale)
+
+    def page_to_canvas(self, box):
+        # Map a page-space box (PDF points) onto the current preview
+        scale = self.preview_dpi / POINTS_PER_INCH
+        return tuple(v * scale for v in box)
+
+    def layout_page(self, page_number):
+        # The page whose regions apply to page_number: the closest page at or before it with
+        # regions of its own, or the first page with regions for the pages before that
+        starts = sorted(page for page, regions in self.page_regions.items() if regions)
+        if not starts:
+            return None
+        earlier = [page for page in starts if page <= page_number]
+        return earlier[-1] if earlier else starts[0]
+
+    def build_layouts(self):
+        # One layout per page with its own regions, covering the pages up to the next such page
+        starts = sorted(page for page, regions in self.page_regions.items() if regions)
+        layouts = []
+        for k, start in enumerate(starts):
+            first = 1 if k == 0 else start + 1
+            last = starts[k + 1] if k + 1 < len(starts) else None
+            pages = f"{first}-{last}" if last else ("" if k == 0 else f"{first}-")
+            regions = list(self.page_regions[start])
+            anchors = [
+                anchor for page, page_anchors in sorted(self.page_anchors.items())
+                if self.layout_page(page) == start for anchor in page_anchors
+            ]
+            layouts.append(make_layout(regions, f"From page {start + 1}", pages, anchors))
+        return PageLayouts(layouts)
+
+    def save_template(self):
+        if not any(self.page_regions.values()):
             messagebox.showerror("Error", "Please select at least one region!")
             return
 
-        extracted_data = []
+        output_file = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Region Templates", "*.json")])
+        if not output_file:
+            return
 
-        for page_num, image in enumerate(self.images):
-            for rect in self.rectangles:
-                if isinstance(rect, tuple) and len(rect) == 4:
-                    # Scale the rectangle coordinates to match the original image
-                    scale_x = image.width / self.display_image.width
-                    scale_y = image.height / self.display_image.height
-                    x0 = int(rect[0] * scale_x)
-                    y0 = int(rect[1] * scale_y)
-                    x1 = int(rect[2] * scale_x)
-                    y1 = int(rect[3] * scale_y)
+        try:
+            save_layouts(output_file, self.build_layouts())
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save template: {str(e)}")
 
-                    # Crop the image to the selected area
-                    cropped_image = image.crop((x0, y0, x1, y1))
+    def load_template(self):
+        if not self.images:
+            messagebox.showerror("Error", "Please open a PDF first!")
+            return
 
-                    # Convert the cropped image to text using OCR (Tesseract)
-                    text = self.extract_text_from_image(cropped_image)
+        file_path = filedialog.askopenfilename(filetypes=[("Region Templates", "*.json")])
+        if not file_path:
+            return
 
-                    if text:
-                        extracted_data.append({"Page": page_num + 1, "Extracted Data": text.strip(), "Region": (x0, y0, x1, y1)})
-                else:
-                    print(f"Invalid rectangle: {rect}")
+        try:
+            layouts = load_layouts(file_path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load template: {str(e)}")
+            return
 
-        if extracted_data:
-            print("Extracted Text from all pages:")
-            for entry in extracted_data:
-                print(f"Page {entry['Page']} (Region {entry['Region']}):\n{entry['Extracted Data']}\n")
+        # Replace the current selection: each layout's regions go on the first page it applies to.
+        # Layouts told apart by anchors or by scattered page ranges can't be edited here.
+        self.page_regions = {}
+        self.page_anchors = {}
+        skipped = []
+        for layout in layouts.layouts:
+            ranges = parse_pages(layout["pages"])
+            start = ranges[0][0] - 1
+            if layout["require_anchor"] or len(ranges) > 1 or start in self.page_regions:
+                skipped.append(layout["name"])
+                continue
+            self.page_regions[start] = list(layout["regions"])
+            if layout["anchors"]:
+                self.page_anchors[start] = list(layout["anchors"])
+        self.display_pdf_page(self.current_page)
+
+        if skipped:
+            messagebox.showwarning(
+                "Template", f"Layouts not loaded (run them with batch_cli.py instead): {', '.join(skipped)}"
+            )
 
-            # Export the extracted data to Excel
-            self.export_to_excel(extracted_data)
-        else:
-            messagebox.showerror("Error", "No text found in the selected area on any page!")
+    def extract_and_export(self):
+        if not self.images or not any(self.page_regions.values()):
+            messagebox.showerror("Error", "Please select at least one region!")
+            return
 
-    def extract_text_from_image(self, image):
-        try:
-            # Convert the image to grayscale
-            image = image.convert("L")
+        layouts = self.build_layouts()
 
-            # Apply thresholding to improve OCR accuracy
-            image = image.point(lambda x: 0 if x < 128 else 255, "1")
+        # Choose the output first: rows are written to it as each page finishes
+        output_file = filedialog.asksaveasfilename(
+            defaultextension=".xlsx",
+            filetypes=[("Excel Files", "*.xlsx"), ("CSV Files", "*.csv"), ("Parquet Files", "*.parquet")],
+        )
+        if not output_file:
+            return
 
-            # Use Tesseract OCR to extract text from the image
-            text = pytesseract.image_to_string(image)
-            return text
+        self.images.set_dpi(self.ocr_dpi.get())
+        self.images.set_storage(self.page_colors.get(), self.page_memory.get(), self.spill_pages.get())
+        extraction_id = run_id(self.pdf_path, layouts, self.images.dpi)
+
+        # Offer to continue an interrupted extraction of the same PDF and regions into this file
+        start_page = 0
+        progress = load_progress(output_file)
+        if progress and progress.get("run_id") == extraction_id and progress.get("position"):
+            if messagebox.askyesno("Resume", f"An earlier extraction to this file stopped after page {progress['position']}. Resume from there?"):
+                start_page = progress["position"]
+
+        options = dict(
+            self.ocr_options(),
+            output_file=output_file,
+            run_id=extraction_id,
+            resume=start_page > 0,
+            report=self.write_report.get(),
+            profile=self.profile_run.get(),
+        )
+
+        # Regions per page, for the progress display
+        region_counts = [len(self.page_regions[self.layout_page(page)]) for page in range(len(self.images))]
+        self.output_file = output_file
+        self.start_page = start_page
+        self.extraction_pages = len(self.images)
+        self.total_crops = sum(region_counts[start_page:])
+        self.extraction_start = time.perf_counter()
+        self.cancel_event.clear()
+        self.progress_bar.configure(maximum=max(self.total_crops, 1), value=0)
+        self.progress_label.configure(text="Starting extraction...")
+        # The pages and regions being read stay in use until the thread finishes, so no other PDF
+        # or template can be opened meanwhile
+        for button in (self.extract_button, self.open_button, self.load_template_button):
+            button.configure(state="disabled")
+        self.cancel_button.configure(state="normal")
+
+        # Run the OCR pass on a worker thread so the window stays responsive
+        self.extraction_thread = threading.Thread(
+            target=self.run_extraction, args=(self.images, layouts, region_counts, options), daemon=True
+        )
+        self.extraction_thread.start()
+        self.root.after(100, self.poll_extraction)
+
+    def ocr_options(self):
+        # OCR settings chosen in the window, for an extraction or for queued jobs
+        return {
+            "mode": self.ocr_mode.get(),
+            "region_only": self.region_only.get(),
+            "workers": self.ocr_workers.get(),
+            "server": self.ocr_server.get().strip() or None,
+            "preprocessing": make_settings(
+                threshold=self.threshold_method.get(), deskew=self.deskew.get(), skip_empty=self.skip_empty.get()
+            ),
+            "use_cache": self.use_cache.get(),
+            "dedup": self.use_dedup.get(),
+            "use_text_layer": self.use_text_layer.get(),
+            "dpi": self.ocr_dpi.get(),
+            "confidence": self.record_confidence.get(),
+            "retry_below": self.retry_below.get() or None,
+            "retry_dpi": self.retry_dpi.get(),
+            "page_colors": self.page_colors.get(),
+            "page_memory_mb": self.page_memory.get(),
+            "spill_pages": self.spill_pages.get(),
+        }
+
+    def run_extraction(self, pages, layouts, region_counts, options):
+        # Runs on the extraction thread; only talks to the GUI through the queue
+        regions_done = {}  # page_num -> number of regions finished
+        counts = {"crops": 0, "pages": 0}
+
+        def on_result(result):
+            page_num = result[0]
+            regions_done[page_num] = regions_done.get(page_num, 0) + 1
+            counts["crops"] += 1
+            if regions_done[page_num] == region_counts[page_num]:
+                counts["pages"] += 1
+            self.extraction_queue.put(("progress", counts["pages"], counts["crops"]))
+
+        cache = None
+        sink = None
+        dedup = CropDeduplicator() if options["dedup"] else None
+        metrics = Metrics()
+        profiler = ThreadProfiler() if options["profile"] else None
+        try:
+            # The cache is shared by the pipeline threads of this run
+            if options["use_cache"]:
+                cache = OCRCache()
+            text_layer = TextLayer(pages.pdf_path, len(pages)) if options["use_text_layer"] else None
+            sink = StreamingSink(options["output_file"], row_columns(layouts, options["confidence"]), options["run_id"],
+                                 options["resume"])
+
+            # OCR every (page, region) crop across the worker pool; crops are rasterized
+            # while earlier ones are being recognized, and rows are streamed to the output
+            with profiler.thread() if profiler else nullcontext():
+                with OCRExecutor(workers=options["workers"], preprocessing=options["preprocessing"],
+                                 server=options["server"]) as executor:
+                    pipeline = extract_to_sink(
+                        executor, pages, layouts, options["mode"], sink, region_only=options["region_only"],
+                        progress=on_result, cancel_event=self.cancel_event, cache=cache, text_layer=text_layer,
+                        metrics=metrics, profiler=profiler, dedup=dedup, confidence=options["confidence"],
+                        retry_below=options["retry_below"], retry_dpi=options["retry_dpi"],
+                    )
+
+                # After a cancel keep the progress file, so the extraction can be resumed later
+                with metrics.timer("export"):
+                    sink.close(keep_progress=self.cancel_event.is_set())
+
+            stats = [f"Bottleneck: {pipeline.bottleneck()}"]
+            print(pipeline.stats_text())
+            if text_layer:
+                stats.append(f"Text layer: {text_layer.regions_read} regions")
+            if layouts.anchors_found or layouts.anchors_missed:
+                stats.append(f"Anchors: {layouts.anchors_found} found, {layouts.anchors_missed} not found")
+            if metrics.counter("regions_skipped_empty"):
+                stats.append(f"Skipped empty: {metrics.counter('regions_skipped_empty')} regions")
+            if cache:
+                stats.append(cache.stats_text())
+            if dedup and dedup.lookups:
+                stats.append(dedup.stats_text())
+            if metrics.counter("regions_retried"):
+                stats.append(f"Re-OCR: {metrics.counter('regions_improved')} of {metrics.counter('regions_retried')} regions improved")
+
+            if options["report"]:
+                report_file = options["output_file"] + ".report.json"
+                metrics.write_report(
+                    report_file,
+                    pipeline=pipeline.stats(),
+                    cache={"hits": cache.hits, "misses": cache.misses} if cache else None,
+                    dedup={"crops": dedup.lookups, "reused": dedup.reused, "ratio": round(dedup.ratio, 3)} if dedup else None,
+                    text_layer_regions=text_layer.regions_read if text_layer else None,
+                    anchors={"found": layouts.anchors_found, "not_found": layouts.anchors_missed},
+                    settings={key: options[key] for key in ("mode", "region_only", "workers", "server", "preprocessing", "retry_below", "retry_dpi")},
+                    dpi=pages.dpi,
+                    page_memory={"color_mode": pages.color_mode, "peak_mb": round(pages.peak_bytes / (1024 * 1024), 1)},
+                    rows_written=sink.rows_written,
+                )
+                print(f"Performance report written to {report_file}")
+            if profiler:
+                profiler.dump(options["output_file"] + ".prof")
+                print(f"Profile written to {options['output_file']}.prof")
+            self.extraction_queue.put(
+                ("done", counts["crops"], executor.crops_per_second, " | ".join(stats), sink.rows_written, sink.position or 0)
+            )
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to extract text from image: {str(e)}")
-            return ""
+            if sink:
+                # Keep what was committed so far for a resume
+                sink.abort()
+            self.extraction_queue.put(("error", str(e)))
+        finally:
+            if cache:
+                cache.close()
+
+    def poll_extraction(self):
+        # Apply the messages posted by the extraction thread, then check again shortly
+        while True:
+            try:
+                message = self.extraction_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == "progress":
+                self.update_progress(message[1], message[2])
+            elif message[0] == "done":
+                self.finish_extraction(*message[1:])
+                return
+            elif message[0] == "error":
+                self.reset_extraction_controls()
+                messagebox.showerror("Error", f"Failed to extract text from image: {message[1]}")
+                return
+
+        self.root.after(100, self.poll_extraction)
+
+    def update_progress(self, pages_done, crops_done):
+        elapsed = time.perf_counter() - self.extraction_start
+        rate = crops_done / elapsed if elapsed else 0.0
+        eta = (self.total_crops - crops_done) / rate if rate else 0.0
+
+        self.progress_bar.configure(value=crops_done)
+        self.progress_label.configure(
+            text=f"Pages {self.start_page + pages_done}/{self.extraction_pages} | {rate:.1f} crops/s | ETA {eta:.0f}s"
+        )
+
+    def cancel_extraction(self):
+        # Stop starting new crops; the thread returns what has finished so far
+        self.cancel_event.set()
+        self.cancel_button.configure(state="disabled")
+        self.progress_label.configure(text="Cancelling...")
+
+    def reset_extraction_controls(self):
+        for button in (self.extract_button, self.open_button, self.load_template_button):
+            button.configure(state="normal")
+        self.cancel_button.configure(state="disabled")
+
+    def finish_extraction(self, crops_done, crops_per_second, run_stats, rows_written, pages_written):
+        self.reset_extraction_controls()
+        print(f"OCR throughput: {crops_per_second:.1f} crops/s ({crops_done} crops)")
+        if run_stats:
+            print(run_stats)
+
+        if self.cancel_event.is_set():
+            self.progress_label.configure(text=f"Cancelled after {crops_done}/{self.total_crops} crops")
+            messagebox.showinfo(
+                "Cancelled",
+                f"Extraction cancelled. Pages 1-{pages_written} were exported ({rows_written} rows). "
+                "Extract to the same file again to resume.",
+            )
+            return
+
+        summary = f"Done: {crops_done} crops at {crops_per_second:.1f} crops/s"
+        if run_stats:
+            summary += f" | {run_stats}"
+        self.progress_label.configure(text=summary)
 
-    def export_to_excel(self, extracted_data):
-        # Convert the extracted data to a pandas DataFrame
-        df = pd.DataFrame(extracted_data)
+        if rows_written:
+            messagebox.showinfo("Success", f"Data exported to {os.path.basename(self.output_file)} successfully ({rows_written} rows).")
+        else:
+            messagebox.showerror("Error", "No text found in the selected area on any page!")
+
+    def open_job_queue(self):
+        if self.queue_window is not None and self.queue_window.winfo_exists():
+            self.queue_window.lift()
+            return
+
+        self.queue_window = window = tk.Toplevel(self.root)
+        window.title("Job Queue")
+
+        # One row per queued PDF; item ids are the job ids
+        self.queue_tree = ttk.Treeview(window, columns=("file", "status", "pages", "rows"), show="headings", height=15)
+        for column, heading, width in (("file", "File", 300), ("status", "Status", 200), ("pages", "Pages", 80), ("rows", "Rows", 60)):
+            self.queue_tree.heading(column, text=heading)
+            self.queue_tree.column(column, width=width)
+        self.queue_tree.pack(fill="both", expand=True)
+
+        buttons = tk.Frame(window)
+        buttons.pack(pady=5)
+        tk.Button(buttons, text="Add PDFs", command=self.add_queue_jobs).pack(side="left", padx=5)
+        self.queue_format = tk.StringVar(value=".xlsx")
+        tk.OptionMenu(buttons, self.queue_format, *OUTPUT_FORMATS).pack(side="left")
+        tk.Button(buttons, text="Start", command=self.start_job_queue).pack(side="left", padx=5)
+        tk.Button(buttons, text="Pause", command=self.job_runner.stop).pack(side="left", padx=5)
+        tk.Button(buttons, text="Retry failed", command=self.retry_queue_jobs).pack(side="left", padx=5)
+        tk.Button(buttons, text="Remove selected", command=self.remove_queue_jobs).pack(side="left", padx=5)
+
+        # PDFs extracted at the same time; they share the "OCR workers" processes
+        tk.Label(buttons, text="Files at once").pack(side="left")
+        self.queue_files = tk.IntVar(value=MAX_CONCURRENT_FILES)
+        tk.Spinbox(buttons, from_=1, to=8, width=3, textvariable=self.queue_files).pack(side="left")
+
+        self.queue_label = tk.Label(window, text="")
+        self.queue_label.pack(pady=5)
+        self.refresh_job_queue()
+
+    def add_queue_jobs(self):
+        # Queue PDFs with the regions drawn now and the current OCR settings
+        if not any(self.page_regions.values()):
+            messagebox.showerror("Error", "Please select at least one region!", parent=self.queue_window)
+            return
+        pdf_paths = filedialog.askopenfilenames(filetypes=[("PDF Files", "*.pdf")], parent=self.queue_window)
+        if not pdf_paths:
+            return
+        output_dir = filedialog.askdirectory(title="Output folder", parent=self.queue_window)
+        if not output_dir:
+            return
 
         try:
-            # Ask the user where to save the Excel file
-            output_file = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel Files", "*.xlsx")])
-            if output_file:
-                # Save the data to the selected Excel file
-                df.to_excel(output_file, index=False)
-                messagebox.showinfo("Success", "Data exported to Excel successfully.")
+            self.job_queue.add(pdf_paths, self.build_layouts(), output_dir, self.queue_format.get(), self.ocr_options())
         except Exception as e:
-            messagebox.showerror("Error", f"Failed to export data to Excel: {str(e)}")
+            messagebox.showerror("Error", f"Failed to queue the PDFs: {str(e)}", parent=self.queue_window)
+
+    def start_job_queue(self):
+        if not self.job_runner.running:
+            self.job_runner.max_files = max(1, self.queue_files.get())
+            self.job_runner.start()
+
+    def retry_queue_jobs(self):
+        # The selected failed jobs, or all of them when none is selected
+        job_ids = set(self.queue_tree.selection()) or {job["id"] for job in self.job_queue.snapshot()}
+        self.job_queue.retry(job_ids)
+
+    def remove_queue_jobs(self):
+        # Running jobs are kept; pause the queue first to remove them
+        self.job_queue.remove(set(self.queue_tree.selection()))
+
+    def refresh_job_queue(self):
+        # Show the state of the queue, then check again shortly while the window is open
+        if self.queue_window is None or not self.queue_window.winfo_exists():
+            return
+
+        jobs = self.job_queue.snapshot()
+        for job in jobs:
+            status = f"{FAILED}: {job['error']}" if job["status"] == FAILED else job["status"]
+            pages = f"{job['pages_done']}/{job['pages']}" if job["pages"] else ""
+            values = (os.path.basename(job["pdf_path"]), status, pages, job["rows"])
+            if self.queue_tree.exists(job["id"]):
+                self.queue_tree.item(job["id"], values=values)
+            else:
+                self.queue_tree.insert("", "end", iid=job["id"], values=values)
+        job_ids = {job["id"] for job in jobs}
+        for item in self.queue_tree.get_children():
+            if item not in job_ids:
+                self.queue_tree.delete(item)
+
+        counts = {status: sum(job["status"] == status for job in jobs) for status in (PENDING, RUNNING, DONE, FAILED)}
+        summary = ", ".join(f"{n} {status}" for status, n in counts.items() if n) or "No jobs"
+        if self.job_runner.running and self.job_runner.stop_event.is_set():
+            summary += " | Pausing..."
+        self.queue_label.configure(text=summary)
+        self.root.after(500, self.refresh_job_queue)
 
 
 if __name__ == "__main__":